@@ -1 +1,5 @@
+import time
+
 __version__ = "0.0.1"
+# Start of the process, the time to the first decision is reported from here
+started_at = time.monotonic()
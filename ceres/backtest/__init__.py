@@ -0,0 +1,2 @@
+from ceres.backtest.backtesting import Backtesting, format_report
+from ceres.backtest.replayhandler import LatencyModel, ReplayExchangesHandler
@@ -0,0 +1,141 @@
+import logging
+import time
+
+from ceres.backtest.datasource import capture_symbols, read_order_books
+from ceres.backtest.replayhandler import LatencyModel, ReplayExchangesHandler
+from ceres.ceresbot import CeresBot
+
+logger = logging.getLogger(__name__)
+
+
+class Backtesting:
+    """
+    Replays recorded order books through the strategy and CeresBot's
+    decision logic as fast as possible, streaming the input.
+    """
+
+    def __init__(self, config, data_path, latency_model=None) -> None:
+        self.data_path = data_path
+        config = dict(config)
+        config["dry"] = True
+        config["telegram"] = {"enabled": False}
+        config["recorder"] = {"enabled": False}
+        config["journal"] = {"enabled": False}
+        config["order_manager"] = {"enabled": False}
+        config["recovery"] = {"enabled": False}
+        symbols = self._get_symbols(config)
+        self.handler = ReplayExchangesHandler(
+            config, symbols, latency_model or LatencyModel(), on_fill=self._on_fill
+        )
+        self.bot = CeresBot(config, exchangeshandler=self.handler)
+        self.wallets = self.bot.wallets
+        self.currencies = sorted(self.wallets.currencies)
+        self._initial = {currency: self.wallets.get_total_currency(currency) for currency in self.currencies}
+        self._exchanges = set(self.handler.exchanges_list)
+        self._symbols = set(symbols)
+
+    def _get_symbols(self, config):
+        symbols = config.get("symbols", [config.get("symbol")])
+        if symbols == "all":
+            if self.data_path.endswith(".jsonl"):
+                raise Exception("symbols \"all\" needs a binary capture, please list the symbols to replay")
+            symbols = capture_symbols(self.data_path)
+        return symbols
+
+    def _on_fill(self, order, filled, price):
+        exchange = order["exchange"]
+        if filled:
+            fee_cost = filled * price * self.bot.strategy.fees.taker(exchange, order["symbol"])
+            self.wallets.apply_order_fill(exchange, order, filled, price, fee_cost)
+        if order["amount"] - filled > 0:
+            self.wallets.release_order(exchange, order, order["amount"] - filled)
+
+    def start(self):
+        """
+        Run the replay
+        :return: dict with the results
+        """
+        started = time.perf_counter()
+        first_ts, last_ts, records = self.handler.loop.run_until_complete(self._replay())
+        elapsed = time.perf_counter() - started
+        self.handler.close()
+        replayed = (last_ts - first_ts) if records else 0
+        return {
+            "records": records,
+            "replayed_seconds": replayed,
+            "elapsed_seconds": elapsed,
+            "speedup": replayed / elapsed if elapsed else 0,
+            "opportunities": self.bot.total_opportunities,
+            "rejected_opportunities": self.bot.rejected_opportunities,
+            "trades": self.bot.total_trades,
+            "failed_executions": self.bot.failed_executions,
+            "orders_sent": self.handler.orders_sent,
+            "orders_filled": self.handler.orders_filled,
+            "orders_partially_filled": self.handler.orders_partial,
+            "orders_unfilled": self.handler.orders_unfilled,
+            "balance_change": {
+                currency: self.wallets.get_total_currency(currency) - self._initial[currency]
+                for currency in self.currencies
+            },
+            "pnl": self._valued_pnl(),
+        }
+
+    async def _replay(self):
+        first_ts = last_ts = None
+        records = 0
+        for ts, exchange, symbol, ob in read_order_books(self.data_path):
+            if exchange not in self._exchanges or symbol not in self._symbols:
+                continue
+            if first_ts is None:
+                first_ts = ts
+            last_ts = ts
+            records += 1
+            self.handler.advance(ts)
+            self.handler.book_store.update(exchange, symbol, ob, received_at=ts)
+            await self.bot.main_loop()
+        self.handler.finish()
+        return first_ts, last_ts, records
+
+    def _valued_pnl(self):
+        """
+        Balance change of all currencies valued at the last mid price in the
+        common quote currency, None if the symbols do not share one
+        """
+        quotes = {symbol.split("/")[1] for symbol in self._symbols}
+        if len(quotes) != 1:
+            return None
+        quote = quotes.pop()
+        pnl = 0
+        for currency in self.currencies:
+            change = self.wallets.get_total_currency(currency) - self._initial[currency]
+            if currency == quote:
+                pnl += change
+                continue
+            mid = self._last_mid(f"{currency}/{quote}")
+            if mid is None:
+                return None
+            pnl += change * mid
+        return {"currency": quote, "pnl": pnl}
+
+    def _last_mid(self, symbol):
+        for ob in self.handler.book_store.get_books(symbol).values():
+            if ob["bids"] and ob["asks"]:
+                return (ob["bids"][0][0] + ob["asks"][0][0]) / 2
+        return None
+
+
+def format_report(results):
+    lines = [
+        f"Replayed {results['records']} order books covering {results['replayed_seconds']:.1f}s "
+        f"in {results['elapsed_seconds']:.2f}s ({results['speedup']:.0f}x real time)",
+        f"Opportunities: {results['opportunities']} "
+        f"(rejected for profit or balance: {results['rejected_opportunities']})",
+        f"Trades: {results['trades']} Orders: {results['orders_sent']} filled: {results['orders_filled']} "
+        f"partially filled: {results['orders_partially_filled']} missed: {results['orders_unfilled']}",
+        "Balance change: " + ", ".join(
+            f"{change:+.8f} {currency}" for currency, change in results["balance_change"].items()
+        ),
+    ]
+    if results["pnl"]:
+        lines.append(f"PnL: {results['pnl']['pnl']:+.8f} {results['pnl']['currency']}")
+    return "\n".join(lines)
@@ -0,0 +1,60 @@
+import heapq
+import json
+
+import numpy as np
+
+from ceres.data import CaptureReader
+
+
+def read_jsonl(path):
+    """
+    Stream order books from a JSONL file, one order book per line in time order:
+    {"exchange": "binance", "symbol": "BTC/USDT", "timestamp": 1680000000000, "bids": [[p, a], ...], "asks": [...]}
+    An optional "local_timestamp" (ms) is used as the time the bot saw the book.
+    :return: generator of (time in seconds, exchange, symbol, order book)
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            ts = record.get("local_timestamp") or record["timestamp"]
+            ob = {"bids": record["bids"], "asks": record["asks"], "timestamp": record.get("timestamp")}
+            yield ts / 1000, record["exchange"], record["symbol"], ob
+
+
+def _read_capture_stream(reader, exchange, symbol, start=None, end=None):
+    for records in reader.read(exchange, symbol, start, end):
+        local_ts = records["local_ts"]
+        exchange_ts = records["exchange_ts"]
+        bids = records["bids"]
+        asks = records["asks"]
+        for i in range(len(records)):
+            record_bids = bids[i]
+            record_asks = asks[i]
+            ob = {
+                "bids": record_bids[~np.isnan(record_bids[:, 0])].tolist(),
+                "asks": record_asks[~np.isnan(record_asks[:, 0])].tolist(),
+                "timestamp": int(exchange_ts[i]) or None,
+            }
+            yield local_ts[i] / 1e9, exchange, symbol, ob
+
+
+def read_capture(path, start=None, end=None):
+    """
+    Stream order books of all streams of a binary capture merged in time order
+    :return: generator of (time in seconds, exchange, symbol, order book)
+    """
+    reader = CaptureReader(path)
+    streams = [_read_capture_stream(reader, ex, symbol, start, end) for ex, symbol in reader.streams()]
+    return heapq.merge(*streams, key=lambda record: record[0])
+
+
+def capture_symbols(path):
+    return sorted({symbol for _, symbol in CaptureReader(path).streams()})
+
+
+def read_order_books(path):
+    if path.endswith(".jsonl"):
+        return read_jsonl(path)
+    return read_capture(path)
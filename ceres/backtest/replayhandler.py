@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import logging
+import math
+import random
+from itertools import count
+
+from ceres.exchange.bookstore import BookStore
+from ceres.exchange.execution import ExecutionResult, LegResult
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyModel:
+    """One-way latency to an exchange: a base plus uniform jitter, both in milliseconds"""
+
+    def __init__(self, latency_ms=50, jitter_ms=0, per_exchange=None, seed=0) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_exchange = per_exchange or {}
+        self._random = random.Random(seed)
+
+    def sample(self, exchange) -> float:
+        """
+        :return: latency in seconds
+        """
+        latency_ms = self.per_exchange.get(exchange, self.latency_ms)
+        return (latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000
+
+
+class ReplayApi:
+    """The few ccxt api members the strategies use"""
+
+    def __init__(self, name, amount_precision=8) -> None:
+        self.id = name
+        self.name = name
+        self.has = {}
+        self.amount_precision = amount_precision
+
+    def amount_to_precision(self, symbol, amount):
+        factor = 10 ** self.amount_precision
+        return str(math.floor(amount * factor) / factor)
+
+
+class ReplayExchange:
+    def __init__(self, name, amount_precision=8) -> None:
+        self.ex_dict = {"name": name}
+        self.recorder = None
+        self.api = ReplayApi(name, amount_precision)
+
+    @property
+    def name(self):
+        return self.api.id
+
+    def round_amount(self, symbol, amount):
+        return float(self.api.amount_to_precision(symbol, amount))
+
+
+class ReplayExchangesHandler:
+    """
+    Stands in for ExchangesHandler while replaying recorded order books.
+    Orders reach the exchange after a latency drawn from the latency model
+    and are then filled as immediate-or-cancel against the book recorded
+    at that moment. The replay driver moves the clock with advance().
+    """
+
+    def __init__(self, config, symbols, latency_model=None, on_fill=None) -> None:
+        self._config = config
+        backtest_config = self._config.get("backtest", {})
+        self.symbols = list(symbols)
+        self.exchanges_list = [ex.get("name") for ex in self._config.get("exchanges")]
+        self.exchanges = {
+            ex: ReplayExchange(ex, backtest_config.get("amount_precision", 8)) for ex in self.exchanges_list
+        }
+        self.markets = self._build_markets(backtest_config)
+        self.book_store = BookStore()
+        self.recorder = None
+        self.latency_model = latency_model or LatencyModel()
+        self.on_fill = on_fill
+        self._now = 0
+        self.orders_sent = 0
+        self.orders_filled = 0
+        self.orders_partial = 0
+        self.orders_unfilled = 0
+        self._pending = []
+        self._seq = count()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def _build_markets(self, backtest_config):
+        """Markets are not recorded, fees come from the backtest config instead"""
+        taker_fee = backtest_config.get("taker_fee", 0.001)
+        fees = backtest_config.get("fees", {})
+        markets = {}
+        for ex in self.exchanges_list:
+            markets[ex] = {}
+            for symbol in self.symbols:
+                base, quote = symbol.split("/")
+                fee = fees.get(ex, taker_fee)
+                markets[ex][symbol] = {
+                    "symbol": symbol, "base": base, "quote": quote, "taker": fee, "maker": fee, "limits": {},
+                }
+        return markets
+
+    @property
+    def current_exchanges(self):
+        return self.exchanges_list
+
+    def get_markets(self):
+        return self.markets
+
+    def is_healthy(self, ex):
+        return True
+
+    def now(self):
+        """Replay time"""
+        return self._now
+
+    def close(self):
+        if self.loop and not self.loop.is_closed():
+            self.loop.close()
+
+    def start_order_book_streams(self):
+        pass
+
+    async def close_exchanges(self):
+        pass
+
+    async def fetch_balances(self, params=None):
+        return {}
+
+    def get_balances(self, params=None):
+        raise Exception("Backtesting only runs in dry mode")
+
+    async def create_orders(self, orders, decided_at=None):
+        legs = []
+        for order in orders:
+            arrival = self._now + self.latency_model.sample(order["exchange"])
+            heapq.heappush(self._pending, (arrival, next(self._seq), order))
+            self.orders_sent += 1
+            result = dict(order, status="open", filled=0, remaining=order["amount"])
+            legs.append(LegResult(order["exchange"], order, result=result, sent_at=self._now, acked_at=arrival))
+        return ExecutionResult(legs=legs)
+
+    def advance(self, now):
+        """Move the clock to now, filling every order that reached its exchange before"""
+        while self._pending and self._pending[0][0] <= now:
+            arrival, _, order = heapq.heappop(self._pending)
+            self._fill(order)
+        self._now = now
+
+    def finish(self):
+        """Fill the orders still in flight against the last books"""
+        self.advance(math.inf)
+
+    def _fill(self, order):
+        ob = self.book_store.get(order["exchange"], order["symbol"])
+        filled = cost = 0
+        if ob is not None:
+            levels = ob["asks"] if order["side"] == "buy" else ob["bids"]
+            for price, amount, *_ in levels:
+                if (order["side"] == "buy" and price > order["price"]) or (order["side"] == "sell" and price < order["price"]):
+                    break
+                take = min(amount, order["amount"] - filled)
+                filled += take
+                cost += take * price
+                if filled >= order["amount"]:
+                    break
+        if filled >= order["amount"]:
+            self.orders_filled += 1
+        elif filled > 0:
+            self.orders_partial += 1
+        else:
+            self.orders_unfilled += 1
+        if self.on_fill:
+            self.on_fill(order, filled, cost / filled if filled else 0)
@@ -1,7 +1,11 @@
-import copy
+import asyncio
 import logging
+import time
 from typing import NamedTuple
 
+from ceres.exchange.circuitbreaker import CircuitOpenError
+from ceres.exchange.exchangehelpers import StreamIdleError, backoff_delay
+
 logger = logging.getLogger(__name__)
 
 
@@ -13,37 +17,67 @@ class Asset(NamedTuple):
 
 
 class Balances:
+    """
+    In-memory balance ledger of the currencies we trade.
+    It is updated from our own fills and from the exchanges balance streams
+    where available. A full REST reconciliation only runs every
+    balance_reconcile_interval seconds or when a drift has been detected.
+    """
+
     def __init__(self, config, exchangeshandler) -> None:
         self._config = config
         self._exchangeshandler = exchangeshandler
         self._initial_balance = {}
         self.dry: bool = self._config.get("dry", True)
+        self.reconcile_interval = self._config.get("balance_reconcile_interval", 300)
+        self.drift_tolerance = self._config.get("balance_drift_tolerance", 0.0001)
+        self.currencies = self._get_currencies()
+        self._reconcile_requested = asyncio.Event()
+        self._last_reconcile = 0
+        self._tasks = []
         self._get_initial_balance()
-        # print(self._initial_balance)
-        self._balance = copy.deepcopy(self._initial_balance)
+        self._balance = {ex: dict(balance) for ex, balance in self._initial_balance.items()}
+
+    def _get_currencies(self):
+        currencies = set()
+        for symbol in self._exchangeshandler.symbols:
+            base, quote = symbol.split("/")
+            currencies.update((base, quote))
+        return currencies
 
     def _get_initial_balance(self):
         if self.dry:
             """
-            example of balance of a exchange
-            {'BTC': {'free': 1.0, 'used': 0.0, 'total': 1.0}, 'ETH': {'free': 0.0, 'used': 0.0, 'total': 0.0}}
+            dry_balance is either an amount of every quote currency or a dict per currency
+            e.g. 1000 or {'BTC': 0.1, 'USDT': 1000}, the same balance is used on every exchange
             """
-            pass
+            dry_balance = self._config.get("dry_balance", 0)
+            if not isinstance(dry_balance, dict):
+                quotes = {symbol.split("/")[1] for symbol in self._exchangeshandler.symbols}
+                dry_balance = {quote: dry_balance for quote in quotes}
+            for ex in self._exchangeshandler.current_exchanges:
+                self._initial_balance[ex] = {
+                    coin: Asset(currency=coin, free=dry_balance.get(coin, 0), total=dry_balance.get(coin, 0))
+                    for coin in self.currencies
+                }
         else:
             balances = self._exchangeshandler.get_balances()
             for ex, balance in balances.items():
-                bal = {}
-                # print(ex, balance)
-                for coin, info in balance.items():
-                    # print(coin,info)
-                    if coin not in ["timestamp", "datetime"]:
-                        bal[coin] = Asset(
-                            currency=coin,
-                            free=info.get("free", 0),
-                            used=info.get("used", 0),
-                            total=info.get("total", 0),
-                        )
-                self._initial_balance[ex] = bal
+                self._initial_balance[ex] = self._to_assets(balance)
+            self._last_reconcile = time.time()
+
+    def _to_assets(self, balance):
+        """Convert a ccxt balance to Assets, keeping only the tracked currencies"""
+        bal = {}
+        for coin in self.currencies:
+            info = balance.get(coin) or {}
+            bal[coin] = Asset(
+                currency=coin,
+                free=info.get("free") or 0,
+                used=info.get("used") or 0,
+                total=info.get("total") or 0,
+            )
+        return bal
 
     def get_free(self, exchange, currency):
         return self._balance[exchange][currency].free
@@ -57,18 +91,140 @@ class Balances:
             total_balance += self.get_total(exchange, currency)
         return total_balance
 
-    def update_balance(self):
-        balances = self._exchangeshandler.get_balances()
-        for exchange, balance in balances.items():
-            for coin, info in balance.items():
-                if coin not in ["timestamp", "datetime"]:
-                    self._balance[exchange][coin] = Asset(
-                        currency=coin,
-                        free=info.get("free", 0),
-                        used=info.get("used", 0),
-                        total=info.get("total", 0),
-                    )
-
     def check_free_amount(self, exchange, currency, required_amount):
         free_amount = self.get_free(exchange, currency)
         return free_amount >= required_amount
+
+    def _add(self, exchange, currency, free=0, used=0):
+        asset = self._balance[exchange][currency]
+        self._balance[exchange][currency] = asset._replace(
+            free=asset.free + free, used=asset.used + used, total=asset.total + free + used
+        )
+
+    def apply_fill(self, exchange, symbol, side, amount, price, fee_cost=0, fee_currency=None):
+        """
+        Book a fill of one of our orders
+        :param fee_cost: fee paid, in the quote currency unless fee_currency is given
+        """
+        base, quote = symbol.split("/")
+        cost = amount * price
+        if side == "buy":
+            self._add(exchange, base, free=amount)
+            self._add(exchange, quote, free=-cost)
+        else:
+            self._add(exchange, base, free=-amount)
+            self._add(exchange, quote, free=cost)
+        if fee_cost:
+            fee_currency = fee_currency if fee_currency in self.currencies else quote
+            self._add(exchange, fee_currency, free=-fee_cost)
+
+    def apply_order(self, exchange, order, fee_rate=0):
+        """
+        Book an acknowledged order: its filled part as a fill and the
+        remaining part as reserved until the exchange reports it
+        """
+        base, quote = order["symbol"].split("/")
+        price = order.get("average") or order["price"]
+        filled = order.get("filled") or 0
+        remaining = order.get("remaining")
+        if remaining is None:
+            remaining = order["amount"] - filled
+        if filled:
+            fee = order.get("fee") or {}
+            fee_cost = fee.get("cost")
+            if fee_cost is None:
+                fee_cost = filled * price * fee_rate
+            self.apply_fill(exchange, order["symbol"], order["side"], filled, price, fee_cost, fee.get("currency"))
+        if remaining > 0:
+            if order["side"] == "buy":
+                self._add(exchange, quote, free=-remaining * order["price"], used=remaining * order["price"])
+            else:
+                self._add(exchange, base, free=-remaining, used=remaining)
+
+    def release_order(self, exchange, order, amount):
+        """Give back the reservation of amount of an order, e.g. once it filled or got cancelled"""
+        base, quote = order["symbol"].split("/")
+        if order["side"] == "buy":
+            self._add(exchange, quote, free=amount * order["price"], used=-amount * order["price"])
+        else:
+            self._add(exchange, base, free=amount, used=-amount)
+
+    def apply_order_fill(self, exchange, order, amount, price, fee_cost=0, fee_currency=None):
+        """Book a fill of the reserved remainder of an acknowledged order"""
+        self.release_order(exchange, order, amount)
+        self.apply_fill(exchange, order["symbol"], order["side"], amount, price, fee_cost, fee_currency)
+
+    def update_from_exchange(self, exchange, balance, log_drift=True):
+        """
+        Take over a balance reported by the exchange. Stream updates may
+        legitimately race our own fills, so drift is only reported for
+        REST reconciliations.
+        """
+        assets = self._to_assets(balance)
+        for coin, asset in assets.items():
+            known = self._balance[exchange][coin]
+            if log_drift and abs(known.total - asset.total) > self.drift_tolerance * max(abs(asset.total), 1):
+                logger.warning(
+                    f"Balance drift on {exchange} for {coin}: ledger {known.total}, exchange {asset.total}"
+                )
+        self._balance[exchange] = assets
+
+    def request_reconcile(self):
+        """Ask for a REST reconciliation as soon as possible, e.g. after a rejected order"""
+        self._reconcile_requested.set()
+
+    async def reconcile(self):
+        balances = await self._exchangeshandler.fetch_balances()
+        for exchange, balance in balances.items():
+            self.update_from_exchange(exchange, balance)
+        self._last_reconcile = time.time()
+
+    def start(self):
+        """Start the balance streams and the reconciliation task on the handler loop"""
+        if self.dry:
+            return
+        loop = self._exchangeshandler.loop
+        for ex, exchange in self._exchangeshandler.exchanges.items():
+            if exchange.api.has.get("watchBalance"):
+                self._tasks.append(loop.create_task(self._stream_balance(ex)))
+        self._tasks.append(loop.create_task(self._reconcile_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _stream_balance(self, ex):
+        exchange = self._exchangeshandler.exchanges[ex]
+        failures = 0
+        while True:
+            try:
+                balance = await exchange.watch_balance()
+            except CircuitOpenError:
+                # Raised before any await, retrying at once would hold the loop until the breaker closes
+                await asyncio.sleep(exchange.breaker.retry_in() + backoff_delay(0))
+                continue
+            except StreamIdleError:
+                continue
+            except Exception as e:
+                logger.warning(f"Balance stream of {ex} failed: {e}. Reconnecting.")
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+                continue
+            failures = 0
+            self.update_from_exchange(ex, balance, log_drift=False)
+
+    async def _reconcile_loop(self):
+        while True:
+            timeout = max(self._last_reconcile + self.reconcile_interval - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._reconcile_requested.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._reconcile_requested.clear()
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Balance reconciliation failed: {e}")
+                self._last_reconcile = time.time()
@@ -0,0 +1,2 @@
+from ceres.benchmark.latency import (LatencyProbe, check_thresholds, format_results, run_benchmark,
+                                     run_scenario, save_results)
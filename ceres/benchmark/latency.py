@@ -0,0 +1,196 @@
+import json
+import logging
+import time
+
+import numpy as np
+
+from ceres.ceresbot import CeresBot
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (50, 90, 99)
+
+
+def benchmark_symbols(n_symbols):
+    """BTC/USDT plus coins quoted in USDT and BTC, so both spot and cycle arbitrage find work"""
+    symbols = ["BTC/USDT"]
+    coin = 0
+    while len(symbols) < n_symbols:
+        symbols.append(f"C{coin}/USDT")
+        if len(symbols) < n_symbols:
+            symbols.append(f"C{coin}/BTC")
+        coin += 1
+    return symbols
+
+
+def benchmark_config(n_exchanges, n_symbols, strategy="spot_arbitrage", update_interval=0.01,
+                     latency_ms=10, jitter_ms=0, error_rate=0, reject_rate=0):
+    symbols = benchmark_symbols(n_symbols)
+    prices = {symbol: 30000 if symbol == "BTC/USDT" else 100 if symbol.endswith("/USDT") else 100 / 30000
+              for symbol in symbols}
+    exchanges = [
+        {
+            "name": f"fake{i}",
+            "fake": {
+                "markets": symbols,
+                "prices": prices,
+                "update_interval": update_interval,
+                "latency_ms": latency_ms,
+                "jitter_ms": jitter_ms,
+                "error_rate": error_rate,
+                "reject_rate": reject_rate,
+                "balance": {currency: 1e9 for symbol in symbols for currency in symbol.split("/")},
+                "seed": i,
+            },
+        }
+        for i in range(n_exchanges)
+    ]
+    return {
+        "dry": False,
+        "symbols": symbols,
+        "strategy": strategy,
+        "min_profit": 0,
+        "order_size": 0.1,
+        "exchanges": exchanges,
+        "telegram": {"enabled": False},
+        "markets_cache": {"enabled": False},
+        "journal": {"enabled": False},
+    }
+
+
+def summarize(samples):
+    """
+    :param samples: latencies in seconds
+    :return: dict with count and percentiles in ms
+    """
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    summary = {"count": len(values), "mean": float(values.mean()), "max": float(values.max())}
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{p}"] = float(value)
+    return summary
+
+
+class LatencyProbe:
+    """
+    Measures a running bot from the outside: order book arrival to the
+    strategy decision that consumed it, and decision to order
+    acknowledgement. Samples taken before start_at are discarded.
+    """
+
+    def __init__(self, bot, start_at=0) -> None:
+        self.bot = bot
+        self.start_at = start_at
+        self.ticks = 0
+        self.decisions = 0
+        self.executions = 0
+        self.tick_to_decision = []
+        self.decision_to_send = []
+        self.decision_to_ack = []
+        self._arrivals = {}
+        self._decided_at = 0
+        self._decided_wall = 0
+        self._check_opportunity = bot.strategy.check_opportunity
+        self._create_orders = bot.exchangeHandler.create_orders
+        bot.exchangeHandler.book_store.add_listener(self._on_update)
+        bot.strategy.check_opportunity = self._timed_check_opportunity
+        bot.exchangeHandler.create_orders = self._timed_create_orders
+
+    def _on_update(self, exchange, symbol):
+        # Keep the oldest arrival, updates waiting for the bot are coalesced
+        self._arrivals.setdefault((exchange, symbol), time.perf_counter())
+
+    def _timed_check_opportunity(self, updates=None):
+        result = self._check_opportunity(updates)
+        now = time.perf_counter()
+        self._decided_at = now
+        self._decided_wall = time.time()
+        arrivals = [self._arrivals.pop(update, None) for update in updates or []]
+        if now >= self.start_at:
+            self.decisions += 1
+            for arrived_at in arrivals:
+                if arrived_at is not None:
+                    self.ticks += 1
+                    self.tick_to_decision.append(now - arrived_at)
+        return result
+
+    async def _timed_create_orders(self, orders, decided_at=None):
+        decided_perf, decided_wall = self._decided_at, self._decided_wall
+        execution = await self._create_orders(orders, decided_at)
+        if decided_perf >= self.start_at:
+            self.executions += 1
+            self.decision_to_send.append(max(leg.sent_at for leg in execution.legs) - decided_wall)
+            self.decision_to_ack.append(time.perf_counter() - decided_perf)
+        return execution
+
+
+def run_scenario(n_exchanges, n_symbols, duration=5.0, warmup=1.0, **options):
+    """
+    Run the bot against fake exchanges for warmup + duration seconds
+    :return: dict with the scenario and its measurements
+    """
+    config = benchmark_config(n_exchanges, n_symbols, **options)
+    bot = CeresBot(config)
+    probe = LatencyProbe(bot, start_at=time.perf_counter() + warmup)
+    bot.run(duration=warmup + duration)
+    return {
+        "exchanges": n_exchanges,
+        "symbols": n_symbols,
+        "strategy": config["strategy"],
+        "duration": duration,
+        "ticks_per_second": probe.ticks / duration,
+        "decisions_per_second": probe.decisions / duration,
+        "executions": probe.executions,
+        "tick_to_decision": summarize(probe.tick_to_decision),
+        "decision_to_send": summarize(probe.decision_to_send),
+        "decision_to_ack": summarize(probe.decision_to_ack),
+    }
+
+
+def run_benchmark(exchanges=(2, 4), symbols=(1, 8), **options):
+    results = []
+    for n_exchanges in exchanges:
+        for n_symbols in symbols:
+            logger.info(f"Benchmarking {n_exchanges} exchanges with {n_symbols} symbols")
+            results.append(run_scenario(n_exchanges, n_symbols, **options))
+    return results
+
+
+def format_results(results):
+    header = (
+        f"{'exchanges':>9} {'symbols':>7} {'ticks/s':>9} {'decisions/s':>11} "
+        f"{'tick->decision p50/p99 ms':>26} {'decision->send p50/p99 ms':>26} {'decision->ack p50/p99 ms':>25}"
+    )
+    lines = [header]
+    for r in results:
+        cells = []
+        for key in ("tick_to_decision", "decision_to_send", "decision_to_ack"):
+            s = r[key]
+            cells.append(f"{s['p50']:.3f}/{s['p99']:.3f}" if s["count"] else "-")
+        lines.append(
+            f"{r['exchanges']:>9} {r['symbols']:>7} {r['ticks_per_second']:>9.0f} {r['decisions_per_second']:>11.0f} "
+            f"{cells[0]:>26} {cells[1]:>26} {cells[2]:>25}"
+        )
+    return "\n".join(lines)
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def check_thresholds(results, max_tick_p99_ms=None, max_send_p99_ms=None):
+    """
+    :return: list of messages for the scenarios above a threshold
+    """
+    failures = []
+    for r in results:
+        scenario = f"{r['exchanges']} exchanges, {r['symbols']} symbols"
+        tick_p99 = r["tick_to_decision"].get("p99")
+        send_p99 = r["decision_to_send"].get("p99")
+        if max_tick_p99_ms is not None and tick_p99 is not None and tick_p99 > max_tick_p99_ms:
+            failures.append(f"{scenario}: tick to decision p99 {tick_p99:.3f} ms > {max_tick_p99_ms} ms")
+        if max_send_p99_ms is not None and send_p99 is not None and send_p99 > max_send_p99_ms:
+            failures.append(f"{scenario}: decision to send p99 {send_p99:.3f} ms > {max_send_p99_ms} ms")
+    return failures
@@ -1,77 +1,381 @@
+import asyncio
 import logging
+import time
 
+import ceres
+from ceres import __version__
 from ceres.balances import Balances
-from ceres.exchange import ExchangesHandler
-from ceres.remote import Telegram
-from ceres.strategy import SpotArbitrage
+from ceres.exchange import ExchangesHandler, OrderManager
+from ceres.exchange.exchangehelpers import cancel_tasks
+from ceres.metrics import LoopLagMonitor, MetricsServer, SamplingProfiler, metrics
+from ceres.strategy import STRATEGIES
 from ceres.config import Config
+from ceres.data import Journal, JournalReader
+from ceres.recovery import RecoveryEngine
 
 
 logger = logging.getLogger(__name__)
 
 
 class CeresBot:
-    def __init__(self, config) -> None:
+    def __init__(self, config, exchangeshandler=None, hub=None, profiler=None) -> None:
+        """
+        :param hub: MarketDataHub to take the order books from, see run_bots
+        :param profiler: SamplingProfiler of the process, bots sharing a loop share it
+        """
         self.config = Config(config)
 
         if self.config.dry:
             logger.info("Bot is running in dry mode")
 
-        self.exchangeHandler = ExchangesHandler(self.config)
+        self.exchangeHandler = exchangeshandler or ExchangesHandler(self.config, hub)
         self.wallets = Balances(self.config, self.exchangeHandler)
-        self.strategy = SpotArbitrage(self.config, self.exchangeHandler)
-        self.symbol = self.config.symbol
+        self.strategy = STRATEGIES[self.config.strategy](self.config, self.exchangeHandler, self.wallets)
+        self.symbols = self.exchangeHandler.symbols
         self.min_profit = self.config.min_profit
-        counter, base = self.symbol.split("/")
-        self.counter = counter
-        self.base = base
         self.balances = None
+        self.total_opportunities = 0
+        self.rejected_opportunities = 0
         self.total_trades = 0
         self.total_profit = 0
+        self.failed_executions = 0
         self.total_turnover = 0
+        self.heart_beat = 60
+        self._heart_beat_now = 0
+        self._book_updated = asyncio.Event()
+        self._pending_updates = set()
+        self._decided_at = None
+        self.metrics_server = MetricsServer.from_config(self.config, metrics)
+        self.journal = Journal.from_config(self.config)
+        if self.journal:
+            self._restore_totals()
+        self.order_manager = OrderManager.from_config(
+            self.config, self.exchangeHandler, self.wallets, journal=self.journal, on_fill=self._on_fill,
+            on_done=self._on_order_done,
+        )
+        self.recovery = RecoveryEngine.from_config(
+            self.config, self.exchangeHandler, self.wallets, self.strategy.fees.taker, journal=self.journal,
+            on_execution=self._on_recovery_execution,
+        )
+        if self.recovery and self.order_manager:
+            self.recovery.follow_open_orders = True
+        self.exchangeHandler.book_store.add_listener(self._on_order_book_update)
+        self.profiler = profiler or SamplingProfiler.from_config(self.config)
+        self.telegram = None
         if self.config.telegram_enabled:
-            self.telegram = Telegram(self.config)
+            from ceres.remote.telegram import Telegram
+            self.telegram = Telegram(self.config, on_profile=self.profiler.toggle)
+        self._first_decision = True
 
-    def main_loop(self):
-        self.wallets.update_balance()
-        signal, orders = self.strategy.check_opportunity()
+    def _restore_totals(self):
+        """Carry the trade counters over from the journal of previous runs"""
+        reader = JournalReader(self.journal.path)
+        try:
+            self.total_trades, self.total_profit, self.total_turnover = reader.totals()
+        finally:
+            reader.close()
+        if self.total_trades:
+            logger.info(f"Journal holds {self.total_trades} trades with {self.total_profit:.5f} profit")
+
+    def _on_fill(self, exchange, order, amount, price):
+        self.total_turnover += amount
+
+    def _on_order_done(self, exchange, order, filled, fee):
+        if self.recovery:
+            self.recovery.on_order_done(exchange, order, filled, fee)
+
+    def _on_order_book_update(self, exchange, symbol):
+        self._pending_updates.add((exchange, symbol))
+        self._book_updated.set()
+
+    def run(self, duration=None, profile=False):
+        """
+        Run the bot on the exchanges handler loop until interrupted
+        :param duration: stop after that many seconds
+        :param profile: profile the whole run, SIGUSR1 also starts and stops the profiler
+        """
+        loop = self.exchangeHandler.loop
+        monitor = _start_diagnostics(self.config, loop, self.profiler, profile)
+        task = loop.create_task(self._run())
+        if duration is not None:
+            _stop_after(loop, duration, [task])
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            logger.info("Bot stopped")
+        finally:
+            loop.run_until_complete(cancel_tasks([task]))
+            loop.run_until_complete(self._shutdown())
+            _stop_diagnostics(monitor, self.profiler)
+
+    async def _shutdown(self):
+        if self.order_manager:
+            await self.order_manager.stop()
+        if self.recovery:
+            await self.recovery.stop()
+        await self.wallets.stop()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        await self.exchangeHandler.close_exchanges()
+        if self.telegram:
+            self.telegram.close()
+        if self.journal:
+            self.journal.close()
+
+    async def _run(self):
+        if self.metrics_server:
+            await self.metrics_server.start()
+        self.wallets.start()
+        self.exchangeHandler.start_order_book_streams()
+        self.exchangeHandler.start_markets_validation(self.strategy.update_markets)
+        self.exchangeHandler.start_clock_sync()
+        self.exchangeHandler.start_keep_alive()
+        while True:
+            self._heartbeat()
+            try:
+                await asyncio.wait_for(self._book_updated.wait(), timeout=self.heart_beat)
+            except asyncio.TimeoutError:
+                continue
+            # Updates arriving while we evaluate are coalesced into the next pass
+            self._book_updated.clear()
+            await self.main_loop()
+
+    def _heartbeat(self):
+        now = time.time()
+        if (now - self._heart_beat_now) > self.heart_beat:
+            logger.info(f"Bot heartbeat. Running version='{__version__}'")
+            self._log_feeds()
+            self._heart_beat_now = now
+
+    def _log_feeds(self):
+        for ex, clock in self.exchangeHandler.book_store.clocks.items():
+            if clock.latency is None:
+                continue
+            source = "probed" if clock.synced else "relative to the fastest update"
+            logger.info(
+                f"Feed {ex}: clock offset {clock.offset * 1000:+.1f} ms ({source}), "
+                f"latency {clock.latency * 1000:.1f} ms, min {clock.min_latency * 1000:.1f} ms"
+            )
+
+    async def main_loop(self):
+        updates, self._pending_updates = self._pending_updates, set()
+        evaluated_at = time.time()
+        for ex, symbol in updates:
+            received_at = self.exchangeHandler.book_store.received_at(ex, symbol)
+            if received_at:
+                metrics.observe("ceres_stage_latency_seconds", evaluated_at - received_at, stage="receipt_to_evaluation", exchange=ex)
+        try:
+            signal, orders = self.strategy.check_opportunity(updates)
+        except Exception as e:
+            # One bad evaluation must not end the bot, the next update is evaluated afresh
+            metrics.inc("ceres_strategy_errors_total")
+            logger.exception(f"Strategy failed to evaluate the update, skipping it: {e}")
+            return
+        self._decided_at = time.time()
+        metrics.observe("ceres_stage_latency_seconds", self._decided_at - evaluated_at, stage="evaluation", exchange="all")
+        if self._first_decision:
+            self._first_decision = False
+            logger.info(f"Time to first decision: {time.monotonic() - ceres.started_at:.2f}s after start")
         if not signal:
             return
-        if float(orders['profit']['profit']) > self.min_profit and self.check_balance(orders):
+        self.total_opportunities += 1
+        if (float(orders['profit']['profit']) > self.min_profit and self.check_health(orders)
+                and self.check_balance(orders)):
             logger.info(f'Creating orders now: {orders}')
-            self.execute_orders(orders)
+            await self.execute_orders(orders)
         else:
-            logger.info(f'Profit too low: {orders["profit"]["profit"]} or balance not enough')
+            self.rejected_opportunities += 1
+            logger.info(f'Profit too low: {orders["profit"]["profit"]}, exchange unhealthy or balance not enough')
+            if self.journal:
+                self.journal.record_opportunity(
+                    self._traded_symbols(orders), self.config.strategy, orders, "rejected", self._decided_at
+                )
+
+    def check_health(self, orders):
+        return all(self.exchangeHandler.is_healthy(order['exchange']) for order in orders["exchange_orders"])
 
     def check_balance(self, orders):
-        for exchange, order in orders["exchange_orders"].items():
-            if self.is_balance_insufficient(exchange, order):
+        for order in orders["exchange_orders"]:
+            if self.is_balance_insufficient(order['exchange'], order):
                 return False
         return True
 
     def is_balance_insufficient(self, exchange, order):
+        counter, base = order['symbol'].split("/")
         if order['side'] == 'sell':
-            return not self.wallets.check_free_amount(exchange, self.counter, order['amount'])
+            return not self.wallets.check_free_amount(exchange, counter, order['amount'])
         if order['side'] == 'buy':
-            return not self.wallets.check_free_amount(exchange, self.base, order['amount']*order['price'])
+            return not self.wallets.check_free_amount(exchange, base, order['amount']*order['price'])
         return False
 
     def get_summary_message(self, orders):
-        msg = f"Profit: {orders['profit']['profit']} Total: {format(self.total_profit, '.5f')} Trades: {self.total_trades} Turnover: {self.total_turnover}  {self.counter}\n"
-        counter_balance = self.wallets.get_total_currency(self.counter)
-        counter_balance_base = list(orders['exchange_orders'].items())[0][1]['price'] * counter_balance
-        base_balance = self.wallets.get_total_currency(self.base)
-        msg += f"Balance: {format(counter_balance, '.2f')} {self.counter} ({format(counter_balance_base, '.2f')} {self.base}) {format(base_balance, '.2f')} {self.base} ({format(base_balance + counter_balance_base, '.2f')} {self.base})"
+        order = orders['exchange_orders'][0]
+        counter, base = order['symbol'].split("/")
+        msg = f"Profit: {orders['profit']['profit']} Total: {format(self.total_profit, '.5f')} Trades: {self.total_trades} Turnover: {self.total_turnover}  {counter}\n"
+        if self.failed_executions:
+            msg += f"Failed executions: {self.failed_executions}\n"
+        counter_balance = self.wallets.get_total_currency(counter)
+        counter_balance_base = order['price'] * counter_balance
+        base_balance = self.wallets.get_total_currency(base)
+        msg += f"Balance: {format(counter_balance, '.2f')} {counter} ({format(counter_balance_base, '.2f')} {base}) {format(base_balance, '.2f')} {base} ({format(base_balance + counter_balance_base, '.2f')} {base})"
         return msg
 
-    def execute_orders(self, orders):
+    @staticmethod
+    def _traded_symbols(orders):
+        """Symbol of a spot arbitrage, the symbols of a cycle joined by commas"""
+        return ",".join(dict.fromkeys(order['symbol'] for order in orders['exchange_orders']))
+
+    def _journal_execution(self, orders, execution):
+        if execution.ok:
+            status = "executed"
+        elif execution.placed_legs:
+            status = "partially_executed"
+        else:
+            status = "failed"
+        opportunity_id = self.journal.record_opportunity(
+            self._traded_symbols(orders), self.config.strategy, orders, status, self._decided_at
+        )
+        self._journal_legs(opportunity_id, execution.legs)
+        return opportunity_id
+
+    def _journal_legs(self, opportunity_id, legs):
+        for leg in legs:
+            self.journal.record_order(opportunity_id, leg)
+            filled = leg.result.get('filled') if leg.ok else None
+            if filled:
+                fee = leg.result.get('fee') or {}
+                self.journal.record_fill(
+                    leg.exchange, leg.order['symbol'], leg.order['side'], filled,
+                    leg.result.get('average') or leg.result.get('price'), fee.get('cost'),
+                    leg.result.get('id'), leg.acked_at or None,
+                )
+
+    def _book_leg(self, leg):
+        fee_rate = self.strategy.fees.taker(leg.exchange, leg.order['symbol'])
+        self.wallets.apply_order(leg.exchange, leg.result, fee_rate)
+        if self.order_manager:
+            # Fills after the ack are counted as the manager reports them
+            self.total_turnover += leg.result.get('filled') or 0
+            self.order_manager.track(leg.exchange, leg.result, fee_rate, leg.sent_at)
+        else:
+            self.total_turnover += leg.order['amount']
+
+    def _on_recovery_execution(self, execution, opportunity_id):
+        for leg in execution.legs:
+            if leg.ok:
+                self._book_leg(leg)
+        if execution.failed_legs:
+            self.wallets.request_reconcile()
+        if self.journal:
+            self._journal_legs(opportunity_id, execution.legs)
+
+    async def execute_orders(self, orders):
+        # Fire all legs before doing anything else, logging would only delay them
+        execution = await self.exchangeHandler.create_orders(orders["exchange_orders"], self._decided_at)
         msg = ""
-        self.total_profit += float(orders['profit']['profit'])
-        self.total_trades += 1
-        for exchange, order in orders["exchange_orders"].items():
-            logger.info(f"Placing {order['type']} {order['side']} order for {order['amount']} {self.symbol} @ {order['price']} on {exchange}")
-            msg += f"{order['side']} {order['amount']} {self.symbol} @ {order['price']} on {exchange} \n"
-            self.total_turnover += order['amount']
-            res = self.exchangeHandler.create_order(exchange, order['type'], order['side'], order['amount'], order['price'])
+        if execution.ok:
+            self.total_profit += float(orders['profit']['profit'])
+            self.total_trades += 1
+        else:
+            # The expected profit needs every leg, what was placed is left to the recovery
+            self.failed_executions += 1
+        for order in orders["exchange_orders"]:
+            logger.info(f"Placed {order['type']} {order['side']} order for {order['amount']} {order['symbol']} @ {order['price']} on {order['exchange']}")
+            msg += f"{order['side']} {order['amount']} {order['symbol']} @ {order['price']} on {order['exchange']} \n"
+        for leg in execution.legs:
+            if leg.ok:
+                self._book_leg(leg)
+                logger.info(f"{leg.order['side']} order on {leg.exchange} acknowledged in {leg.latency * 1000:.1f} ms")
+            else:
+                logger.warning(f"{leg.order['side']} order on {leg.exchange} failed after {leg.latency * 1000:.1f} ms: {leg.error}")
+                msg += f"FAILED {leg.order['side']} on {leg.exchange}: {leg.error} \n"
+        if execution.failed_legs:
+            # A rejected leg usually means our ledger and the exchange disagree
+            self.wallets.request_reconcile()
+        opportunity_id = self._journal_execution(orders, execution) if self.journal else None
+        if self.recovery:
+            for recovery in await self.recovery.recover(execution, opportunity_id):
+                msg += (
+                    f"RECOVERY {recovery.status}: {recovery.side} {recovery.filled}/{recovery.amount} {recovery.symbol} "
+                    f"on {recovery.exchanges or 'no exchange'} \n"
+                )
+        logger.info(
+            f"Executed {len(execution.placed_legs)}/{len(execution.legs)} legs in {execution.latency * 1000:.1f} ms "
+            f"(send skew {execution.send_skew * 1000:.3f} ms)"
+        )
         msg += self.get_summary_message(orders)
-        self.telegram.send_message(msg)
+        if self.telegram:
+            # Only queues the message, sending happens on the notifier thread
+            self.telegram.send_message(msg)
+        return execution
+
+
+def _stop_after(loop, duration, tasks):
+    """Cancel tasks after duration seconds, again until they end as the bot loop may swallow a cancellation"""
+    loop.call_later(duration, lambda: loop.create_task(cancel_tasks(tasks)))
+
+
+def _start_diagnostics(config, loop, profiler, profile):
+    """
+    Monitor the lag of the loop about to run in this thread, and let SIGUSR1 toggle the profiler
+    :return: the LoopLagMonitor, None when disabled
+    """
+    monitor = LoopLagMonitor.from_config(config, loop)
+    if monitor:
+        monitor.start()
+    if profiler.install_signal(loop):
+        logger.info("Send SIGUSR1 to start or stop profiling")
+    if profile:
+        profiler.start()
+    return monitor
+
+
+def _stop_diagnostics(monitor, profiler):
+    if monitor:
+        monitor.stop()
+    profiler.remove_signal()
+    profiler.stop()
+
+
+def run_bots(configs, duration=None, profile=False):
+    """
+    Run one bot per config in this process until interrupted. The bots
+    share a MarketDataHub, so every order book is streamed once whatever
+    the number of bots trading it, while each bot keeps its own accounts,
+    balances, orders and journal.
+    :param duration: stop after that many seconds
+    :param profile: profile the whole run, SIGUSR1 also starts and stops the profiler
+    """
+    from ceres.exchange.marketdatahub import MarketDataHub
+
+    journals = [
+        config.get("journal", {}).get("path", "ceres.db") for config in configs
+        if config.get("journal", {}).get("enabled", False)
+    ]
+    if len(set(journals)) < len(journals):
+        raise Exception("Bots of one process cannot share a journal. Please give each config its own journal path.")
+    # The name labels the gauges of each bot
+    for i, config in enumerate(configs):
+        config.setdefault("name", f"bot{i + 1}")
+    if len({config["name"] for config in configs}) < len(configs):
+        raise Exception("Bots of one process need different names. Please give each config its own name.")
+    hub = MarketDataHub()
+    loop = hub.loop
+    profiler = SamplingProfiler.from_config(configs[0])
+    bots = [CeresBot(config, hub=hub, profiler=profiler) for config in configs]
+    monitor = _start_diagnostics(configs[0], loop, profiler, profile)
+    tasks = [loop.create_task(bot._run()) for bot in bots]
+    if duration is not None:
+        _stop_after(loop, duration, tasks)
+    try:
+        loop.run_until_complete(asyncio.gather(*tasks))
+    except asyncio.CancelledError:
+        logger.info("Bots stopped")
+    finally:
+        loop.run_until_complete(cancel_tasks(tasks))
+        for bot in bots:
+            loop.run_until_complete(bot._shutdown())
+        loop.run_until_complete(hub.close())
+        _stop_diagnostics(monitor, profiler)
+        loop.close()
+    return bots
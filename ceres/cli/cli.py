@@ -1,36 +1,138 @@
 import logging
-import time
+from typing import List
 
 import typer
 
 from ceres import __version__
-from ceres.ceresbot import CeresBot
 from ceres.utils import load_config
 
 cli = typer.Typer(help='Ceres bot cli', add_completion=False)
 
 @cli.command()
-def trade(verbose: int = typer.Option(logging.INFO, '-v', '--verbose', help='Verbose mode')):
+def trade(
+    config_paths: List[str] = typer.Option(['config.json'], '--config', help='Config file, repeat it to run several bots sharing the order book streams'),
+    verbose: int = typer.Option(logging.INFO, '-v', '--verbose', help='Verbose mode'),
+    profile: bool = typer.Option(False, '--profile', help='Profile the whole run, SIGUSR1 also starts and stops the profiler'),
+):
     """Start trading"""
+    import os
+
+    from ceres.ceresbot import CeresBot, run_bots
+
     logger = logging.getLogger("ceres")
     LOGFORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     logging.basicConfig(level=verbose, format=LOGFORMAT)
-    config = load_config()
+    configs = [load_config(path) for path in config_paths]
     logger.info("Starting ceres")
-    ceresbot = CeresBot(config)
-    heart_beat_now = 0
-    heart_beat = 60
-    while True:
-        now = time.time()
-        if (now - heart_beat_now) > heart_beat:
-            logger.info(f"Bot heartbeat. Running version='{__version__}'")
-            heart_beat_now = now
-        ceresbot.main_loop()
+    try:
+        if len(configs) > 1:
+            for path, config in zip(config_paths, configs):
+                config.setdefault("name", os.path.splitext(os.path.basename(path))[0])
+            run_bots(configs, profile=profile)
+        else:
+            CeresBot(configs[0]).run(profile=profile)
+    except KeyboardInterrupt:
+        logger.info("Stopping ceres")
+
+@cli.command()
+def backtest(
+    data: str = typer.Option(..., '--data', help='Binary capture directory or JSONL file of order books'),
+    config_path: str = typer.Option('config.json', '--config', help='Config file'),
+    latency_ms: float = typer.Option(50, '--latency-ms', help='One-way order latency in ms'),
+    jitter_ms: float = typer.Option(0, '--jitter-ms', help='Random extra latency in ms'),
+    verbose: int = typer.Option(logging.WARNING, '-v', '--verbose', help='Verbose mode'),
+):
+    """Replay recorded order books through the strategy"""
+    from ceres.backtest import Backtesting, LatencyModel, format_report
+
+    LOGFORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=verbose, format=LOGFORMAT)
+    config = load_config(config_path)
+    latency_model = LatencyModel(latency_ms, jitter_ms, config.get("backtest", {}).get("latency_ms"))
+    results = Backtesting(config, data, latency_model).start()
+    print(format_report(results))
 
 @cli.command()
-def show_trades():
+def benchmark(
+    exchanges: str = typer.Option('2,4,8', '--exchanges', help='Comma separated numbers of fake exchanges'),
+    symbols: str = typer.Option('1,8,32', '--symbols', help='Comma separated numbers of symbols'),
+    strategy: str = typer.Option('spot_arbitrage', '--strategy', help='Strategy to benchmark'),
+    duration: float = typer.Option(5, '--duration', help='Seconds measured per scenario'),
+    update_interval: float = typer.Option(0.01, '--update-interval', help='Seconds between order book updates'),
+    latency_ms: float = typer.Option(10, '--latency-ms', help='Fake exchange rest latency in ms'),
+    jitter_ms: float = typer.Option(0, '--jitter-ms', help='Random extra rest latency in ms'),
+    error_rate: float = typer.Option(0, '--error-rate', help='Probability of an injected network error'),
+    output: str = typer.Option(None, '--json', help='Write the results to a JSON file'),
+    max_tick_p99_ms: float = typer.Option(None, '--max-tick-p99-ms', help='Fail above this tick to decision p99'),
+    max_send_p99_ms: float = typer.Option(None, '--max-send-p99-ms', help='Fail above this decision to send p99'),
+    verbose: int = typer.Option(logging.WARNING, '-v', '--verbose', help='Verbose mode'),
+):
+    """Measure latency and throughput against in-process fake exchanges"""
+    from ceres.benchmark import check_thresholds, format_results, run_benchmark, save_results
+
+    LOGFORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=verbose, format=LOGFORMAT)
+    results = run_benchmark(
+        exchanges=[int(n) for n in exchanges.split(',')],
+        symbols=[int(n) for n in symbols.split(',')],
+        strategy=strategy,
+        duration=duration,
+        update_interval=update_interval,
+        latency_ms=latency_ms,
+        jitter_ms=jitter_ms,
+        error_rate=error_rate,
+    )
+    print(format_results(results))
+    if output:
+        save_results(results, output)
+    failures = check_thresholds(results, max_tick_p99_ms, max_send_p99_ms)
+    for failure in failures:
+        print(failure)
+    if failures:
+        raise typer.Exit(code=1)
+
+@cli.command()
+def show_trades(
+    limit: int = typer.Option(20, '--limit', help='Number of orders to show'),
+    exchange: str = typer.Option(None, '--exchange', help='Only orders on this exchange'),
+    symbol: str = typer.Option(None, '--symbol', help='Only this symbol'),
+    hours: float = typer.Option(None, '--hours', help='Only the last hours'),
+    db: str = typer.Option(None, '--db', help='Journal database, defaults to the journal path of the config'),
+    config_path: str = typer.Option('config.json', '--config', help='Config file'),
+):
     """Show last trades"""
-    raise NotImplementedError()
+    import os
+    import time
+    from datetime import datetime
+
+    from ceres.data import JournalReader
+
+    if db is None:
+        db = "ceres.db"
+        if os.path.exists(config_path):
+            db = load_config(config_path).get("journal", {}).get("path", db)
+    if not os.path.exists(db):
+        print(f"No journal found at {db}")
+        raise typer.Exit(code=1)
+    since = time.time() - hours * 3600 if hours else None
+    reader = JournalReader(db)
+    try:
+        trades = reader.last_trades(limit, exchange, symbol, since)
+        pnl = reader.pnl(symbol, since, exchange)
+    finally:
+        reader.close()
+    print(f"{'time':<19} {'exchange':<12} {'symbol':<12} {'side':<4} {'amount':>14} {'price':>14} {'status':<10} {'profit':>10}")
+    for trade in reversed(trades):
+        profit = f"{trade['profit']:.5f}" if trade['profit'] is not None else ""
+        status = trade['status'] or ""
+        print(
+            f"{datetime.fromtimestamp(trade['ts']).strftime('%Y-%m-%d %H:%M:%S'):<19} {trade['exchange']:<12} "
+            f"{trade['symbol']:<12} {trade['side']:<4} {trade['amount']:>14.8f} {trade['price']:>14.8f} "
+            f"{status:<10} {profit:>10}"
+        )
+    print()
+    for row in pnl:
+        print(f"{row['symbol']}: {row['trades']} trades, profit {row['profit']:.5f}, fees {row['fees']:.5f}")
 
 @cli.command(help='Bot version')
 def version():
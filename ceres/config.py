@@ -14,6 +14,15 @@ class Config:
     def symbol(self):
         return self._config.get('symbol')
 
+    @property
+    def symbols(self):
+        """List of symbols to trade or "all" for every symbol common to all exchanges"""
+        return self._config.get('symbols', [self.symbol])
+
+    @property
+    def strategy(self):
+        return self._config.get('strategy', 'spot_arbitrage')
+
     @property
     def min_profit(self):
         return self._config.get('min_profit', 0.005)
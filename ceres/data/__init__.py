@@ -0,0 +1,2 @@
+from ceres.data.capture import CaptureReader, Recorder
+from ceres.data.journal import Journal, JournalReader
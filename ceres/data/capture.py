@@ -0,0 +1,282 @@
+"""
+Compact append-only order book capture.
+
+Every (exchange, symbol) stream is stored in its own directory as segment
+files of fixed-width little-endian records, so a segment can be memory
+mapped as a NumPy structured array without any parsing:
+
+    <path>/<exchange>/<BASE-QUOTE>/<first local ts>.seg
+    <path>/<exchange>/<BASE-QUOTE>/index.csv
+
+A segment starts with a HEADER_SIZE bytes header (magic, version, depth,
+exchange, symbol) followed by records of local_ts (ns), exchange_ts (ms,
+0 if unknown) and the top depth levels of bids and asks as (price, amount)
+pairs, NaN padded. index.csv gets a "segment,first_ts,last_ts,count" line
+for every closed segment.
+"""
+import logging
+import math
+import os
+import queue
+import struct
+import threading
+import time
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CERESOB1"
+VERSION = 1
+HEADER_FORMAT = "<8sHH32s32s"
+HEADER_SIZE = 128
+# Records converted at once by the writer thread, small enough to hold the GIL well below a millisecond
+CONVERT_CHUNK = 32
+
+
+def record_dtype(depth):
+    return np.dtype([
+        ("local_ts", "<i8"),
+        ("exchange_ts", "<i8"),
+        ("bids", "<f8", (depth, 2)),
+        ("asks", "<f8", (depth, 2)),
+    ])
+
+
+def stream_dir(path, exchange, symbol):
+    return os.path.join(path, exchange, symbol.replace("/", "-"))
+
+
+def write_header(f, depth, exchange, symbol):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, depth, exchange.encode(), symbol.encode())
+    f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+
+def read_header(filename):
+    with open(filename, "rb") as f:
+        magic, version, depth, exchange, symbol = struct.unpack(
+            HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT))
+        )
+    if magic != MAGIC:
+        raise ValueError(f"{filename} is not an order book capture segment")
+    return {
+        "version": version,
+        "depth": depth,
+        "exchange": exchange.rstrip(b"\0").decode(),
+        "symbol": symbol.rstrip(b"\0").decode(),
+    }
+
+
+def to_records(batch, depth):
+    """Convert recorded (local_ts, exchange_ts, bids, asks) tuples to a record array"""
+    records = np.empty(len(batch), dtype=record_dtype(depth))
+    empty = (math.nan, math.nan)
+    local_ts, exchange_ts, bids, asks = zip(*batch)
+    records["local_ts"] = local_ts
+    records["exchange_ts"] = exchange_ts
+    records["bids"] = [levels + [empty] * (depth - len(levels)) for levels in bids]
+    records["asks"] = [levels + [empty] * (depth - len(levels)) for levels in asks]
+    return records
+
+
+class Recorder:
+    """
+    Records top depth order book snapshots. record() only copies the
+    levels into the current batch; batches are converted and written to
+    disk by a background thread so the event loop never waits on numpy
+    conversion or the file system.
+    """
+
+    def __init__(self, path, depth=10, batch_size=256, flush_interval=1.0, segment_records=100000) -> None:
+        self.path = path
+        self.depth = depth
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.segment_records = segment_records
+        self.dropped = 0
+        self._batches = {}
+        self._last_flush = time.monotonic()
+        self._queue = queue.Queue(maxsize=1024)
+        self._writer = threading.Thread(target=self._write_loop, name="ceres-recorder", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_config(cls, config):
+        recorder_config = config.get("recorder", {})
+        if not recorder_config.get("enabled", False):
+            return None
+        return cls(
+            recorder_config.get("path", "capture"),
+            depth=recorder_config.get("depth", 10),
+            batch_size=recorder_config.get("batch_size", 256),
+            flush_interval=recorder_config.get("flush_interval", 1.0),
+            segment_records=recorder_config.get("segment_records", 100000),
+        )
+
+    def record(self, exchange, symbol, ob) -> None:
+        batch = self._batches.get((exchange, symbol))
+        if batch is None:
+            batch = self._batches[(exchange, symbol)] = []
+        # ccxt updates book levels in place, so the values have to be copied now
+        batch.append((
+            time.time_ns(),
+            ob.get("timestamp") or 0,
+            [(level[0], level[1]) for level in islice(ob["bids"], self.depth)],
+            [(level[0], level[1]) for level in islice(ob["asks"], self.depth)],
+        ))
+        if len(batch) >= self.batch_size:
+            self._hand_over(exchange, symbol)
+        elif time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def _hand_over(self, exchange, symbol):
+        batch = self._batches.pop((exchange, symbol))
+        try:
+            self._queue.put_nowait((exchange, symbol, batch))
+        except queue.Full:
+            self.dropped += len(batch)
+            logger.warning(f"Recorder queue is full, dropped {len(batch)} order books of {exchange} {symbol}")
+
+    def flush(self) -> None:
+        for exchange, symbol in list(self._batches):
+            self._hand_over(exchange, symbol)
+        self._last_flush = time.monotonic()
+
+    def close(self) -> None:
+        """Flush everything and wait for the writer to finish"""
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        writer = _SegmentWriter(self.path, self.depth, self.segment_records)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            exchange, symbol, batch = item
+            try:
+                for i in range(0, len(batch), CONVERT_CHUNK):
+                    writer.write(exchange, symbol, to_records(batch[i:i + CONVERT_CHUNK], self.depth))
+                    # Give the GIL back to the event loop thread between chunks
+                    time.sleep(0)
+            except Exception as e:
+                logger.warning(f"Could not write order book capture: {e}")
+        writer.close()
+
+
+class _SegmentWriter:
+    """Appends batches to segment files and rotates them, only used from the writer thread"""
+
+    def __init__(self, path, depth, segment_records) -> None:
+        self.path = path
+        self.depth = depth
+        self.segment_records = segment_records
+        self._segments = {}
+
+    def write(self, exchange, symbol, batch):
+        while len(batch):
+            segment = self._segments.get((exchange, symbol))
+            if segment is None:
+                segment = self._open(exchange, symbol, batch[0]["local_ts"])
+            room = self.segment_records - segment["count"]
+            part, batch = batch[:room], batch[room:]
+            segment["file"].write(part.tobytes())
+            segment["file"].flush()
+            if segment["count"] == 0:
+                segment["first_ts"] = int(part[0]["local_ts"])
+            segment["last_ts"] = int(part[-1]["local_ts"])
+            segment["count"] += len(part)
+            if segment["count"] >= self.segment_records:
+                self._rotate(exchange, symbol)
+
+    def _open(self, exchange, symbol, first_ts):
+        directory = stream_dir(self.path, exchange, symbol)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{int(first_ts)}.seg"
+        f = open(os.path.join(directory, name), "wb")
+        write_header(f, self.depth, exchange, symbol)
+        segment = {"file": f, "name": name, "directory": directory, "count": 0, "first_ts": 0, "last_ts": 0}
+        self._segments[(exchange, symbol)] = segment
+        return segment
+
+    def _rotate(self, exchange, symbol):
+        segment = self._segments.pop((exchange, symbol))
+        segment["file"].close()
+        with open(os.path.join(segment["directory"], "index.csv"), "a") as index:
+            index.write(f"{segment['name']},{segment['first_ts']},{segment['last_ts']},{segment['count']}\n")
+
+    def close(self):
+        for exchange, symbol in list(self._segments):
+            self._rotate(exchange, symbol)
+
+
+class CaptureReader:
+    """Memory mapped access to a capture directory written by Recorder"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+
+    def streams(self):
+        """
+        :return: list of (exchange, symbol) found in the capture
+        """
+        streams = []
+        if not os.path.isdir(self.path):
+            return streams
+        for exchange in sorted(os.listdir(self.path)):
+            ex_dir = os.path.join(self.path, exchange)
+            if not os.path.isdir(ex_dir):
+                continue
+            for symbol_dir in sorted(os.listdir(ex_dir)):
+                segments = self._segments(os.path.join(ex_dir, symbol_dir))
+                if segments:
+                    streams.append((exchange, read_header(segments[0][0])["symbol"]))
+        return streams
+
+    def _segments(self, directory):
+        """
+        :return: list of (filename, first_ts, last_ts) sorted by time, None for unknown bounds
+        """
+        indexed = {}
+        index_file = os.path.join(directory, "index.csv")
+        if os.path.exists(index_file):
+            with open(index_file) as index:
+                for line in index:
+                    name, first_ts, last_ts, _ = line.strip().split(",")
+                    indexed[name] = (int(first_ts), int(last_ts))
+        segments = []
+        for name in os.listdir(directory):
+            if name.endswith(".seg"):
+                first_ts, last_ts = indexed.get(name, (int(name[:-4]), None))
+                segments.append((os.path.join(directory, name), first_ts, last_ts))
+        return sorted(segments, key=lambda segment: segment[1])
+
+    def read(self, exchange, symbol, start=None, end=None):
+        """
+        Yield memory mapped record arrays of a stream between start and end (local ns timestamps)
+        """
+        directory = stream_dir(self.path, exchange, symbol)
+        if not os.path.isdir(directory):
+            return
+        for filename, first_ts, last_ts in self._segments(directory):
+            if end is not None and first_ts > end:
+                break
+            if start is not None and last_ts is not None and last_ts < start:
+                continue
+            records = self.map_segment(filename)
+            lo = 0 if start is None else np.searchsorted(records["local_ts"], start, side="left")
+            hi = len(records) if end is None else np.searchsorted(records["local_ts"], end, side="right")
+            if hi > lo:
+                yield records[lo:hi]
+
+    @staticmethod
+    def map_segment(filename):
+        header = read_header(filename)
+        dtype = record_dtype(header["depth"])
+        size = os.path.getsize(filename) - HEADER_SIZE
+        count = size // dtype.itemsize
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
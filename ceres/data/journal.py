@@ -0,0 +1,296 @@
+"""
+Trade journal in a local SQLite database.
+
+Every opportunity the strategy finds, every order leg sent for it, every
+fill and every recovery of a one-sided execution is appended to a table. The database runs in WAL mode so
+show-trades can read while the bot writes, and the tables are indexed on
+time, exchange and symbol so recent trades and PnL queries stay fast on
+millions of rows.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from itertools import count
+
+from ceres.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS opportunities (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    symbol TEXT NOT NULL,
+    strategy TEXT,
+    profit REAL,
+    profit_pct REAL,
+    fees REAL,
+    status TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    opportunity_id INTEGER,
+    ts REAL NOT NULL,
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    side TEXT NOT NULL,
+    type TEXT,
+    amount REAL,
+    price REAL,
+    status TEXT,
+    exchange_order_id TEXT,
+    error TEXT,
+    latency REAL
+);
+CREATE TABLE IF NOT EXISTS fills (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    exchange TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    side TEXT NOT NULL,
+    amount REAL NOT NULL,
+    price REAL,
+    fee REAL,
+    exchange_order_id TEXT
+);
+CREATE TABLE IF NOT EXISTS recoveries (
+    id INTEGER PRIMARY KEY,
+    opportunity_id INTEGER,
+    ts REAL NOT NULL,
+    symbol TEXT NOT NULL,
+    side TEXT NOT NULL,
+    amount REAL NOT NULL,
+    filled REAL,
+    price REAL,
+    reference_price REAL,
+    slippage REAL,
+    exposed_for REAL,
+    exchanges TEXT,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS opportunities_ts ON opportunities (ts);
+CREATE INDEX IF NOT EXISTS opportunities_symbol_ts ON opportunities (symbol, ts);
+-- Covers the PnL aggregates, so they never touch the table itself
+CREATE INDEX IF NOT EXISTS opportunities_pnl ON opportunities (status, symbol, ts, profit, fees);
+CREATE INDEX IF NOT EXISTS orders_ts ON orders (ts);
+CREATE INDEX IF NOT EXISTS orders_exchange_ts ON orders (exchange, ts);
+CREATE INDEX IF NOT EXISTS orders_symbol_ts ON orders (symbol, ts);
+CREATE INDEX IF NOT EXISTS orders_opportunity ON orders (opportunity_id);
+CREATE INDEX IF NOT EXISTS fills_ts ON fills (ts);
+CREATE INDEX IF NOT EXISTS fills_exchange_ts ON fills (exchange, ts);
+CREATE INDEX IF NOT EXISTS fills_symbol_ts ON fills (symbol, ts);
+CREATE INDEX IF NOT EXISTS recoveries_ts ON recoveries (ts);
+"""
+
+INSERTS = {
+    "opportunities": "INSERT INTO opportunities (id, ts, symbol, strategy, profit, profit_pct, fees, status) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "orders": "INSERT INTO orders (opportunity_id, ts, exchange, symbol, side, type, amount, price, status, "
+              "exchange_order_id, error, latency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    "fills": "INSERT INTO fills (ts, exchange, symbol, side, amount, price, fee, exchange_order_id) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+    "recoveries": "INSERT INTO recoveries (opportunity_id, ts, symbol, side, amount, filled, price, reference_price, "
+                  "slippage, exposed_for, exchanges, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+}
+
+
+def connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # With WAL a commit only waits for the log write, a power loss may lose the last transactions but not corrupt
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class Journal:
+    """
+    Appends trades to the journal database. The record methods only put a
+    row on a queue; a background thread writes the rows in batches of up to
+    batch_size, or whatever arrived within flush_interval seconds, each
+    batch in one transaction. When the queue is full rows are dropped and
+    counted rather than blocking the trading loop.
+    """
+
+    def __init__(self, path, batch_size=256, flush_interval=0.5, queue_size=10000) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._connection = connect(path)
+        last_id = self._connection.execute("SELECT MAX(id) FROM opportunities").fetchone()[0]
+        # Ids are handed out here so orders can refer to their opportunity before it is written
+        self._opportunity_ids = count((last_id or 0) + 1)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name="ceres-journal", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_config(cls, config):
+        journal_config = config.get("journal", {})
+        if not journal_config.get("enabled", False):
+            return None
+        return cls(
+            journal_config.get("path", "ceres.db"),
+            batch_size=journal_config.get("batch_size", 256),
+            flush_interval=journal_config.get("flush_interval", 0.5),
+            queue_size=journal_config.get("queue_size", 10000),
+        )
+
+    def _put(self, table, row):
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("ceres_journal_dropped_total", table=table)
+
+    def record_opportunity(self, symbol, strategy, orders, status, ts=None) -> int:
+        """
+        :param orders: orders dict of the strategy
+        :param status: executed, partially_executed, failed or rejected
+        :return: id of the opportunity, to pass to record_order
+        """
+        opportunity_id = next(self._opportunity_ids)
+        profit = orders["profit"]
+        self._put("opportunities", (
+            opportunity_id, ts or time.time(), symbol, strategy,
+            float(profit["profit"]), float(profit.get("profit_pct", 0)), float(profit.get("fees", 0)), status,
+        ))
+        return opportunity_id
+
+    def record_order(self, opportunity_id, leg) -> None:
+        """
+        :param leg: LegResult of the order
+        """
+        order, result = leg.order, leg.result or {}
+        self._put("orders", (
+            opportunity_id, leg.sent_at or time.time(), leg.exchange, order["symbol"], order["side"], order["type"],
+            order["amount"], order["price"], result.get("status") if leg.ok else "failed",
+            result.get("id"), leg.error, leg.latency if leg.acked_at else None,
+        ))
+
+    def record_fill(self, exchange, symbol, side, amount, price, fee=None, exchange_order_id=None, ts=None) -> None:
+        self._put("fills", (ts or time.time(), exchange, symbol, side, amount, price, fee, exchange_order_id))
+
+    def record_recovery(self, opportunity_id, recovery, ts=None) -> None:
+        """
+        :param recovery: Recovery of a one-sided execution
+        """
+        self._put("recoveries", (
+            opportunity_id, ts or time.time(), recovery.symbol, recovery.side, recovery.amount, recovery.filled,
+            recovery.price, recovery.reference_price, recovery.slippage, recovery.exposed_for, recovery.exchanges,
+            recovery.status,
+        ))
+
+    def close(self, timeout=5.0) -> None:
+        """Write what is still queued and stop the writer"""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Journal queue is still full, dropping the remaining rows")
+            return
+        self._writer.join(timeout)
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            rows = {}
+            stopping = self._collect(item, rows, time.monotonic() + self.flush_interval)
+            try:
+                with self._connection:
+                    for table, table_rows in rows.items():
+                        self._connection.executemany(INSERTS[table], table_rows)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write {sum(len(r) for r in rows.values())} journal rows: {e}")
+        self._connection.close()
+
+    def _collect(self, item, rows, deadline):
+        """
+        Group item and the rows arriving before deadline by table, up to batch_size rows
+        :return: True if the journal is closing
+        """
+        collected = 0
+        while True:
+            table, row = item
+            rows.setdefault(table, []).append(row)
+            collected += 1
+            if collected >= self.batch_size:
+                return False
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if item is None:
+                return True
+
+
+class JournalReader:
+    """Queries on a journal database, safe to use while the bot writes to it"""
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self._connection.row_factory = sqlite3.Row
+
+    def close(self) -> None:
+        self._connection.close()
+
+    @staticmethod
+    def _filters(exchange=None, symbol=None, since=None, prefix=""):
+        clauses, params = [], []
+        if exchange:
+            clauses.append(f"{prefix}exchange = ?")
+            params.append(exchange)
+        if symbol:
+            clauses.append(f"{prefix}symbol = ?")
+            params.append(symbol)
+        if since:
+            clauses.append(f"{prefix}ts >= ?")
+            params.append(since)
+        return clauses, params
+
+    def last_trades(self, limit=20, exchange=None, symbol=None, since=None):
+        """
+        :return: list of order rows joined with their opportunity's profit, newest first
+        """
+        clauses, params = self._filters(exchange, symbol, since, prefix="o.")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return self._connection.execute(
+            "SELECT o.ts, o.exchange, o.symbol, o.side, o.amount, o.price, o.status, o.error, o.latency, "
+            "o.opportunity_id, p.profit FROM orders o LEFT JOIN opportunities p ON p.id = o.opportunity_id "
+            f"{where} ORDER BY o.ts DESC LIMIT ?",
+            params + [limit],
+        ).fetchall()
+
+    def pnl(self, symbol=None, since=None, exchange=None):
+        """
+        :param exchange: only the opportunities with an order on this exchange
+        :return: list of rows with symbol, trades, profit and fees of the executed opportunities
+        """
+        clauses, params = self._filters(symbol=symbol, since=since)
+        if exchange:
+            clauses.append("id IN (SELECT opportunity_id FROM orders WHERE exchange = ?)")
+            params.append(exchange)
+        clauses.append("status IN ('executed', 'partially_executed')")
+        return self._connection.execute(
+            "SELECT symbol, COUNT(*) AS trades, SUM(profit) AS profit, SUM(fees) AS fees FROM opportunities "
+            f"WHERE {' AND '.join(clauses)} GROUP BY symbol ORDER BY symbol",
+            params,
+        ).fetchall()
+
+    def totals(self):
+        """
+        :return: (trades, profit, turnover) of the opportunities executed on every leg, turnover being the
+            filled amount
+        """
+        trades, profit = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(profit), 0) FROM opportunities WHERE status = 'executed'"
+        ).fetchone()
+        turnover = self._connection.execute("SELECT COALESCE(SUM(amount), 0) FROM fills").fetchone()[0]
+        return trades, profit, turnover
@@ -1,3 +1,5 @@
 from ceres.exchange.exchange import Exchange
 from ceres.exchange.exchangeshandler import ExchangesHandler
 from ceres.exchange.exchangehelpers import retrier
+from ceres.exchange.ordermanager import OrderManager
+from ceres.exchange.marketdatahub import MarketDataHub
@@ -0,0 +1,104 @@
+import logging
+import time
+
+from ceres.exchange.clock import ClockEstimator
+from ceres.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BookStore:
+    """
+    Holds the latest order book of every exchange and symbol.
+    The exchange streams push into it and every registered listener is
+    notified with (exchange, symbol) on each update. The local receive time
+    of every book is kept and the exchange timestamps feed a clock
+    estimator per exchange, so the age of a quote can be told.
+    """
+
+    def __init__(self, bot=None) -> None:
+        """
+        :param bot: name of the bot owning the store, labels its gauges when several bots share the process
+        """
+        self.labels = {"bot": bot} if bot else {}
+        self._books = {}
+        self._received = {}
+        self._listeners = []
+        self.clocks = {}
+        metrics.set_collector(f"clocks_{bot}" if bot else "clocks", self._clock_gauges)
+
+    def _clock_gauges(self):
+        for exchange, clock in list(self.clocks.items()):
+            yield "ceres_clock_offset_seconds", {"exchange": exchange, **self.labels}, clock.offset
+            if clock.latency is not None:
+                yield "ceres_feed_latency_seconds", {"exchange": exchange, **self.labels}, clock.latency
+
+    def add_listener(self, listener) -> None:
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def update(self, exchange, symbol, order_book, received_at=None) -> None:
+        """
+        :param received_at: local time the book was received, now by default
+        """
+        if received_at is None:
+            received_at = time.time()
+        self._books.setdefault(symbol, {})[exchange] = order_book
+        self._received.setdefault(symbol, {})[exchange] = received_at
+        exchange_ts = order_book.get("timestamp")
+        if exchange_ts:
+            clock = self.clocks.get(exchange) or self.clock(exchange)
+            clock.add_quote(exchange_ts / 1000, received_at)
+            metrics.observe(
+                "ceres_stage_latency_seconds", received_at - clock.to_local(exchange_ts / 1000),
+                stage="exchange_to_receipt", exchange=exchange,
+            )
+        for listener in self._listeners:
+            listener(exchange, symbol)
+
+    def remove_exchange(self, exchange) -> None:
+        """Forget the order books of an exchange, listeners are notified and find no book anymore"""
+        for symbol, books in self._books.items():
+            self._received[symbol].pop(exchange, None)
+            if books.pop(exchange, None) is not None:
+                for listener in self._listeners:
+                    listener(exchange, symbol)
+
+    def get(self, exchange, symbol):
+        return self._books.get(symbol, {}).get(exchange)
+
+    def clock(self, exchange):
+        clock = self.clocks.get(exchange)
+        if clock is None:
+            clock = self.clocks[exchange] = ClockEstimator()
+        return clock
+
+    def received_at(self, exchange, symbol):
+        return self._received.get(symbol, {}).get(exchange)
+
+    def quote_age(self, exchange, symbol, now):
+        """
+        Age of the book of an exchange: the longest of the time since we
+        received it and the time since the exchange stamped it, corrected
+        by the estimated clock offset
+        :return: seconds, infinite when there is no book
+        """
+        received_at = self.received_at(exchange, symbol)
+        if received_at is None:
+            return float("inf")
+        age = now - received_at
+        exchange_ts = self._books[symbol][exchange].get("timestamp")
+        clock = self.clocks.get(exchange)
+        if exchange_ts and clock:
+            age = max(age, now - clock.to_local(exchange_ts / 1000))
+        return age
+
+    def get_books(self, symbol):
+        """
+        Order books of a symbol on all exchanges which already sent one
+        :return: dict exchange -> order book
+        """
+        return self._books.get(symbol, {})
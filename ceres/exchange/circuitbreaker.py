@@ -0,0 +1,107 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Health state of one exchange.
+    closed: calls go through, failure_threshold consecutive failures open it.
+    open: calls fail fast for reset_timeout seconds, then it is half open.
+    half_open: one probe call at a time, a success closes it, a failure opens
+    it again for twice as long, up to max_reset_timeout.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=5.0, max_reset_timeout=60.0, on_change=None) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.on_change = on_change
+        self.failures = 0
+        self._state = CLOSED
+        self._opened_at = 0
+        self._probe_at = None
+
+    @classmethod
+    def from_config(cls, config, ex_dict):
+        """The exchange entry can override the global circuit_breaker settings"""
+        breaker_config = dict(config.get("circuit_breaker", {}))
+        breaker_config.update(ex_dict.get("circuit_breaker", {}))
+        return cls(
+            ex_dict.get("name"),
+            failure_threshold=breaker_config.get("failure_threshold", 5),
+            reset_timeout=breaker_config.get("reset_timeout", 5.0),
+            max_reset_timeout=breaker_config.get("max_reset_timeout", 60.0),
+        )
+
+    @property
+    def state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_at = None
+        return self._state
+
+    @property
+    def closed(self):
+        return self._state == CLOSED
+
+    def retry_in(self):
+        """
+        :return: seconds until a call may be allowed again
+        """
+        state = self.state
+        if state == OPEN:
+            return max(self._opened_at + self.reset_timeout - time.monotonic(), 0)
+        if state == HALF_OPEN and self._probe_at is not None:
+            return max(self._probe_at + self.reset_timeout - time.monotonic(), 0)
+        return 0
+
+    def allow(self):
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        # A probe that never reported back, e.g. because it was cancelled, is given up after reset_timeout
+        now = time.monotonic()
+        if self._probe_at is None or now - self._probe_at >= self.reset_timeout:
+            self._probe_at = now
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        if self._state != CLOSED:
+            self.reset_timeout = self.base_reset_timeout
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        state = self.state
+        if state == HALF_OPEN:
+            self.reset_timeout = min(self.reset_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif state == CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._probe_at = None
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        changed = state != self._state
+        self._state = state
+        if changed and self.on_change:
+            self.on_change(self.name, state)
@@ -0,0 +1,84 @@
+from collections import deque
+
+# Probes kept to pick the one with the shortest round trip
+PROBES = 8
+
+
+class ClockEstimator:
+    """
+    Estimates the clock offset of an exchange (exchange clock - local clock)
+    and the one-way latency of its feed.
+
+    Every quote gives d = local receive time - exchange timestamp, which is
+    offset-free latency minus the offset. The minimum of d over a sliding
+    window is the fastest delivery. When the exchange answers time probes,
+    the offset is taken NTP style from the probe with the shortest round
+    trip; otherwise the fastest delivery is assumed to have taken no time,
+    so latencies are relative to it.
+    """
+
+    def __init__(self, window=60.0, alpha=0.05) -> None:
+        self.window = window
+        self.alpha = alpha
+        self.mean_delay = None
+        self.last_delay = None
+        self._min_delays = deque()
+        self._probes = deque(maxlen=PROBES)
+
+    def add_quote(self, exchange_ts, received_at) -> None:
+        """
+        :param exchange_ts: exchange timestamp in seconds
+        :param received_at: local time.time() of the receipt
+        """
+        delay = received_at - exchange_ts
+        self.last_delay = delay
+        self.mean_delay = delay if self.mean_delay is None else self.mean_delay + self.alpha * (delay - self.mean_delay)
+        # Monotonic deque, the front is the minimum of the window
+        min_delays = self._min_delays
+        while min_delays and min_delays[-1][1] >= delay:
+            min_delays.pop()
+        min_delays.append((received_at, delay))
+        while min_delays[0][0] < received_at - self.window:
+            min_delays.popleft()
+
+    def add_probe(self, sent_at, exchange_ts, received_at) -> None:
+        """
+        :param sent_at: local time the time request was sent
+        :param exchange_ts: exchange time in the answer, in seconds
+        :param received_at: local time the answer arrived
+        """
+        self._probes.append((received_at - sent_at, exchange_ts - (sent_at + received_at) / 2))
+
+    @property
+    def synced(self):
+        """True when the offset comes from time probes"""
+        return bool(self._probes)
+
+    @property
+    def min_delay(self):
+        return self._min_delays[0][1] if self._min_delays else None
+
+    @property
+    def offset(self):
+        if self._probes:
+            return min(self._probes)[1]
+        if self._min_delays:
+            return -self.min_delay
+        return 0.0
+
+    @property
+    def latency(self):
+        """Mean one-way latency of the feed in seconds"""
+        if self.mean_delay is None:
+            return None
+        return self.mean_delay + self.offset
+
+    @property
+    def min_latency(self):
+        if self.min_delay is None:
+            return None
+        return self.min_delay + self.offset
+
+    def to_local(self, exchange_ts):
+        """Exchange timestamp in seconds converted to the local clock"""
+        return exchange_ts - self.offset
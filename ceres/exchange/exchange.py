@@ -1,23 +1,50 @@
 from datetime import datetime
+import asyncio
 import logging
+import time
 
-import ccxt.pro as ccxt
-from ccxt import InsufficientFunds,InvalidOrder, DDoSProtection,BaseError,NetworkError,ExchangeError
+import ccxt
+from ccxt.base.decimal_to_precision import TICK_SIZE
+from ccxt import InsufficientFunds,InvalidOrder, DDoSProtection,BaseError,NetworkError,ExchangeError,OrderNotFound,ArgumentsRequired
 
-from ceres.exchange.exchangehelpers import retrier
+from ceres.exchange.circuitbreaker import CircuitBreaker
+from ceres.exchange.exchangehelpers import StreamIdleError, retrier
+from ceres.exchange.ordertemplates import build_templates
+from ceres.exchange.ratelimiter import BACKGROUND, NORMAL, ORDER, RateBudget, priority
+from ceres.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
-print(ccxt.exchanges)
+
 class Exchange:
-    def __init__(self, config, ex_dict={}) -> None:
+    def __init__(self, config, ex_dict={}, budgets=None) -> None:
+        """
+        :param budgets: called with (config, ex_dict, api) for the rate budget, which a MarketDataHub shares between
+        the clients of an exchange; RateBudget.from_config by default
+        """
         self._config = config
         self.dry = self._config.get('dry', True)
         self.ex_dict = ex_dict
+        self.recorder = None
+        self.breaker = CircuitBreaker.from_config(self._config, ex_dict)
+        # Deadlines of single calls, order book streams may legitimately be quiet for a while
+        self.call_timeout = self._config.get('call_timeout', 10)
+        self.order_timeout = self._config.get('order_timeout', 5)
+        self.stream_timeout = self._config.get('stream_timeout', 60)
+        # An order sent within warm_window seconds of the previous rest call reuses a kept-alive connection
+        self.warm_window = self._config.get('order_path', {}).get('warm_window', 15)
+        self.templates = {}
         self.api = self.init_exchange(self.ex_dict)
+        # Rest calls are scheduled by priority within the weight the exchange allows
+        self.budget = (budgets or RateBudget.from_config)(self._config, ex_dict, self.api)
+        if self.budget:
+            self.budget.install(self.api)
 
     def init_exchange(self, ex_dict):
         name = ex_dict.get("name")
+        if ex_dict.get("fake") is not None:
+            from ceres.exchange.fakeexchange import FakeApi
+            return FakeApi(name, ex_dict.get("fake"))
 
         ex_config = {
             "apiKey": ex_dict.get("key"),
@@ -26,8 +53,10 @@ class Exchange:
             "options": ex_dict.get("options"),
 
         }
+        # ccxt.pro imports every exchange class, only pay for it when a real exchange is configured
+        from ccxt import pro
         try:
-            api = getattr(ccxt, name.lower())(ex_config)
+            api = getattr(pro, name.lower())(ex_config)
         except ccxt.BaseError as e:
             raise Exception(f"Initialization of ccxt failed. Reason: {e}") from e
 
@@ -54,10 +83,23 @@ class Exchange:
     def __repr__(self) -> str:
         return self.api.name
     
-    @retrier
     async def watch_order_book(self, symbol):
+        """
+        Next update of an order book. Waiting longer than stream_timeout raises StreamIdleError,
+        outside the retries, so a quiet symbol does not count against the circuit breaker of the exchange
+        """
+        try:
+            return await asyncio.wait_for(self._watch_order_book(symbol), self.stream_timeout)
+        except asyncio.TimeoutError:
+            raise StreamIdleError(f"No {symbol} order book update for {self.stream_timeout}s") from None
+
+    @retrier
+    async def _watch_order_book(self, symbol):
         try:
-            return await self.api.watch_order_book(symbol)
+            order_book = await self.api.watch_order_book(symbol)
+            if self.recorder:
+                self.recorder.record(self.ex_dict.get("name"), symbol, order_book)
+            return order_book
         except DDoSProtection as e:
             raise Exception(e) from e
         except (NetworkError, ExchangeError) as e:
@@ -66,11 +108,12 @@ class Exchange:
         except BaseError as e:
             raise Exception(e) from e
         
+    @priority(BACKGROUND)
     @retrier
     async def watch_ticker(self, symbol):    
         # watch tickers not working fetch ticker for now
         try:
-            return await self.api.fetch_ticker(symbol)
+            return await asyncio.wait_for(self.api.fetch_ticker(symbol), self.call_timeout)
         except ccxt.DDoSProtection as e:
             raise Exception(e) from e
         except (ccxt.NetworkError, ccxt.ExchangeError) as e:
@@ -79,18 +122,57 @@ class Exchange:
         except ccxt.BaseError as e:
             raise Exception(e) from e
 
+    @priority(BACKGROUND)
+    async def fetch_time(self):
+        """
+        :return: exchange time in ms
+        """
+        return await asyncio.wait_for(self.api.fetch_time(), self.call_timeout)
+
+    @priority(BACKGROUND)
     async def load_markets(self, reload=False):
         return await self.api.load_markets(reload=reload)
 
+    def set_markets(self, markets):
+        """Use markets loaded elsewhere, e.g. from the markets cache"""
+        self.api.set_markets(markets)
+
+    def round_amount(self, symbol, amount):
+        """
+        Amount truncated to the lot of the market, 0 when it is less than one lot where ccxt's
+        amount_to_precision raises
+        """
+        template = self.templates.get(symbol)
+        if template and template.lot:
+            return template.amount(amount)
+        try:
+            return float(self.api.amount_to_precision(symbol, amount))
+        except (ArgumentsRequired, InvalidOrder):
+            return 0.0
+
+    def prepare_orders(self, markets):
+        """Work out the precision, limits and params of the orders of the traded markets once"""
+        self.templates = build_templates(
+            markets, getattr(self.api, "precisionMode", TICK_SIZE), self.ex_dict.get("order_params")
+        )
+
+    async def close(self):
+        await self.api.close()
+
+    @staticmethod
+    def _clean_balance(balance):
+        balance.pop("info", None)
+        balance.pop("free", None)
+        balance.pop("total", None)
+        balance.pop("used", None)
+        return balance
+
+    @priority(BACKGROUND)
     @retrier
-    async def watch_balance(self):
+    async def fetch_balance(self):
         try:
-            balance = await self.api.fetch_balance()
-            balance.pop("info")
-            balance.pop("free", None)
-            balance.pop("total", None)
-            balance.pop("used", None)
-            return balance
+            balance = await asyncio.wait_for(self.api.fetch_balance(), self.call_timeout)
+            return self._clean_balance(balance)
 
         except ccxt.DDoSProtection as e:
             raise Exception(e) from e
@@ -99,6 +181,56 @@ class Exchange:
         except ccxt.BaseError as e:
             raise Exception(e) from e
 
+    @retrier
+    async def watch_balance(self):
+        try:
+            balance = await self.api.watch_balance()
+            return self._clean_balance(dict(balance))
+        except ccxt.DDoSProtection as e:
+            raise Exception(e) from e
+        except (ccxt.NetworkError, ccxt.ExchangeError) as e:
+            raise Exception(f'Could not watch balance due to {e.__class__.__name__}. Message: {e}') from e
+        except ccxt.BaseError as e:
+            raise Exception(e) from e
+
+    @retrier
+    async def watch_orders(self):
+        """
+        :return: list of our orders which changed since the last call
+        """
+        try:
+            return await self.api.watch_orders()
+        except ccxt.DDoSProtection as e:
+            raise Exception(e) from e
+        except (ccxt.NetworkError, ccxt.ExchangeError) as e:
+            raise Exception(f'Could not watch orders due to {e.__class__.__name__}. Message: {e}') from e
+        except ccxt.BaseError as e:
+            raise Exception(e) from e
+
+    @priority(NORMAL)
+    async def fetch_order(self, id, symbol):
+        """Not retried, the order manager polls again anyway"""
+        try:
+            return await asyncio.wait_for(self.api.fetch_order(id, symbol), self.call_timeout)
+        except (ccxt.NetworkError, ccxt.ExchangeError) as e:
+            raise Exception(f'Could not fetch order {id} due to {e.__class__.__name__}. Message: {e}') from e
+        except ccxt.BaseError as e:
+            raise Exception(e) from e
+
+    @priority(ORDER)
+    async def cancel_order(self, id, symbol):
+        """
+        :return: the cancelled order as far as the exchange reports it, None if the order is not open anymore
+        """
+        try:
+            return await asyncio.wait_for(self.api.cancel_order(id, symbol), self.order_timeout) or {}
+        except OrderNotFound:
+            return None
+        except (ccxt.NetworkError, ccxt.ExchangeError) as e:
+            raise Exception(f'Could not cancel order {id} due to {e.__class__.__name__}. Message: {e}') from e
+        except ccxt.BaseError as e:
+            raise Exception(e) from e
+
     def create_simulated_order(self, symbol, type, side, amount, price, params): 
         # assuming all trades immediately filled
         # still need to consider fees
@@ -125,37 +257,81 @@ class Exchange:
 
         return simulated_order
 
+    @priority(ORDER)
     async def create_order(self, *, symbol, type, side, amount, price, params):
+        metrics.inc("ceres_orders_total", exchange=self.name)
         if self.dry:
             order = self.create_simulated_order(symbol, type, side, amount, price, params)
             return order
 
+        if not self.breaker.allow():
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason="CircuitOpen")
+            logger.warning(f'Not placing {side} order on {self.name}, the exchange is unhealthy')
+            return None
+
+        template = self.templates.get(symbol)
+        if template:
+            amount, price = template.amount(amount), template.price(price)
+            refused = template.check(amount, price)
+            if refused:
+                metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason="Limits")
+                logger.warning(f'Not placing {side} order on {self.name} for {symbol}: {refused}')
+                return None
+            if template.params:
+                params = {**template.params, **params}
+
         try:
-            order = await self.api.create_order(
-                symbol,
-                type,
-                side,
-                amount,
-                price,
-                params
+            last_request = (getattr(self.api, 'lastRestRequestTimestamp', None) or 0) / 1000
+            sent_at = time.time()
+            order = await asyncio.wait_for(
+                self.api.create_order(
+                    symbol,
+                    type,
+                    side,
+                    amount,
+                    price,
+                    params
+                ),
+                self.order_timeout,
             )
+            round_trip = time.time() - sent_at
+            metrics.observe("ceres_stage_latency_seconds", round_trip, stage="send_to_ack", exchange=self.name)
+            metrics.observe(
+                "ceres_order_round_trip_seconds", round_trip, exchange=self.name,
+                connection="warm" if sent_at - last_request < self.warm_window else "cold",
+            )
+            self.breaker.record_success()
             return order
+        except asyncio.TimeoutError:
+            # The order may still have been placed, the caller reconciles
+            self.breaker.record_failure()
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason="Timeout")
+            logger.warning(
+                f'No answer to {type} {side} order on market {symbol} within {self.order_timeout}s, its state is unknown.')
         except InsufficientFunds as e:
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason=e.__class__.__name__)
             logger.warning(
                 f'Insufficient funds to create {type} {side} order on market {symbol}. '
                 f'Tried to {side} amount {amount} at rate {price}.'
                 f'Message: {e}')
         except InvalidOrder as e:
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason=e.__class__.__name__)
             logger.warning(
                 f'Could not create {type} {side} order on market {symbol}. '
                 f'Tried to {side} amount {amount} at rate {price}. '
                 f'Message: {e}') 
         except DDoSProtection as e:
+            self.breaker.record_failure()
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason=e.__class__.__name__)
             logger.warning(e)
         except (NetworkError, ExchangeError) as e:
+            if isinstance(e, NetworkError):
+                self.breaker.record_failure()
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason=e.__class__.__name__)
             logger.warning(
                 f'Could not place {side} order due to {e.__class__.__name__}. Message: {e}')
         except BaseError as e:
+            metrics.inc("ceres_orders_rejected_total", exchange=self.name, reason=e.__class__.__name__)
             logger.warning(e)
 
     def check_exchange_has(self, method=str) -> bool:
@@ -1,27 +1,68 @@
 import asyncio
+import functools
 import logging
+import random
 
+from ceres.exchange.circuitbreaker import OPEN, CircuitOpenError
+from ceres.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
+RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8.0
+
+
+class StreamIdleError(Exception):
+    """A stream sent nothing for a while, which a quiet market does without anything being wrong"""
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter, so reconnecting streams do not retry in lockstep"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def cancel_tasks(tasks, interval=1.0):
+    """
+    Cancel tasks and wait for them to end. A task is cancelled again every interval seconds
+    while it runs, as asyncio.wait_for may swallow a cancellation arriving together with its result.
+    """
+    pending = set(tasks)
+    while pending:
+        for task in pending:
+            task.cancel()
+        _, pending = await asyncio.wait(pending, timeout=interval)
+
+
 def retrier(f):
+    """
+    Retry an exchange call with jittered backoff. Every attempt is reported to
+    the circuit breaker of the exchange; calls fail fast while it is open.
+    """
+    @functools.wraps(f)
     async def wrapper(*args, **kwargs):
-        count = kwargs.pop('count', 4)
-        try:
-            return await f(*args, **kwargs)
-        except Exception as e:
-            msg = f'{f.__name__}() returned exception: "{e}". '
-            if count > 0:
-                msg += f'Retrying still for {count} times.'
-                count -= 1
-                kwargs['count'] = count
-                backoff_delay = (4 - (count+1)) ** 2 + 1
-                logger.info(f"Applying DDosProtection backoff delay: {backoff_delay}")
-                await asyncio.sleep(backoff_delay)
-                if msg:
-                    logger.warning(msg)
-                return await wrapper(*args, **kwargs)
-            else:
-                logger.warning(msg + 'Giving up.')
-                raise e
+        count = kwargs.pop('count', RETRIES)
+        breaker = getattr(args[0], 'breaker', None) if args else None
+        attempt = 0
+        while True:
+            if breaker and not breaker.allow():
+                raise CircuitOpenError(f'{breaker.name} is unhealthy, retry in {breaker.retry_in():.1f}s')
+            try:
+                result = await f(*args, **kwargs)
+            except Exception as e:
+                if breaker:
+                    breaker.record_failure()
+                msg = f'{f.__name__}() returned exception: "{e}". '
+                if attempt >= count or (breaker and breaker.state == OPEN):
+                    logger.warning(msg + 'Giving up.')
+                    raise e
+                delay = backoff_delay(attempt)
+                attempt += 1
+                metrics.inc("ceres_retries_total", function=f.__name__)
+                logger.warning(msg + f'Retrying in {delay:.2f}s, still {count - attempt + 1} times.')
+                await asyncio.sleep(delay)
+                continue
+            if breaker:
+                breaker.record_success()
+            return result
     return wrapper
@@ -1,29 +1,60 @@
 import logging
 import asyncio
+import time
 
+from ceres.data import Recorder
 from ceres.exchange import Exchange
+from ceres.exchange.bookstore import BookStore
+from ceres.exchange.circuitbreaker import CLOSED, OPEN, CircuitOpenError
+from ceres.exchange.exchangehelpers import StreamIdleError, backoff_delay
+from ceres.exchange.execution import ExecutionResult, LegResult
+from ceres.exchange.feedprocess import FeedProcesses
+from ceres.exchange.marketscache import MarketsCache
+from ceres.metrics import metrics
 
 logger = logging.getLogger(__name__)
 
 
 class ExchangesHandler:
-    def __init__(self, config) -> None:
+    def __init__(self, config, hub=None) -> None:
+        """
+        :param hub: MarketDataHub streaming the order books, shared with other handlers of the process
+        """
         self._config = config
-        self.symbol = self._config.get("symbol")
+        self.hub = hub
+        # Deadline of calls gathered over all exchanges, late exchanges are left out
+        self.gather_timeout = self._config.get("gather_timeout", 30)
+        self.clock_sync_interval = self._config.get("clock_sync_interval", 60)
+        self.keep_alive_interval = self._config.get("order_path", {}).get("keep_alive_interval", 10)
+        self.symbols = []
         self.exchanges_list = []
         self.exchanges = {}
         self.markets = {}
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
+        self.book_store = BookStore(bot=self._config.get("name"))
+        self.recorder = Recorder.from_config(self._config)
+        self.markets_cache = MarketsCache.from_config(self._config)
+        self.feed_processes = FeedProcesses.from_config(self._config)
+        # Exchanges whose markets came from the cache and still have to be checked
+        self.cached_markets = set()
+        self._stream_tasks = []
+        self._background_tasks = []
+        if hub:
+            self.loop = hub.loop
+        else:
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
         self._get_exchanges()
         self.markets = self._load_markets()
+        self.symbols = self._get_symbols()
         self._check_symbol_on_exchange()
 
     def _get_exchanges(self):
         ex_info = self._config.get("exchanges")
         for ex in ex_info:
             name = ex.get("name")
-            self.exchanges[name] = Exchange(self._config, ex)
+            self.exchanges[name] = Exchange(self._config, ex, budgets=self.hub.rate_budget if self.hub else None)
+            self.exchanges[name].recorder = self.recorder
+            self.exchanges[name].breaker.on_change = self._on_health_change
         self.exchanges_list = list(self.exchanges.keys())
 
     def __del__(self):
@@ -32,22 +63,59 @@ class ExchangesHandler:
 
     def close(self):
         logger.info("ExchangesHandler object destroyed, closing async loop")
-        if self.loop and not self.loop.is_closed():
+        # The loop of a hub is closed by its owner
+        if self.loop and not self.hub and not self.loop.is_closed():
             self.loop.close()
 
     @property
     def current_exchanges(self):
         return self.exchanges_list
 
-    def create_order(self, ex, type, side, amount, price):
-        return dict(
-            zip(
-                ex,
-                self.loop.run_until_complete(
-                    self.exchanges[ex].create_order(symbol=self.symbol, type=type, side=side, amount=amount, price=price, params={})
-                )
+    def now(self):
+        """Current time of the quotes, the strategies take their time from here"""
+        return time.time()
+
+    def is_healthy(self, ex):
+        return self.exchanges[ex].breaker.closed
+
+    def _on_health_change(self, ex, state):
+        if state == OPEN:
+            logger.warning(f"{ex} is unhealthy, trading on the other exchanges while it reconnects")
+            metrics.inc("ceres_circuit_breaker_trips_total", exchange=ex)
+            # Its books are getting stale, the strategy must not use them anymore
+            self.book_store.remove_exchange(ex)
+        elif state == CLOSED:
+            logger.info(f"{ex} is healthy again")
+
+    async def create_orders(self, orders, decided_at=None):
+        """
+        Submit all order legs concurrently
+        :param orders: list of order dicts, each with the exchange to place it on and optional ccxt params
+        :param decided_at: time.time() the strategy decided to trade
+        :return: ExecutionResult with one LegResult per leg
+        """
+        results = await asyncio.gather(*[self._submit_leg(order, decided_at) for order in orders])
+        return ExecutionResult(legs=list(results))
+
+    async def _submit_leg(self, order, decided_at=None):
+        ex = order["exchange"]
+        sent_at = time.time()
+        if decided_at is not None:
+            metrics.observe("ceres_stage_latency_seconds", sent_at - decided_at, stage="decision_to_send", exchange=ex)
+        try:
+            res = await self.exchanges[ex].create_order(
+                symbol=order["symbol"],
+                type=order["type"],
+                side=order["side"],
+                amount=order["amount"],
+                price=order["price"],
+                params=order.get("params", {}),
             )
-        )
+        except Exception as e:
+            logger.warning(f"Could not place {order['side']} order on {ex}: {e}")
+            return LegResult(ex, order, error=str(e), sent_at=sent_at, acked_at=time.time())
+        error = None if res is not None else "order rejected"
+        return LegResult(ex, order, result=res, error=error, sent_at=sent_at, acked_at=time.time())
 
     def get_markets(self):
         if not self.markets:
@@ -55,63 +123,262 @@ class ExchangesHandler:
         return self.markets
 
     async def _gather_tasks(self, operation, params=None):
+        """
+        Run an operation on every exchange within gather_timeout
+        :return: list of results in exchanges_list order, the exception for exchanges that failed or were late
+        """
         if params:
             tasks = [
-                getattr(self.exchanges[ex], operation)(params)
+                asyncio.ensure_future(getattr(self.exchanges[ex], operation)(params))
                 for ex in self.exchanges_list
             ]
         else:
             tasks = [
-                getattr(self.exchanges[ex], operation)() for ex in self.exchanges_list
+                asyncio.ensure_future(getattr(self.exchanges[ex], operation)()) for ex in self.exchanges_list
             ]
-        return await asyncio.gather(*tasks)
-
-    def watch_order_books(self, params=None):
-        return dict(
-            zip(
-                self.exchanges_list,
-                self.loop.run_until_complete(
-                    self._gather_tasks(operation="watch_order_book", params=params)
-                ),
-            )
+        _, pending = await asyncio.wait(tasks, timeout=self.gather_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        results = []
+        for ex, task in zip(self.exchanges_list, tasks):
+            if task in pending:
+                results.append(asyncio.TimeoutError(f"{ex} {operation} missed the {self.gather_timeout}s deadline"))
+            else:
+                results.append(task.exception() or task.result())
+        return results
+
+    def _successful(self, operation, results):
+        """Results of the exchanges that answered, the others are logged"""
+        successful = {}
+        for ex, result in zip(self.exchanges_list, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"{operation} failed on {ex}: {result}")
+            else:
+                successful[ex] = result
+        return successful
+
+    def start_order_book_streams(self):
+        """Start one long-lived order book stream per exchange and symbol on the handler loop"""
+        if self.hub:
+            self.hub.subscribe(self)
+            return
+        if self.feed_processes:
+            self.feed_processes.start(self)
+            return
+        for ex in self.exchanges_list:
+            for symbol in self.symbols:
+                task = self.loop.create_task(self._stream_order_book(ex, symbol))
+                self._stream_tasks.append(task)
+
+    async def _stream_order_book(self, ex, symbol):
+        """Push every order book update of an exchange into the book store"""
+        breaker = self.exchanges[ex].breaker
+        failures = 0
+        while True:
+            try:
+                order_book = await self.exchanges[ex].watch_order_book(symbol)
+            except CircuitOpenError:
+                await asyncio.sleep(breaker.retry_in() + backoff_delay(0))
+                continue
+            except StreamIdleError as e:
+                logger.info(f"{e} on {ex}, resubscribing")
+                continue
+            except Exception as e:
+                logger.warning(f"Order book stream of {ex} for {symbol} failed: {e}. Reconnecting.")
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+                continue
+            failures = 0
+            self.book_store.update(ex, symbol, order_book)
+
+    async def stop_order_book_streams(self):
+        if self.hub:
+            await self.hub.unsubscribe(self)
+        if self.feed_processes:
+            self.feed_processes.stop()
+        for task in self._stream_tasks:
+            task.cancel()
+        await asyncio.gather(*self._stream_tasks, return_exceptions=True)
+        self._stream_tasks = []
+
+    async def close_exchanges(self):
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks = []
+        await self.stop_order_book_streams()
+        await asyncio.gather(
+            *[self.exchanges[ex].close() for ex in self.exchanges_list], return_exceptions=True
         )
+        if self.recorder:
+            await self.loop.run_in_executor(None, self.recorder.close)
 
     def get_balances(self, params=None):
-        return dict(
-            zip(
-                self.exchanges_list,
-                self.loop.run_until_complete(
-                    self._gather_tasks(operation="watch_balance", params=params)
-                ),
-            )
+        """Balances of all exchanges, raises if one of them does not answer"""
+        results = self.loop.run_until_complete(
+            self._gather_tasks(operation="fetch_balance", params=params)
+        )
+        for ex, result in zip(self.exchanges_list, results):
+            if isinstance(result, BaseException):
+                raise Exception(f"Could not get the balance of {ex}: {result}") from result
+        return dict(zip(self.exchanges_list, results))
+
+    async def fetch_balances(self, params=None):
+        """Balances of the exchanges answering within gather_timeout"""
+        return self._successful(
+            "fetch_balance", await self._gather_tasks(operation="fetch_balance", params=params)
         )
 
     def get_ticker_on_exchanges(self, params=None):
-        return dict(
-            zip(
-                self.exchanges_list,
-                self.loop.run_until_complete(
-                    self._gather_tasks(operation="watch_ticker", params=params)
-                ),
-            )
+        return self._successful(
+            "watch_ticker",
+            self.loop.run_until_complete(
+                self._gather_tasks(operation="watch_ticker", params=params)
+            ),
         )
 
+    def _sandbox(self, ex):
+        return bool(self.exchanges[ex].ex_dict.get("sandbox"))
+
     def _load_markets(self):
-        """Load markets for all the exchanges"""
-        logger.info(f"Loading markets for exchanges {*self.exchanges_list,}")
-        return dict(
-            zip(
-                self.exchanges_list,
-                self.loop.run_until_complete(
-                    self._gather_tasks(operation="load_markets")
-                ),
+        """
+        Load markets for all the exchanges, from the markets cache when it is fresh.
+        Only the configured symbols are kept unless symbols is "all".
+        """
+        started = time.perf_counter()
+        markets = {}
+        to_load = []
+        for ex in self.exchanges_list:
+            cached = self.markets_cache.load(ex, self._sandbox(ex)) if self.markets_cache else None
+            if cached:
+                markets[ex] = cached
+                self.cached_markets.add(ex)
+            else:
+                to_load.append(ex)
+        if to_load:
+            logger.info(f"Loading markets for exchanges {*to_load,}")
+            loaded = self.loop.run_until_complete(
+                asyncio.gather(*[self.exchanges[ex].load_markets() for ex in to_load])
             )
+            for ex, ex_markets in zip(to_load, loaded):
+                markets[ex] = ex_markets
+                if self.markets_cache:
+                    self.markets_cache.save(ex, ex_markets, self._sandbox(ex))
+        markets = {ex: self._select_markets(markets[ex]) for ex in self.exchanges_list}
+        for ex in self.cached_markets:
+            self.exchanges[ex].set_markets(markets[ex])
+        for ex in self.exchanges_list:
+            self.exchanges[ex].prepare_orders(markets[ex])
+        logger.info(
+            f"Loaded markets of {len(markets)} exchanges in {time.perf_counter() - started:.2f}s "
+            f"({len(self.cached_markets)} from cache)"
+        )
+        return markets
+
+    def _select_markets(self, markets):
+        symbols = self._config.symbols
+        if symbols == "all":
+            return markets
+        return {symbol: markets[symbol] for symbol in symbols if symbol in markets}
+
+    def start_clock_sync(self):
+        """Probe the time of the exchanges supporting it, to estimate their clock offset"""
+        exchanges = [ex for ex in self.exchanges_list if self.exchanges[ex].api.has.get("fetchTime")]
+        if exchanges and self.clock_sync_interval:
+            self._background_tasks.append(self.loop.create_task(self._clock_sync_loop(exchanges)))
+
+    async def _clock_sync_loop(self, exchanges):
+        while True:
+            await asyncio.gather(*[self._probe_clock(ex) for ex in exchanges])
+            await asyncio.sleep(self.clock_sync_interval)
+
+    def start_keep_alive(self):
+        """
+        Keep the rest connections used for orders open: an exchange without any rest call for
+        keep_alive_interval seconds is sent a time probe, which also feeds its clock estimate
+        """
+        exchanges = [ex for ex in self.exchanges_list if self.exchanges[ex].api.has.get("fetchTime")]
+        if exchanges and self.keep_alive_interval and not self._config.get("dry", False):
+            self._background_tasks.append(self.loop.create_task(self._keep_alive_loop(exchanges)))
+
+    async def _keep_alive_loop(self, exchanges):
+        while True:
+            await asyncio.sleep(self.keep_alive_interval / 2)
+            now_ms = time.time() * 1000
+            idle = [
+                ex for ex in exchanges
+                if now_ms - (getattr(self.exchanges[ex].api, "lastRestRequestTimestamp", None) or 0)
+                >= self.keep_alive_interval * 1000
+            ]
+            await asyncio.gather(*[self._probe_clock(ex) for ex in idle])
+
+    async def _probe_clock(self, ex):
+        sent_at = time.time()
+        try:
+            exchange_ms = await self.exchanges[ex].fetch_time()
+        except Exception as e:
+            logger.debug(f"Could not probe the clock of {ex}: {e}")
+            return
+        received_at = time.time()
+        if exchange_ms:
+            clock = self.book_store.clock(ex)
+            clock.add_probe(sent_at, exchange_ms / 1000, received_at)
+            logger.debug(f"{ex} clock offset {clock.offset * 1000:+.1f} ms, round trip {(received_at - sent_at) * 1000:.1f} ms")
+
+    def start_markets_validation(self, on_change=None):
+        """
+        Reload the markets that came from the cache in the background
+        :param on_change: called when the markets of the traded symbols changed
+        """
+        if self.cached_markets:
+            self._background_tasks.append(self.loop.create_task(self._validate_markets(on_change)))
+
+    async def _validate_markets(self, on_change=None):
+        exchanges = sorted(self.cached_markets)
+        results = await asyncio.gather(
+            *[self.exchanges[ex].load_markets(reload=True) for ex in exchanges], return_exceptions=True
         )
+        changed = False
+        for ex, ex_markets in zip(exchanges, results):
+            if isinstance(ex_markets, Exception):
+                logger.warning(f"Could not validate cached markets of {ex}: {ex_markets}")
+                continue
+            self.cached_markets.discard(ex)
+            if self.markets_cache:
+                await self.loop.run_in_executor(None, self.markets_cache.save, ex, ex_markets, self._sandbox(ex))
+            selected = self._select_markets(ex_markets)
+            for symbol in self.symbols:
+                if symbol not in selected:
+                    logger.warning(f"{symbol} is not listed on {ex} anymore")
+                elif selected[symbol] != self.markets[ex].get(symbol):
+                    logger.info(f"Cached market {symbol} of {ex} was outdated")
+                    changed = True
+            self.markets[ex] = selected
+            self.exchanges[ex].prepare_orders(selected)
+        if changed and on_change:
+            on_change()
+
+    def _get_symbols(self):
+        """Configured symbols, "all" resolves to the active spot symbols listed on every exchange"""
+        symbols = self._config.symbols
+        if symbols != "all":
+            return list(symbols)
+        common = None
+        for market in self.markets.values():
+            listed = {
+                symbol for symbol, m in market.items()
+                if m.get("spot", True) and m.get("active") is not False
+            }
+            common = listed if common is None else common & listed
+        logger.info(f"Found {len(common)} symbols common to all exchanges")
+        return sorted(common)
 
     def _check_symbol_on_exchange(self):
-        """Check if symbol is available on all the exchanges"""
+        """Check if symbols are available on all the exchanges"""
         for ex, market in self.markets.items():
-            if not self.symbol in market:
-                raise Exception(
-                    f"{ex} does not have market symbol {self.symbol}. Please delete it or check if it is correctly written."
-                )
+            for symbol in self.symbols:
+                if not symbol in market:
+                    raise Exception(
+                        f"{ex} does not have market symbol {symbol}. Please delete it or check if it is correctly written."
+                    )
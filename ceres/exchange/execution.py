@@ -0,0 +1,57 @@
+from typing import List, NamedTuple, Optional
+
+
+class LegResult(NamedTuple):
+    """Outcome of a single order leg"""
+
+    exchange: str
+    order: dict
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    sent_at: float = 0
+    acked_at: float = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.result is not None
+
+    @property
+    def latency(self) -> float:
+        """Seconds between sending the order and the exchange acknowledging it"""
+        return self.acked_at - self.sent_at
+
+
+class ExecutionResult(NamedTuple):
+    """Combined outcome of all legs submitted together"""
+
+    legs: List[LegResult]
+
+    @property
+    def ok(self) -> bool:
+        return all(leg.ok for leg in self.legs)
+
+    @property
+    def placed_legs(self) -> List[LegResult]:
+        return [leg for leg in self.legs if leg.ok]
+
+    @property
+    def failed_legs(self) -> List[LegResult]:
+        return [leg for leg in self.legs if not leg.ok]
+
+    @property
+    def started_at(self) -> float:
+        return min(leg.sent_at for leg in self.legs)
+
+    @property
+    def finished_at(self) -> float:
+        return max(leg.acked_at for leg in self.legs)
+
+    @property
+    def latency(self) -> float:
+        """Seconds from the first send until the last acknowledgement"""
+        return self.finished_at - self.started_at
+
+    @property
+    def send_skew(self) -> float:
+        """Seconds between sending the first and the last leg"""
+        return max(leg.sent_at for leg in self.legs) - self.started_at
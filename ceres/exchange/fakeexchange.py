@@ -0,0 +1,330 @@
+"""
+In-process stand-in for a ccxt.pro exchange.
+
+It implements the part of the ccxt api used by Exchange (load_markets,
+watch_order_book, fetch_balance, watch_balance, create_order, fetch_order,
+cancel_order and the precision helpers)
+on top of a random walk order book, so the bot can run without any venue.
+Enable it per exchange with a "fake" dict in the exchange config:
+
+    {"name": "fake1", "fake": {"update_interval": 0.01, "latency_ms": 20, "error_rate": 0.01}}
+
+Options:
+    markets: symbols listed (default BTC/USDT, ETH/USDT, ETH/BTC)
+    prices: mid price per symbol (default 100)
+    price_offset: relative offset of all mid prices of this exchange, to create arbitrage
+    volatility: relative standard deviation of a mid price step (default 0.0005)
+    update_interval: seconds between order book updates of a symbol (default 0.01)
+    depth, level_amount, spread: order book shape (default 20, 1.0, 0.0002)
+    taker_fee: taker and maker fee (default 0.001)
+    latency_ms, jitter_ms: delay of rest calls (default 10, 0)
+    cold_latency_ms: extra delay of a rest call made after idle_timeout seconds without any,
+        for the connection handshake (default 0, 15)
+    rate_limit_ms: milliseconds per unit of rest weight, like ccxt's rateLimit (default none, unlimited)
+    costs: rest weight per method (default 1)
+    error_rate: probability of a NetworkError on a rest call or an order book update
+    reject_rate: probability of an order being rejected with InvalidOrder
+    resting_rate: probability of an order resting on the book instead of taking it
+    fill_delay: seconds until a resting order is completely filled at its limit price, it fills
+        progressively until then (default 1.0)
+    clock_offset: seconds the exchange clock is ahead of ours (default 0)
+    feed_delay: seconds the order books lag behind the exchange clock (default 0)
+    balance: free balance per currency (default 1000 of every currency)
+    watch_balance: stream the balance every update_interval, with error_rate disconnections (default False)
+    seed: random seed
+"""
+import asyncio
+import math
+import random
+import time
+from datetime import datetime
+from itertools import count
+
+from ccxt import InsufficientFunds, InvalidOrder, NetworkError, OrderNotFound
+
+DEFAULT_MARKETS = ["BTC/USDT", "ETH/USDT", "ETH/BTC"]
+
+
+class FakeApi:
+    def __init__(self, name, options=None) -> None:
+        options = options or {}
+        self.id = name
+        self.name = name
+        self.has = {
+            "watchOrderBook": True, "watchBalance": options.get("watch_balance", False), "createOrder": True,
+            "fetchBalance": True, "fetchTime": True, "fetchOrder": True, "cancelOrder": True, "watchOrders": False,
+        }
+        self.urls = {}
+        self.symbols = options.get("markets", DEFAULT_MARKETS)
+        self.depth = options.get("depth", 20)
+        self.level_amount = options.get("level_amount", 1.0)
+        self.spread = options.get("spread", 0.0002)
+        self.volatility = options.get("volatility", 0.0005)
+        self.update_interval = options.get("update_interval", 0.01)
+        self.taker_fee = options.get("taker_fee", 0.001)
+        self.latency_ms = options.get("latency_ms", 10)
+        self.jitter_ms = options.get("jitter_ms", 0)
+        self.cold_latency_ms = options.get("cold_latency_ms", 0)
+        self.idle_timeout = options.get("idle_timeout", 15)
+        self.lastRestRequestTimestamp = 0
+        self.error_rate = options.get("error_rate", 0)
+        self.rateLimit = options.get("rate_limit_ms")
+        self.costs = options.get("costs", {})
+        self.reject_rate = options.get("reject_rate", 0)
+        self.resting_rate = options.get("resting_rate", 0)
+        self.fill_delay = options.get("fill_delay", 1.0)
+        self.amount_precision = options.get("amount_precision", 6)
+        self.price_precision = options.get("price_precision", 8)
+        self.clock_offset = options.get("clock_offset", 0)
+        self.feed_delay = options.get("feed_delay", 0)
+        self._random = random.Random(options.get("seed", name))
+        prices = options.get("prices", {})
+        offset = options.get("price_offset", 0)
+        self.mids = {symbol: prices.get(symbol, 100) * (1 + offset) for symbol in self.symbols}
+        currencies = {currency for symbol in self.symbols for currency in symbol.split("/")}
+        balance = options.get("balance", {})
+        self.balance = {currency: float(balance.get(currency, 1000)) for currency in currencies}
+        self.markets = {}
+        self.orders = []
+        self._order_ids = count(1)
+        self.calls = {
+            "watch_order_book": 0, "create_order": 0, "fetch_balance": 0, "load_markets": 0, "fetch_time": 0,
+            "fetch_order": 0, "cancel_order": 0, "watch_balance": 0,
+        }
+
+    async def throttle(self, cost=None):
+        """Replaced by a rate budget, like the ccxt throttler"""
+
+    def _connect_ms(self):
+        """Handshake delay of a rest call, for a connection idle for longer than idle_timeout"""
+        now_ms = time.time() * 1000
+        idle = now_ms - self.lastRestRequestTimestamp >= self.idle_timeout * 1000
+        self.lastRestRequestTimestamp = now_ms
+        return self.cold_latency_ms if idle else 0
+
+    async def _rest_call(self, method):
+        await self.throttle(self.costs.get(method, 1))
+        self.calls[method] += 1
+        await asyncio.sleep((self._connect_ms() + self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 1000)
+        if self._random.random() < self.error_rate:
+            raise NetworkError(f"{self.id} {method} failed (injected)")
+
+    async def load_markets(self, reload=False):
+        await self._rest_call("load_markets")
+        if not self.markets or reload:
+            self.markets = {symbol: self._market(symbol) for symbol in self.symbols}
+        return self.markets
+
+    def _market(self, symbol):
+        base, quote = symbol.split("/")
+        return {
+            "id": symbol.replace("/", ""),
+            "symbol": symbol,
+            "base": base,
+            "quote": quote,
+            "spot": True,
+            "active": True,
+            "taker": self.taker_fee,
+            "maker": self.taker_fee,
+            "precision": {"amount": 10 ** -self.amount_precision, "price": 10 ** -self.price_precision},
+            "limits": {
+                "amount": {"min": 10 ** -self.amount_precision, "max": None},
+                "price": {"min": None, "max": None},
+                "cost": {"min": None, "max": None},
+            },
+        }
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+
+    def order_book(self, symbol):
+        """Current order book of symbol around its mid price"""
+        mid = self.mids[symbol]
+        half_spread = mid * self.spread / 2
+        step = mid * self.spread
+        return {
+            "symbol": symbol,
+            "timestamp": int((time.time() + self.clock_offset - self.feed_delay) * 1000),
+            "nonce": None,
+            "bids": [[mid - half_spread - i * step, self.level_amount] for i in range(self.depth)],
+            "asks": [[mid + half_spread + i * step, self.level_amount] for i in range(self.depth)],
+        }
+
+    async def watch_order_book(self, symbol, limit=None, params={}):
+        self.calls["watch_order_book"] += 1
+        await asyncio.sleep(self.update_interval)
+        if self._random.random() < self.error_rate:
+            raise NetworkError(f"{self.id} order book stream of {symbol} disconnected (injected)")
+        self.mids[symbol] *= math.exp(self._random.gauss(0, self.volatility))
+        return self.order_book(symbol)
+
+    async def fetch_time(self, params={}):
+        """Exchange time in ms, taken half way through the round trip"""
+        await self.throttle(self.costs.get("fetch_time", 1))
+        self.calls["fetch_time"] += 1
+        await asyncio.sleep(self._connect_ms() / 1000)
+        half_trip = (self.latency_ms + self._random.uniform(0, self.jitter_ms)) / 2000
+        await asyncio.sleep(half_trip)
+        exchange_ms = int((time.time() + self.clock_offset) * 1000)
+        await asyncio.sleep(half_trip)
+        return exchange_ms
+
+    async def fetch_balance(self, params={}):
+        await self._rest_call("fetch_balance")
+        return self._balance()
+
+    async def watch_balance(self, params={}):
+        self.calls["watch_balance"] += 1
+        await asyncio.sleep(self.update_interval)
+        if self._random.random() < self.error_rate:
+            raise NetworkError(f"{self.id} balance stream disconnected (injected)")
+        return self._balance()
+
+    def _balance(self):
+        balance = {"info": {}, "free": {}, "used": {}, "total": {}}
+        for currency, amount in self.balance.items():
+            balance[currency] = {"free": amount, "used": 0.0, "total": amount}
+            balance["free"][currency] = amount
+            balance["used"][currency] = 0.0
+            balance["total"][currency] = amount
+        return balance
+
+    async def create_order(self, symbol, type, side, amount, price=None, params={}):
+        """Fill immediately against the current book up to the limit price, the rest is cancelled"""
+        await self._rest_call("create_order")
+        if self._random.random() < self.reject_rate:
+            raise InvalidOrder(f"{self.id} rejected {side} order on {symbol} (injected)")
+        if price is not None and params.get("timeInForce") != "IOC" and self._random.random() < self.resting_rate:
+            return self._rest(symbol, type, side, amount, price)
+        base, quote = symbol.split("/")
+        book = self.order_book(symbol)
+        levels = book["asks"] if side == "buy" else book["bids"]
+        filled = cost = 0
+        for level_price, level_amount in levels:
+            if price is not None and (level_price > price if side == "buy" else level_price < price):
+                break
+            take = min(level_amount, amount - filled)
+            filled += take
+            cost += take * level_price
+            if filled >= amount:
+                break
+        fee = cost * self.taker_fee
+        if side == "buy":
+            if cost + fee > self.balance[quote]:
+                raise InsufficientFunds(f"{self.id} {quote} balance too low")
+            self.balance[quote] -= cost + fee
+            self.balance[base] += filled
+        else:
+            if amount > self.balance[base]:
+                raise InsufficientFunds(f"{self.id} {base} balance too low")
+            self.balance[base] -= filled
+            self.balance[quote] += cost - fee
+        now = datetime.utcnow()
+        order = {
+            "id": str(next(self._order_ids)),
+            "clientOrderId": None,
+            "timestamp": int(now.timestamp() * 1000),
+            "datetime": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "symbol": symbol,
+            "type": type,
+            "timeInForce": "IOC",
+            "side": side,
+            "price": price,
+            "average": cost / filled if filled else None,
+            "amount": amount,
+            "cost": cost,
+            "filled": filled,
+            "remaining": 0.0,
+            "status": "closed" if filled >= amount else "canceled",
+            "fee": {"cost": fee, "currency": quote},
+            "trades": [],
+            "info": {},
+        }
+        self.orders.append(order)
+        return order
+
+    def _rest(self, symbol, type, side, amount, price):
+        now = datetime.utcnow()
+        order = {
+            "id": str(next(self._order_ids)),
+            "clientOrderId": None,
+            "timestamp": int(now.timestamp() * 1000),
+            "datetime": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "symbol": symbol,
+            "type": type,
+            "timeInForce": "GTC",
+            "side": side,
+            "price": price,
+            "average": None,
+            "amount": amount,
+            "cost": 0.0,
+            "filled": 0.0,
+            "remaining": amount,
+            "status": "open",
+            "fee": {"cost": 0.0, "currency": symbol.split("/")[1]},
+            "trades": [],
+            "info": {},
+        }
+        self.orders.append(order)
+        return dict(order)
+
+    def _order(self, id):
+        for order in self.orders:
+            if order["id"] == id:
+                return order
+        raise OrderNotFound(f"{self.id} has no order {id}")
+
+    def _fill_resting(self, order):
+        """Fill a resting order at its limit price as far as fill_delay says it should be by now"""
+        if order["status"] != "open":
+            return
+        elapsed = time.time() - order["timestamp"] / 1000
+        target = order["amount"] * min(elapsed / self.fill_delay, 1) if self.fill_delay > 0 else order["amount"]
+        amount = target - order["filled"]
+        if amount <= 0:
+            return
+        base, quote = order["symbol"].split("/")
+        cost = amount * order["price"]
+        fee = cost * self.taker_fee
+        if order["side"] == "buy":
+            self.balance[quote] -= cost + fee
+            self.balance[base] += amount
+        else:
+            self.balance[base] -= amount
+            self.balance[quote] += cost - fee
+        order["filled"] = target
+        order["remaining"] = order["amount"] - target
+        order["cost"] += cost
+        order["average"] = order["cost"] / target
+        order["fee"]["cost"] += fee
+        if order["remaining"] <= 0:
+            order["remaining"] = 0.0
+            order["status"] = "closed"
+
+    async def fetch_order(self, id, symbol=None, params={}):
+        await self._rest_call("fetch_order")
+        order = self._order(id)
+        self._fill_resting(order)
+        return dict(order, fee=dict(order["fee"]))
+
+    async def cancel_order(self, id, symbol=None, params={}):
+        await self._rest_call("cancel_order")
+        order = self._order(id)
+        self._fill_resting(order)
+        if order["status"] != "open":
+            raise OrderNotFound(f"{self.id} order {id} is {order['status']}")
+        order["status"] = "canceled"
+        return dict(order, fee=dict(order["fee"]))
+
+    def amount_to_precision(self, symbol, amount):
+        factor = 10 ** self.amount_precision
+        return str(math.floor(amount * factor) / factor)
+
+    def price_to_precision(self, symbol, price):
+        return str(round(price, self.price_precision))
+
+    def set_sandbox_mode(self, enabled):
+        pass
+
+    async def close(self):
+        pass
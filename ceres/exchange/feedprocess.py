@@ -0,0 +1,223 @@
+"""
+Order book feeds in worker processes.
+
+With feed processes enabled every exchange streams its order books in its
+own process, so websocket parsing and book maintenance of different
+exchanges run on different cores. A worker copies the top levels of every
+update into the stream's slot of a SharedBooks block and writes the slot
+number to a pipe. The bot reads the pipe on its event loop, copies the
+announced slots out of shared memory and pushes them into the book store
+like any other update; nothing is pickled on the way. The recorder runs
+in the workers, so the capture holds every update at the recorder depth
+rather than what is left after the shared memory truncation and the
+coalescing of the bot.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+import numpy as np
+
+from ceres.data.capture import Recorder
+from ceres.exchange.circuitbreaker import CircuitOpenError
+from ceres.exchange.exchangehelpers import StreamIdleError, backoff_delay, cancel_tasks
+from ceres.exchange.sharedbooks import SharedBooks
+
+logger = logging.getLogger(__name__)
+
+LOGFORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Slot numbers written to the pipe at once, a write up to PIPE_BUF (4096 bytes) is atomic
+NOTIFY_CHUNK = 1024
+
+
+def run_feed(config, ex_dict, markets, streams, shm_name, n_slots, depth, notify, log_level):
+    """
+    Entry point of a feed process
+    :param streams: list of (slot, symbol) of this exchange
+    :param notify: write end of the pipe to the bot
+    """
+    # Ctrl+C reaches the whole process group, the bot stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format=LOGFORMAT)
+    asyncio.run(_feed(config, ex_dict, markets, streams, shm_name, n_slots, depth, notify))
+
+
+async def _feed(config, ex_dict, markets, streams, shm_name, n_slots, depth, notify):
+    from ceres.exchange.exchange import Exchange
+
+    books = SharedBooks(n_slots, depth, name=shm_name)
+    exchange = Exchange(config, ex_dict)
+    if markets:
+        exchange.set_markets(markets)
+    # Each worker records the streams of its exchange, which have directories of their own
+    exchange.recorder = Recorder.from_config(config)
+    publisher = _Publisher(books, notify.fileno())
+    tasks = [asyncio.create_task(_stream(exchange, symbol, slot, publisher)) for slot, symbol in streams]
+    loop = asyncio.get_running_loop()
+    try:
+        # The bot terminates its workers, what the recorder holds is written before exiting
+        loop.add_signal_handler(signal.SIGTERM, lambda: loop.create_task(cancel_tasks(tasks, interval=0.1)))
+    except NotImplementedError:
+        pass
+    try:
+        await asyncio.gather(*tasks)
+    except BrokenPipeError:
+        logger.info(f"Bot is gone, stopping the feed of {exchange.name}")
+    except asyncio.CancelledError:
+        logger.debug(f"Stopping the feed of {exchange.name}")
+    finally:
+        await cancel_tasks(tasks, interval=0.1)
+        await exchange.close()
+        if exchange.recorder:
+            exchange.recorder.close()
+        books.close()
+
+
+async def _stream(exchange, symbol, slot, publisher):
+    failures = 0
+    while True:
+        try:
+            order_book = await exchange.watch_order_book(symbol)
+        except CircuitOpenError:
+            await asyncio.sleep(exchange.breaker.retry_in() + backoff_delay(0))
+            continue
+        except StreamIdleError as e:
+            logger.info(f"{e} on {exchange.name}, resubscribing")
+            continue
+        except Exception as e:
+            logger.warning(f"Order book stream of {exchange.name} for {symbol} failed: {e}. Reconnecting.")
+            await asyncio.sleep(backoff_delay(failures))
+            failures += 1
+            continue
+        failures = 0
+        publisher.publish(slot, order_book)
+
+
+class _Publisher:
+    """Writes books to their slots and announces them, never waiting on a slow bot"""
+
+    def __init__(self, books, fd) -> None:
+        self.books = books
+        self.fd = fd
+        self._pending = set()
+        os.set_blocking(fd, False)
+
+    def publish(self, slot, order_book):
+        self.books.write(slot, order_book, time.time())
+        self._pending.add(slot)
+        slots = np.fromiter(self._pending, dtype="<u4", count=len(self._pending))
+        for i in range(0, len(slots), NOTIFY_CHUNK):
+            try:
+                os.write(self.fd, slots[i:i + NOTIFY_CHUNK].tobytes())
+            except BlockingIOError:
+                # The pipe is full, the slots still pending are announced with the next update
+                self._pending = set(slots[i:].tolist())
+                return
+        self._pending.clear()
+
+
+class FeedProcesses:
+    """Runs one feed process per exchange and feeds the books they publish into the book store"""
+
+    def __init__(self, depth=20) -> None:
+        self.depth = depth
+        self.handler = None
+        self.books = None
+        self.streams = []
+        self._workers = {}
+        self._partial = {}
+        self._restarts = {}
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, config):
+        feed_config = config.get("feed_processes", {})
+        if not feed_config.get("enabled", False):
+            return None
+        return cls(feed_config.get("depth", config.get("order_book_depth", 20)))
+
+    def start(self, handler) -> None:
+        self.handler = handler
+        self._stopping = False
+        self.streams = [(ex, symbol) for ex in handler.exchanges_list for symbol in handler.symbols]
+        self.books = SharedBooks(len(self.streams), self.depth)
+        for ex in handler.exchanges_list:
+            self._spawn(ex)
+        logger.info(f"Started {len(self._workers)} feed processes for {len(self.streams)} order book streams")
+
+    def _spawn(self, ex):
+        if self._stopping:
+            return
+        # Forking would copy the event loop and the writer threads of the bot
+        context = multiprocessing.get_context("spawn")
+        reader, writer = context.Pipe(duplex=False)
+        streams = [(slot, symbol) for slot, (stream_ex, symbol) in enumerate(self.streams) if stream_ex == ex]
+        process = context.Process(
+            target=run_feed,
+            args=(
+                self.handler._config, self.handler.exchanges[ex].ex_dict, self.handler.markets.get(ex), streams,
+                self.books.name, len(self.streams), self.depth, writer, logging.getLogger("ceres").getEffectiveLevel(),
+            ),
+            name=f"ceres-feed-{ex}",
+            daemon=True,
+        )
+        process.start()
+        writer.close()
+        os.set_blocking(reader.fileno(), False)
+        self.handler.loop.add_reader(reader.fileno(), self._on_notify, ex)
+        self._workers[ex] = (process, reader)
+
+    def _on_notify(self, ex):
+        process, reader = self._workers[ex]
+        try:
+            data = os.read(reader.fileno(), 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self._on_exit(ex)
+            return
+        data = self._partial.pop(ex, b"") + data
+        usable = len(data) - len(data) % 4
+        if usable < len(data):
+            self._partial[ex] = data[usable:]
+        for slot in np.unique(np.frombuffer(data[:usable], dtype="<u4")):
+            snapshot = self.books.read(slot)
+            if snapshot is None:
+                # Being written again, that write is announced too
+                continue
+            order_book, received_at = snapshot
+            stream_ex, symbol = self.streams[slot]
+            self._restarts[stream_ex] = 0
+            self.handler.book_store.update(stream_ex, symbol, order_book, received_at=received_at)
+
+    def _on_exit(self, ex):
+        process, reader = self._workers.pop(ex)
+        self.handler.loop.remove_reader(reader.fileno())
+        reader.close()
+        self._partial.pop(ex, None)
+        process.join(1)
+        if self._stopping:
+            return
+        restarts = self._restarts.get(ex, 0)
+        self._restarts[ex] = restarts + 1
+        delay = backoff_delay(restarts)
+        logger.warning(f"Feed process of {ex} exited with code {process.exitcode}, restarting in {delay:.1f}s")
+        # Its books are not updated anymore, the strategy must not use them
+        self.handler.book_store.remove_exchange(ex)
+        self.handler.loop.call_later(delay, self._spawn, ex)
+
+    def stop(self) -> None:
+        self._stopping = True
+        for ex, (process, reader) in list(self._workers.items()):
+            self.handler.loop.remove_reader(reader.fileno())
+            process.terminate()
+        for ex, (process, reader) in list(self._workers.items()):
+            process.join(5)
+            reader.close()
+        self._workers = {}
+        if self.books:
+            self.books.close()
+            self.books = None
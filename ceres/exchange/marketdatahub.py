@@ -0,0 +1,152 @@
+"""
+Order book streams shared by several bots in one process.
+
+Every bot normally opens its own order book streams. With a hub, the
+exchanges handlers of all bots subscribe their (exchange, symbol) pairs to
+it instead: the hub opens a single stream per pair on a market data client
+of its own and pushes every update into the book store of each subscribed
+handler. Balances, orders and everything else account related stay on the
+clients of each handler.
+
+Entries of one exchange which differ in sandbox mode, options or fake
+settings get a market data client each. The rest weight of an exchange
+is shared by every client of the process though, the hub hands the same
+rate budget to all of them.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from ceres.exchange.circuitbreaker import OPEN, CircuitOpenError
+from ceres.exchange.exchange import Exchange
+from ceres.exchange.exchangehelpers import StreamIdleError, backoff_delay
+from ceres.exchange.ratelimiter import RateBudget
+
+logger = logging.getLogger(__name__)
+
+
+def client_key(ex_dict):
+    """What a market data client depends on in an exchange entry, entries with the same key share a client"""
+    settings = {key: ex_dict.get(key) or None for key in ("options", "fake")}
+    return ex_dict.get("name"), bool(ex_dict.get("sandbox")), json.dumps(settings, sort_keys=True, default=str)
+
+
+class MarketDataHub:
+    """
+    One order book stream per exchange and symbol, fanned out to every
+    subscribed exchanges handler. Clients, markets and streams are keyed by
+    the client_key of the exchange entry.
+    """
+
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.exchanges = {}
+        self.markets = {}
+        self.budgets = {}
+        self._subscribers = {}
+        self._streams = {}
+
+    def rate_budget(self, config, ex_dict, api):
+        """
+        Rate budget of an exchange shared by the clients of all handlers, the first config asking for it sets it up
+        :return: None when rate limiting is disabled
+        """
+        key = ex_dict.get("name"), bool(ex_dict.get("sandbox"))
+        if key not in self.budgets:
+            self.budgets[key] = RateBudget.from_config(config, ex_dict, api)
+        return self.budgets[key]
+
+    def subscribe(self, handler) -> None:
+        """Stream the symbols of all exchanges of a handler into its book store"""
+        for ex in handler.exchanges_list:
+            ex_dict = handler.exchanges[ex].ex_dict
+            key = client_key(ex_dict)
+            if key not in self.exchanges:
+                self.exchanges[key] = self._market_data_client(handler._config, ex_dict, key)
+            self._add_markets(key, handler.markets.get(ex))
+            for symbol in handler.symbols:
+                subscribers = self._subscribers.setdefault((key, symbol), [])
+                subscribers.append(handler)
+                if (key, symbol) not in self._streams:
+                    self._streams[(key, symbol)] = self.loop.create_task(self._stream(key, symbol))
+        logger.info(f"Hub streams {len(self._streams)} order books for {self._n_handlers()} exchanges handlers")
+
+    def _market_data_client(self, config, ex_dict, key):
+        client = Exchange(config, ex_dict, budgets=self.rate_budget)
+        client.breaker.on_change = lambda ex, state: self._on_health_change(key, state)
+        return client
+
+    def _add_markets(self, key, markets):
+        """The client streams the symbols of every handler, it needs the markets of all of them"""
+        if not markets:
+            return
+        merged = self.markets.setdefault(key, {})
+        if markets.keys() - merged.keys():
+            merged.update(markets)
+            self.exchanges[key].set_markets(dict(merged))
+
+    def _n_handlers(self):
+        return len({id(handler) for subscribers in self._subscribers.values() for handler in subscribers})
+
+    async def unsubscribe(self, handler) -> None:
+        """Stop feeding a handler, streams nobody subscribes to anymore are closed"""
+        unused = []
+        for key, subscribers in list(self._subscribers.items()):
+            if handler in subscribers:
+                subscribers.remove(handler)
+            if not subscribers:
+                del self._subscribers[key]
+                unused.append(self._streams.pop(key))
+        for task in unused:
+            task.cancel()
+        await asyncio.gather(*unused, return_exceptions=True)
+
+    def _on_health_change(self, key, state):
+        if state == OPEN:
+            ex = key[0]
+            logger.warning(f"Market data of {ex} is unhealthy, its books are dropped while it reconnects")
+            for (stream_key, _), subscribers in self._subscribers.items():
+                if stream_key == key:
+                    for handler in subscribers:
+                        handler.book_store.remove_exchange(ex)
+
+    async def _stream(self, key, symbol):
+        ex = key[0]
+        exchange = self.exchanges[key]
+        failures = 0
+        while True:
+            try:
+                order_book = await exchange.watch_order_book(symbol)
+            except CircuitOpenError:
+                await asyncio.sleep(exchange.breaker.retry_in() + backoff_delay(0))
+                continue
+            except StreamIdleError as e:
+                logger.info(f"{e} on {ex}, resubscribing")
+                continue
+            except Exception as e:
+                logger.warning(f"Order book stream of {ex} for {symbol} failed: {e}. Reconnecting.")
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+                continue
+            failures = 0
+            self._publish(key, symbol, order_book)
+
+    def _publish(self, key, symbol, order_book):
+        # Every handler gets the same receive time, whatever the order they are fed in
+        received_at = time.time()
+        ex = key[0]
+        for handler in self._subscribers.get((key, symbol), ()):
+            if handler.recorder:
+                handler.recorder.record(ex, symbol, order_book)
+            handler.book_store.update(ex, symbol, order_book, received_at=received_at)
+
+    async def close(self) -> None:
+        tasks = list(self._streams.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._streams = {}
+        self._subscribers = {}
+        await asyncio.gather(*[client.close() for client in self.exchanges.values()], return_exceptions=True)
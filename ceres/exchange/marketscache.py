@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def default_path():
+    """markets directory in the user cache, $XDG_CACHE_HOME or ~/.cache"""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "ceres", "markets")
+
+
+class MarketsCache:
+    """
+    On-disk cache of the markets of every exchange, one JSON file per
+    exchange and another one for its sandbox, whose markets differ.
+    Entries older than ttl seconds are ignored.
+    """
+
+    def __init__(self, path, ttl=86400) -> None:
+        self.path = path
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config.get("markets_cache", {})
+        if not cache_config.get("enabled", True):
+            return None
+        return cls(cache_config.get("path") or default_path(), cache_config.get("ttl", 86400))
+
+    def _filename(self, exchange, sandbox=False):
+        return os.path.join(self.path, f"{exchange}-sandbox.json" if sandbox else f"{exchange}.json")
+
+    def load(self, exchange, sandbox=False):
+        """
+        :param sandbox: markets of the sandbox api of the exchange
+        :return: cached markets of exchange, None if missing or expired
+        """
+        try:
+            with open(self._filename(exchange, sandbox)) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - cached.get("timestamp", 0) > self.ttl:
+            return None
+        return cached.get("markets")
+
+    def save(self, exchange, markets, sandbox=False):
+        os.makedirs(self.path, exist_ok=True)
+        filename = self._filename(exchange, sandbox)
+        tmp = f"{filename}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"timestamp": time.time(), "markets": markets}, f)
+            os.replace(tmp, filename)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not cache markets of {exchange}: {e}")
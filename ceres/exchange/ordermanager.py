@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import time
+
+from ceres.exchange.exchangehelpers import backoff_delay, cancel_tasks
+from ceres.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DONE = ("closed", "canceled", "expired", "rejected")
+
+
+class TrackedOrder:
+    """An acknowledged order with an open remainder and what we booked of it so far"""
+
+    __slots__ = ("exchange", "order", "fee_rate", "sent_at", "filled", "cost", "fee", "fee_currency", "cancel_handle")
+
+    def __init__(self, exchange, order, fee_rate, sent_at) -> None:
+        self.exchange = exchange
+        self.order = order
+        self.fee_rate = fee_rate
+        self.sent_at = sent_at
+        self.filled = order.get("filled") or 0
+        self.cost = order.get("cost")
+        self.fee = (order.get("fee") or {}).get("cost")
+        self.fee_currency = (order.get("fee") or {}).get("currency")
+        self.cancel_handle = None
+
+    @property
+    def id(self):
+        return self.order["id"]
+
+    @property
+    def symbol(self):
+        return self.order["symbol"]
+
+
+class OrderManager:
+    """
+    Follows every order which was not done when the exchange acknowledged
+    it. Updates come from watch_orders where the exchange streams them and
+    from polling fetch_order elsewhere. Every new fill is booked into the
+    balances right away, and whatever is still open cancel_after seconds
+    after sending is cancelled and its reservation given back.
+    """
+
+    def __init__(self, exchangeshandler, wallets, cancel_after=10, poll_interval=1.0, journal=None, on_fill=None,
+                 on_done=None) -> None:
+        """
+        :param on_fill: called with (exchange, order, amount, price) of every new fill
+        :param on_done: called with (exchange, order, filled, fee) once an order is filled or cancelled
+        """
+        self.exchangeshandler = exchangeshandler
+        self.wallets = wallets
+        self.cancel_after = cancel_after
+        self.poll_interval = poll_interval
+        self.journal = journal
+        self.on_fill = on_fill
+        self.on_done = on_done
+        self.open_orders = {}
+        self._watchers = {}
+        self._cancels = set()
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, config, exchangeshandler, wallets, journal=None, on_fill=None, on_done=None):
+        manager_config = config.get("order_manager", {})
+        if not manager_config.get("enabled", True):
+            return None
+        return cls(
+            exchangeshandler,
+            wallets,
+            cancel_after=manager_config.get("cancel_after", 10),
+            poll_interval=manager_config.get("poll_interval", 1.0),
+            journal=journal,
+            on_fill=on_fill,
+            on_done=on_done,
+        )
+
+    def track(self, exchange, order, fee_rate=0, sent_at=None) -> None:
+        """
+        Follow an acknowledged order whose filled part has already been booked with Balances.apply_order
+        :param order: the order as returned by the exchange
+        """
+        sent_at = sent_at or time.time()
+        remaining = order.get("remaining")
+        if remaining is None:
+            remaining = order["amount"] - (order.get("filled") or 0)
+        if order.get("status") in DONE or remaining <= 0 or not order.get("id"):
+            if order.get("status") == "closed":
+                self._observe_filled(exchange, time.time() - sent_at)
+            return
+        tracked = TrackedOrder(exchange, order, fee_rate, sent_at)
+        key = (exchange, tracked.id)
+        self.open_orders[key] = tracked
+        loop = self.exchangeshandler.loop
+        tracked.cancel_handle = loop.call_at(
+            loop.time() + max(self.cancel_after - (time.time() - sent_at), 0), self._cancel_soon, key
+        )
+        if exchange not in self._watchers:
+            self._watchers[exchange] = loop.create_task(self._watch(exchange))
+
+    def _observe_filled(self, exchange, seconds):
+        metrics.observe("ceres_order_fill_seconds", seconds, exchange=exchange)
+
+    def on_update(self, exchange, update) -> None:
+        """Book what an order update reports beyond what we already booked"""
+        key = (exchange, update.get("id"))
+        tracked = self.open_orders.get(key)
+        if tracked is None:
+            return
+        filled = update.get("filled") or 0
+        amount = filled - tracked.filled
+        if amount > 0:
+            cost = update.get("cost")
+            if cost is not None and tracked.cost is not None:
+                price = (cost - tracked.cost) / amount
+            else:
+                price = update.get("average") or tracked.order["price"]
+            fee = update.get("fee") or {}
+            if fee.get("cost") is not None and tracked.fee is not None:
+                fee_cost = fee["cost"] - tracked.fee
+            else:
+                fee_cost = amount * price * tracked.fee_rate
+            self.wallets.apply_order_fill(exchange, tracked.order, amount, price, fee_cost, fee.get("currency"))
+            tracked.filled, tracked.cost, tracked.fee = filled, cost, fee.get("cost")
+            tracked.fee_currency = fee.get("currency") or tracked.fee_currency
+            if self.journal:
+                self.journal.record_fill(
+                    exchange, tracked.symbol, tracked.order["side"], amount, price, fee_cost, tracked.id
+                )
+            if self.on_fill:
+                self.on_fill(exchange, tracked.order, amount, price)
+        if update.get("status") in DONE:
+            self._finish(key, update["status"])
+
+    def _finish(self, key, status):
+        tracked = self.open_orders.pop(key)
+        if tracked.cancel_handle:
+            tracked.cancel_handle.cancel()
+        leftover = tracked.order["amount"] - tracked.filled
+        took = time.time() - tracked.sent_at
+        if leftover > 0:
+            self.wallets.release_order(tracked.exchange, tracked.order, leftover)
+            logger.info(
+                f"{tracked.order['side']} order {tracked.id} on {tracked.exchange} {status} after {took:.1f}s "
+                f"with {tracked.filled} of {tracked.order['amount']} {tracked.symbol} filled"
+            )
+        else:
+            self._observe_filled(tracked.exchange, took)
+            logger.info(f"{tracked.order['side']} order {tracked.id} on {tracked.exchange} filled in {took:.1f}s")
+        if self.on_done:
+            fee = {"cost": tracked.fee, "currency": tracked.fee_currency} if tracked.fee is not None else None
+            self.on_done(tracked.exchange, tracked.order, tracked.filled, fee)
+
+    async def _watch(self, ex):
+        exchange = self.exchangeshandler.exchanges[ex]
+        if exchange.api.has.get("watchOrders"):
+            await self._stream_orders(ex, exchange)
+        else:
+            await self._poll_orders(ex, exchange)
+
+    async def _stream_orders(self, ex, exchange):
+        failures = 0
+        while not self._stopping:
+            try:
+                updates = await exchange.watch_orders()
+            except Exception as e:
+                logger.warning(f"Order stream of {ex} failed: {e}. Reconnecting.")
+                await asyncio.sleep(backoff_delay(failures))
+                failures += 1
+                continue
+            failures = 0
+            for update in updates:
+                self.on_update(ex, update)
+
+    async def _poll_orders(self, ex, exchange):
+        # Not only cancellation ends the loop, wait_for may swallow a cancellation arriving with its result
+        while not self._stopping:
+            await asyncio.sleep(self.poll_interval)
+            for key, tracked in list(self.open_orders.items()):
+                if tracked.exchange != ex:
+                    continue
+                try:
+                    update = await exchange.fetch_order(tracked.id, tracked.symbol)
+                except Exception as e:
+                    logger.warning(f"Could not poll order {tracked.id} on {ex}: {e}")
+                    continue
+                self.on_update(ex, update)
+
+    def _cancel_soon(self, key):
+        if self._stopping:
+            return
+        task = self.exchangeshandler.loop.create_task(self._cancel(key))
+        self._cancels.add(task)
+        task.add_done_callback(self._cancels.discard)
+
+    async def _cancel(self, key):
+        tracked = self.open_orders.get(key)
+        if tracked is None:
+            return
+        exchange = self.exchangeshandler.exchanges[tracked.exchange]
+        try:
+            await exchange.cancel_order(tracked.id, tracked.symbol)
+        except Exception as e:
+            logger.warning(f"Could not cancel order {tracked.id} on {tracked.exchange}: {e}. Retrying.")
+            if not self._stopping:
+                tracked.cancel_handle = self.exchangeshandler.loop.call_later(self.poll_interval, self._cancel_soon, key)
+            return
+        # The final state also books fills a stream may have missed
+        try:
+            self.on_update(tracked.exchange, await exchange.fetch_order(tracked.id, tracked.symbol))
+        except Exception as e:
+            logger.warning(f"Could not fetch cancelled order {tracked.id} on {tracked.exchange}: {e}")
+        if key in self.open_orders:
+            self._finish(key, "canceled")
+            # We assumed the rest was cancelled without the exchange confirming it
+            self.wallets.request_reconcile()
+
+    async def stop(self, cancel_open=True):
+        """Stop following orders, cancelling those still open first"""
+        self._stopping = True
+        if cancel_open and self.open_orders:
+            logger.info(f"Cancelling {len(self.open_orders)} open orders")
+            await asyncio.gather(*[self._cancel(key) for key in list(self.open_orders)], return_exceptions=True)
+        await cancel_tasks(list(self._watchers.values()) + list(self._cancels))
+        self._watchers = {}
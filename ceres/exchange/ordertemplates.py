@@ -0,0 +1,86 @@
+"""
+Order templates prepared from the loaded markets.
+
+Everything about an order which only depends on its market is worked out
+once per market when the markets are loaded: the price tick and amount lot
+with the decimals to round to, the amount and cost limits and the static
+request params of the exchange. Sending an order then only rounds two
+floats and compares them to the limits, and an order the exchange would
+refuse is never sent.
+"""
+import math
+from decimal import Decimal
+
+from ccxt.base.decimal_to_precision import DECIMAL_PLACES, SIGNIFICANT_DIGITS, TICK_SIZE
+
+
+def to_step(value, mode):
+    """
+    Step of a ccxt precision, whatever the exchange's precision mode
+    :return: the step, None if the market has no fixed step
+    """
+    if value is None or mode == SIGNIFICANT_DIGITS:
+        return None
+    if mode == DECIMAL_PLACES:
+        return 10.0 ** -int(value)
+    return float(value)
+
+
+def step_decimals(step):
+    """Decimals of a step, so multiples of it can be rounded back from their float noise"""
+    return max(-Decimal(repr(step)).normalize().as_tuple().exponent, 0)
+
+
+class OrderTemplate:
+    """Precision, limits and static params of one market"""
+
+    __slots__ = (
+        "symbol", "tick", "lot", "price_decimals", "amount_decimals", "min_amount", "max_amount", "min_cost",
+        "params",
+    )
+
+    def __init__(self, market, mode=TICK_SIZE, params=None) -> None:
+        precision = market.get("precision") or {}
+        limits = market.get("limits") or {}
+        self.symbol = market["symbol"]
+        self.tick = to_step(precision.get("price"), mode)
+        self.lot = to_step(precision.get("amount"), mode)
+        self.price_decimals = step_decimals(self.tick) if self.tick else None
+        self.amount_decimals = step_decimals(self.lot) if self.lot else None
+        self.min_amount = (limits.get("amount") or {}).get("min") or 0
+        self.max_amount = (limits.get("amount") or {}).get("max") or math.inf
+        self.min_cost = (limits.get("cost") or {}).get("min") or 0
+        self.params = params or {}
+
+    def amount(self, amount):
+        """Amount truncated to the lot, like ccxt's amount_to_precision"""
+        if not self.lot:
+            return amount
+        return round(math.floor(amount / self.lot + 1e-9) * self.lot, self.amount_decimals)
+
+    def price(self, price):
+        """Price rounded to the tick, like ccxt's price_to_precision"""
+        if not self.tick or price is None:
+            return price
+        return round(round(price / self.tick) * self.tick, self.price_decimals)
+
+    def check(self, amount, price):
+        """
+        :return: why the exchange would refuse the order, None if it would not
+        """
+        if amount <= 0 or amount < self.min_amount:
+            return f"amount {amount} is below the minimum of {self.min_amount}"
+        if amount > self.max_amount:
+            return f"amount {amount} is above the maximum of {self.max_amount}"
+        if price is not None and amount * price < self.min_cost:
+            return f"cost {amount * price} is below the minimum of {self.min_cost}"
+        return None
+
+
+def build_templates(markets, mode=TICK_SIZE, params=None):
+    """
+    :param markets: dict symbol -> ccxt market
+    :param params: request params sent with every order of the exchange
+    :return: dict symbol -> OrderTemplate
+    """
+    return {symbol: OrderTemplate(market, mode, params) for symbol, market in markets.items()}
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import logging
+import time
+from itertools import count
+
+from ceres.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priorities of rest calls, lower goes first
+ORDER = 0
+NORMAL = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {ORDER: "order", NORMAL: "normal", BACKGROUND: "background"}
+
+_priority = contextvars.ContextVar("ceres_call_priority", default=NORMAL)
+
+
+def priority(level):
+    """Run the rest calls made by an exchange method at a priority"""
+    def decorator(f):
+        @functools.wraps(f)
+        async def wrapper(*args, **kwargs):
+            token = _priority.set(level)
+            try:
+                return await f(*args, **kwargs)
+            finally:
+                _priority.reset(token)
+        return wrapper
+    return decorator
+
+
+class RateBudget:
+    """
+    Token bucket of the rest weight an exchange allows, replacing the ccxt
+    throttler. Calls take their ccxt cost in tokens, which refill at rate
+    per second up to capacity. Waiting calls are served by priority, then
+    in arrival order, so an order never queues behind housekeeping, and
+    background calls are deferred while less than reserve of the capacity
+    is left, keeping that share for orders.
+    """
+
+    def __init__(self, name, rate, capacity, reserve=0.3, sandbox=False) -> None:
+        """
+        :param sandbox: budget of the sandbox api, labelled apart from the one of the live api
+        """
+        self.name = name
+        self.labels = {"exchange": name, "sandbox": "true"} if sandbox else {"exchange": name}
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = reserve
+        self.tokens = capacity
+        self._updated = time.monotonic()
+        self._waiters = []
+        self._order = count()
+        self._timer = None
+        metrics.set_collector(f"rate_budget_{name}{'_sandbox' if sandbox else ''}", self._gauges)
+
+    @classmethod
+    def from_config(cls, config, ex_dict, api):
+        """
+        The exchange entry can override the global rate_limit settings. The rate defaults to the one ccxt
+        knows for the exchange, the capacity to burst seconds of it.
+        :return: None when disabled or the rate is unknown
+        """
+        budget_config = dict(config.get("rate_limit", {}))
+        budget_config.update(ex_dict.get("rate_limit", {}))
+        if not budget_config.get("enabled", True):
+            return None
+        rate = budget_config.get("rate")
+        if rate is None and getattr(api, "rateLimit", None):
+            rate = 1000 / api.rateLimit
+        if not rate:
+            return None
+        return cls(
+            ex_dict.get("name"),
+            rate,
+            budget_config.get("capacity", rate * budget_config.get("burst", 1.0)),
+            reserve=budget_config.get("reserve", 0.3),
+            sandbox=bool(ex_dict.get("sandbox")),
+        )
+
+    def install(self, api) -> None:
+        """Make the rest calls of a ccxt exchange draw from this budget, websocket messages keep their own throttler"""
+        api.throttle = BudgetThrottle(self)
+
+    def _gauges(self):
+        self._refill()
+        yield "ceres_rate_budget_remaining", self.labels, self.tokens
+        yield "ceres_rate_budget_waiting", self.labels, len(self._waiters)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _needed(self, cost, level):
+        """Tokens which must be left for a call to go, never more than the bucket can hold"""
+        floor = self.capacity * self.reserve if level == BACKGROUND else 0
+        return min(cost + floor, self.capacity)
+
+    async def throttle(self, cost=None):
+        """Drop-in for the ccxt throttler, the priority is the one of the calling exchange method"""
+        await self.acquire(1 if cost is None else cost)
+
+    async def acquire(self, cost=1, level=None):
+        """
+        Wait until cost tokens can be taken
+        :param level: priority, the one of the calling exchange method by default
+        """
+        if level is None:
+            level = _priority.get()
+        self._refill()
+        # Calls of the same or a higher priority already waiting go first
+        if not any(waiter[0] <= level for waiter in self._waiters) and self.tokens >= self._needed(cost, level):
+            self.tokens -= cost
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiter = (level, next(self._order), cost, future)
+        heapq.heappush(self._waiters, waiter)
+        queued_at = time.monotonic()
+        self._drain()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if not future.done() or future.cancelled():
+                self._remove(waiter)
+            else:
+                # Granted just as we were cancelled, give the tokens back
+                self.tokens += cost
+            raise
+        metrics.observe(
+            "ceres_rate_limit_wait_seconds", time.monotonic() - queued_at,
+            priority=PRIORITY_NAMES[level], **self.labels,
+        )
+
+    def _remove(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+        self._drain()
+
+    def _drain(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self._refill()
+        while self._waiters:
+            level, _, cost, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            needed = self._needed(cost, level)
+            if self.tokens < needed:
+                self._timer = asyncio.get_running_loop().call_later((needed - self.tokens) / self.rate, self._drain)
+                return
+            heapq.heappop(self._waiters)
+            self.tokens -= cost
+            future.set_result(None)
+
+
+class BudgetThrottle:
+    """
+    Stands in for the ccxt Throttler of an exchange. ccxt hands its event
+    loop to the throttler when it opens the exchange, so this keeps a loop
+    attribute like the Throttler does, the budget itself runs on whatever
+    loop awaits it.
+    """
+
+    def __init__(self, budget, loop=None) -> None:
+        self.budget = budget
+        self.loop = loop
+
+    def __call__(self, cost=None):
+        return self.budget.throttle(cost)
@@ -0,0 +1,97 @@
+"""
+Order books in shared memory, written by feed processes and read by the bot.
+
+Every (exchange, symbol) stream owns one fixed-width slot of a single
+shared memory block:
+
+    seq (u8), received_at (f8, local time), exchange_ts (i8, ms, 0 if unknown),
+    n_bids, n_asks (i4), bids and asks as (depth, 2) price and amount (f8)
+
+Slots are protected by a seqlock: the only writer of a slot makes seq odd,
+writes the fields and makes seq even again. A reader copies the slot and
+keeps the copy only if seq was even and unchanged around the copy, so it
+never waits on the writer and never sees a torn book. This relies on the
+stores of one process becoming visible to the others in program order, as
+on x86; a reader that loses the race simply gets the next update.
+"""
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ceres.strategy.depth import to_levels
+
+
+def slot_dtype(depth):
+    return np.dtype([
+        ("seq", "<u8"),
+        ("received_at", "<f8"),
+        ("exchange_ts", "<i8"),
+        ("n_bids", "<i4"),
+        ("n_asks", "<i4"),
+        ("bids", "<f8", (depth, 2)),
+        ("asks", "<f8", (depth, 2)),
+    ], align=True)
+
+
+class SharedBooks:
+    """
+    Array of order book slots in shared memory. The bot creates it, the
+    feed processes attach to it by name.
+    """
+
+    def __init__(self, n_slots, depth=20, name=None) -> None:
+        self.n_slots = n_slots
+        self.depth = depth
+        self.dtype = slot_dtype(depth)
+        size = max(n_slots, 1) * self.dtype.itemsize
+        self._owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size if self._owner else 0)
+        self.slots = np.ndarray((n_slots,), dtype=self.dtype, buffer=self.shm.buf)
+        if self._owner:
+            self.slots["seq"] = 0
+            self.slots["n_bids"] = 0
+            self.slots["n_asks"] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, slot, order_book, received_at) -> None:
+        """Copy the top depth levels of a ccxt order book into a slot, only one process may write a slot"""
+        bids = to_levels(order_book["bids"], self.depth)
+        asks = to_levels(order_book["asks"], self.depth)
+        record = self.slots[slot:slot + 1]
+        seq = int(record["seq"][0])
+        record["seq"] = seq + 1
+        record["received_at"] = received_at
+        record["exchange_ts"] = order_book.get("timestamp") or 0
+        record["n_bids"] = len(bids)
+        record["n_asks"] = len(asks)
+        record["bids"][0, :len(bids)] = bids
+        record["asks"][0, :len(asks)] = asks
+        record["seq"] = seq + 2
+
+    def read(self, slot):
+        """
+        Consistent copy of a slot
+        :return: (order book dict of arrays, received_at) or None if the slot is empty or being written
+        """
+        seq = self.slots["seq"][slot]
+        if seq == 0 or seq % 2:
+            return None
+        record = self.slots[slot].copy()
+        if self.slots["seq"][slot] != seq:
+            return None
+        order_book = {
+            "bids": record["bids"][:record["n_bids"]],
+            "asks": record["asks"][:record["n_asks"]],
+            "timestamp": int(record["exchange_ts"]) or None,
+        }
+        return order_book, float(record["received_at"])
+
+    def close(self) -> None:
+        self.slots = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
@@ -0,0 +1,5 @@
+from ceres.metrics.histogram import Histogram
+from ceres.metrics.registry import Metrics, metrics
+from ceres.metrics.server import MetricsServer
+from ceres.metrics.looplag import LoopLagMonitor
+from ceres.metrics.profiler import SamplingProfiler
@@ -0,0 +1,80 @@
+import math
+
+# Sub-buckets per power of two, values are kept with 1/8 = 12.5% relative precision
+SUB_BITS = 3
+SUB_COUNT = 1 << SUB_BITS
+# Microseconds above 2 ** MAX_BITS (about 19 hours) land in the last bucket
+MAX_BITS = 36
+# Bucket bounds exported to Prometheus: 1us, 4us, 16us ... about 67s
+EXPORT_BOUNDS_US = [4 ** k for k in range(14)]
+
+
+def bucket_index(us):
+    if us < SUB_COUNT:
+        return us
+    shift = us.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_COUNT + (us >> shift) - SUB_COUNT
+
+
+def bucket_bounds(index):
+    """
+    :return: (lower, upper) bound of a bucket in microseconds, upper excluded
+    """
+    if index < SUB_COUNT:
+        return index, index + 1
+    shift = index // SUB_COUNT - 1
+    mantissa = index % SUB_COUNT + SUB_COUNT
+    return mantissa << shift, (mantissa + 1) << shift
+
+
+class Histogram:
+    """
+    HDR style log-linear latency histogram. Recording is a couple of
+    integer operations and a list increment, memory is fixed.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * bucket_index(1 << MAX_BITS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds) -> None:
+        if seconds < 0:
+            seconds = 0.0
+        us = int(seconds * 1e6)
+        index = bucket_index(us) if us < (1 << MAX_BITS) else len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """
+        :param p: percentile between 0 and 100
+        :return: upper bound of the bucket holding it, in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(self.count * p / 100), 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_bounds(index)[1] / 1e6, self.max)
+        return self.max
+
+    def cumulative(self):
+        """
+        :return: list of (upper bound in seconds, observations at or below it) for EXPORT_BOUNDS_US
+        """
+        result = []
+        seen = 0
+        index = 0
+        for bound in EXPORT_BOUNDS_US:
+            while index < len(self.counts) and bucket_bounds(index)[1] <= bound:
+                seen += self.counts[index]
+                index += 1
+            result.append((bound / 1e6, seen))
+        return result
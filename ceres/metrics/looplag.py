@@ -0,0 +1,152 @@
+"""
+Event loop lag monitor.
+
+A callback scheduled on the loop every interval measures how late it
+runs, which is how long anything else on the loop made it wait. The lag is
+exported as ceres_loop_lag_seconds. When the loop stays blocked beyond the
+threshold, a watchdog thread looks at what the loop thread is running at
+that moment, so the warning logged once the loop is back names the task,
+its coroutine and the line that held the loop, not only how long it did.
+"""
+import asyncio
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+
+from ceres.metrics.profiler import frame_name
+from ceres.metrics.registry import metrics
+
+logger = logging.getLogger(__name__)
+
+_CERES_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _is_coroutine(frame):
+    return bool(frame.f_code.co_flags & (inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE))
+
+
+def _qualname(frame):
+    # co_qualname is only there from Python 3.11
+    return getattr(frame.f_code, "co_qualname", frame.f_code.co_name)
+
+
+def describe_frame(frame, task=None):
+    """
+    What a thread is busy with: the task and coroutine it is stepping, or the plain callback it runs,
+    and the innermost line of ceres below it
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    if not frames:
+        return "unknown"
+    # Frames below the one the loop's Handle._run called belong to the callback or task running
+    running = frames
+    for i, caller in enumerate(frames[1:]):
+        if caller.f_code.co_name == "_run" and caller.f_code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+            running = frames[:i + 1]
+            break
+    ours = next((f for f in running if f.f_code.co_filename.startswith(_CERES_DIR)), running[0])
+    where = f" at {frame_name(ours)}"
+    coroutines = [f for f in running if _is_coroutine(f)]
+    if coroutines:
+        name = f"task {task.get_name()} " if task is not None else ""
+        return f"{name}running {_qualname(coroutines[-1])}(){where}"
+    return f"callback {_qualname(running[-1])}(){where}"
+
+
+class LoopLagMonitor:
+    """Measures the lag of an event loop and names what blocks it"""
+
+    def __init__(self, loop, interval=0.1, threshold=0.05, log_interval=1.0) -> None:
+        """
+        :param interval: seconds between two measures
+        :param threshold: lag in seconds beyond which the loop counts as blocked
+        :param log_interval: blocked loops are logged at most that often, the others are counted in the next line
+        """
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.log_interval = log_interval
+        self.thread_id = None
+        self._expected = None
+        self._handle = None
+        self._culprit = None
+        self._stop = threading.Event()
+        self._watchdog = None
+        self._logged_at = 0
+        self._unlogged = 0
+
+    @classmethod
+    def from_config(cls, config, loop):
+        monitor_config = config.get("loop_monitor", {})
+        if not monitor_config.get("enabled", True):
+            return None
+        return cls(
+            loop,
+            interval=monitor_config.get("interval", 0.1),
+            threshold=monitor_config.get("threshold", 0.05),
+            log_interval=monitor_config.get("log_interval", 1.0),
+        )
+
+    def start(self, thread_id=None) -> None:
+        """
+        :param thread_id: thread running the loop, the calling one by default
+        """
+        self.thread_id = thread_id or threading.get_ident()
+        self._stop.clear()
+        self._expected = time.monotonic() + self.interval
+        self._handle = self.loop.call_later(self.interval, self._beat)
+        self._watchdog = threading.Thread(target=self._watch, name="ceres-loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._stop.set()
+        if self._watchdog:
+            self._watchdog.join()
+            self._watchdog = None
+
+    def _beat(self):
+        now = time.monotonic()
+        lag = max(now - self._expected, 0)
+        metrics.observe("ceres_loop_lag_seconds", lag)
+        culprit, self._culprit = self._culprit, None
+        if lag > self.threshold:
+            metrics.inc("ceres_loop_blocked_total")
+            self._log_blocked(lag, culprit, now)
+        self._expected = now + self.interval
+        self._handle = self.loop.call_later(self.interval, self._beat)
+
+    def _log_blocked(self, lag, culprit, now):
+        if now - self._logged_at < self.log_interval:
+            self._unlogged += 1
+            return
+        others = f", {self._unlogged} more blocks since the last warning" if self._unlogged else ""
+        logger.warning(f"Event loop blocked for {lag * 1000:.0f} ms by {culprit or 'a callback too short to catch'}{others}")
+        self._logged_at, self._unlogged = now, 0
+
+    def _watch(self):
+        # Checking a few times per threshold catches any block lasting a little more than it
+        while not self._stop.wait(self.threshold / 4):
+            expected = self._expected
+            if self._culprit is not None or time.monotonic() - expected <= self.threshold:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            try:
+                task = asyncio.current_task(self.loop)
+            except RuntimeError:
+                task = None
+            culprit = describe_frame(frame, task)
+            del frame
+            # The loop may have caught up meanwhile, the culprit then belongs to no block
+            if self._expected == expected:
+                self._culprit = culprit
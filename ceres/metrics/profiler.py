@@ -0,0 +1,155 @@
+"""
+Sampling profiler of the trading process.
+
+A background thread looks at the stack of the event loop thread every
+interval and counts the stacks it sees. Nothing runs on the loop itself,
+so profiling costs the loop a few microseconds per sample whatever it is
+doing. As a coroutine runs inside the task stepping it, the stacks go
+from the event loop through CeresBot.main_loop or the exchange coroutine
+being run down to the function the loop was busy with, and idle time shows
+as the selector waiting for the network.
+
+Profiles are written in the folded format, one `frame;frame;frame count`
+line per stack, which flamegraph.pl, speedscope and inferno render as
+flame graphs.
+"""
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def frame_name(frame, current_line=True):
+    """
+    function (package/file.py:line) of a frame, short enough for a flame graph
+    :param current_line: the line running, otherwise the first line of the function so all its samples merge
+    """
+    code = frame.f_code
+    path = os.path.join(*code.co_filename.split(os.sep)[-2:]) if os.sep in code.co_filename else code.co_filename
+    return f"{code.co_name} ({path}:{frame.f_lineno if current_line else code.co_firstlineno})"
+
+
+def fold(frame):
+    """Stack of a frame from the outermost call, folded in one line"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame, current_line=False).replace(";", ","))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread, the one creating the profiler by
+    default. It can be started and stopped from any thread, stopping
+    writes the samples taken since the start to a new file.
+    """
+
+    def __init__(self, thread_id=None, interval=0.01, path="ceres-profile") -> None:
+        """
+        :param interval: seconds between samples
+        :param path: prefix of the profile files, the start time and .folded are appended
+        """
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.path = path
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_at = None
+        self._signal = None
+
+    @classmethod
+    def from_config(cls, config, thread_id=None):
+        profile_config = config.get("profile", {})
+        return cls(
+            thread_id,
+            interval=profile_config.get("interval", 0.01),
+            path=profile_config.get("path", "ceres-profile"),
+        )
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread:
+                return
+            self.samples = Counter()
+            self._stop.clear()
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._sample_loop, name="ceres-profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"Profiling every {self.interval * 1000:.0f} ms")
+
+    def stop(self):
+        """
+        :return: path of the profile written, None when not profiling
+        """
+        with self._lock:
+            if not self._thread:
+                return None
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            return self.dump()
+
+    def toggle(self):
+        """
+        Start profiling, or stop and write the profile
+        :return: what was done, for the log or a chat message
+        """
+        if self.running:
+            path = self.stop()
+            return f"Profile written to {path}"
+        self.start()
+        return "Profiling started"
+
+    def install_signal(self, loop, signum=getattr(signal, "SIGUSR1", None)) -> bool:
+        """
+        Toggle the profiler when the process receives signum, SIGUSR1 by default
+        :return: False where signals cannot be handled, on Windows or off the main thread
+        """
+        if signum is None:
+            return False
+        try:
+            loop.add_signal_handler(signum, lambda: logger.info(self.toggle()))
+        except (NotImplementedError, RuntimeError, ValueError):
+            return False
+        self._signal = loop, signum
+        return True
+
+    def remove_signal(self) -> None:
+        if self._signal:
+            loop, signum = self._signal
+            loop.remove_signal_handler(signum)
+            self._signal = None
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[fold(frame)] += 1
+            del frame
+
+    def dump(self, path=None):
+        """
+        Write the samples in the folded format
+        :return: path written
+        """
+        if path is None:
+            started = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started_at))
+            path = f"{self.path}-{started}.folded"
+        samples = dict(self.samples)
+        with open(path, "w") as f:
+            for stack, count in sorted(samples.items()):
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {sum(samples.values())} samples of {len(samples)} stacks to {path}")
+        return path
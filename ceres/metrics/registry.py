@@ -0,0 +1,105 @@
+from ceres.metrics.histogram import Histogram
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Metrics:
+    """Latency histograms and counters of the bot, rendered in the Prometheus text format"""
+
+    def __init__(self) -> None:
+        self.histograms = {}
+        self.counters = {}
+        self.descriptions = {}
+        self._collectors = {}
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def histogram(self, name, **labels):
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).record(seconds)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_collector(self, key, collector):
+        """
+        Gauges computed when rendering, a later collector with the same key replaces the former one
+        :param collector: function returning an iterable of (name, labels dict, value)
+        """
+        self._collectors[key] = collector
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def render(self):
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            self._header(lines, name, "counter")
+            for (counter_name, labels), value in sorted(self.counters.items()):
+                if counter_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+        gauges = {}
+        for collector in self._collectors.values():
+            for name, labels, value in collector():
+                gauges.setdefault(name, []).append((_labels(labels), value))
+        for name, values in sorted(gauges.items()):
+            self._header(lines, name, "gauge")
+            for labels, value in sorted(values):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name in sorted({name for name, _ in self.histograms}):
+            self._header(lines, name, "histogram")
+            for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if histogram_name != name:
+                    continue
+                for bound, count in histogram.cumulative():
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self.descriptions:
+            lines.append(f"# HELP {name} {self.descriptions[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+metrics = Metrics()
+metrics.describe("ceres_stage_latency_seconds", "Latency of each stage from an order book update to an order ack")
+metrics.describe("ceres_retries_total", "Exchange calls retried after an error")
+metrics.describe("ceres_orders_total", "Orders sent")
+metrics.describe("ceres_orders_rejected_total", "Orders rejected or failed")
+metrics.describe("ceres_circuit_breaker_trips_total", "Exchanges marked unhealthy")
+metrics.describe("ceres_quote_age_seconds", "Age of the quotes the strategy evaluated")
+metrics.describe("ceres_stale_quotes_total", "Quotes ignored for being older than max_quote_age")
+metrics.describe("ceres_clock_offset_seconds", "Estimated exchange clock minus local clock")
+metrics.describe("ceres_feed_latency_seconds", "Estimated mean one-way latency of the order book feed")
+metrics.describe("ceres_journal_dropped_total", "Journal rows dropped because the writer fell behind")
+metrics.describe("ceres_order_fill_seconds", "Time from sending an order to it being completely filled")
+metrics.describe("ceres_rate_budget_remaining", "Rest weight left in the rate budget of an exchange")
+metrics.describe("ceres_rate_budget_waiting", "Rest calls waiting for rate budget")
+metrics.describe("ceres_rate_limit_wait_seconds", "Time rest calls waited for rate budget")
+metrics.describe("ceres_recoveries_total", "Recoveries of one-sided executions by outcome")
+metrics.describe("ceres_recovery_seconds", "Time from the first leg filling until a one-sided execution was hedged")
+metrics.describe("ceres_order_round_trip_seconds", "Order round trip on a kept-alive (warm) or a new (cold) connection")
+metrics.describe("ceres_loop_lag_seconds", "How late the event loop ran a callback scheduled on time")
+metrics.describe("ceres_loop_blocked_total", "Times the event loop was blocked beyond the loop_monitor threshold")
+metrics.describe("ceres_strategy_errors_total", "Order book updates skipped because the strategy raised")
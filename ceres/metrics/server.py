@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsServer:
+    """Minimal HTTP server answering GET /metrics, it runs on the bot's event loop"""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9108) -> None:
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @classmethod
+    def from_config(cls, config, metrics):
+        metrics_config = config.get("metrics", {})
+        if not metrics_config.get("enabled", False):
+            return None
+        return cls(metrics, metrics_config.get("host", "127.0.0.1"), metrics_config.get("port", 9108))
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.metrics.render()
+            else:
+                status, body = "404 Not Found", "Not found\n"
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,328 @@
+import asyncio
+import logging
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from ceres.exchange.ordermanager import DONE
+from ceres.metrics import metrics
+from ceres.strategy.depth import cumulative, to_levels, worst_price
+
+logger = logging.getLogger(__name__)
+
+
+class Recovery(NamedTuple):
+    """Outcome of hedging the exposure an execution left on one symbol"""
+
+    symbol: str
+    side: str
+    amount: float
+    reference_price: float
+    filled: float = 0
+    price: Optional[float] = None
+    slippage: Optional[float] = None
+    exposed_for: float = 0
+    exchanges: str = ""
+    status: str = "failed"
+
+
+class RecoveryEngine:
+    """
+    Closes what an execution left one-sided. A symbol bought and sold in
+    the same execution should net to zero once fees are accounted for; when
+    a leg failed or filled less than the others, the missing amount is
+    bought or sold right away on the venue with the best price for it in
+    the current books. That is the next-best venue for the missing leg, or
+    unwinding the filled leg where it was filled when that is cheaper.
+    Venues which refuse the order are skipped on the next attempt, and a
+    recovery whose price is more than max_slippage off the price of the
+    missing leg is not sent. Recovery orders are limited at that bound
+    rather than at the book, so they still fill when the market moved a
+    little since the book arrived.
+
+    Legs still resting on an exchange may yet fill, so a symbol with such
+    legs is settled once the order manager reports them done, and what
+    their cancelled remainders left one-sided is hedged then.
+    """
+
+    def __init__(self, exchangeshandler, wallets, fee_rate, max_slippage=0.02, max_attempts=3, max_quote_age=10,
+                 journal=None, on_execution=None) -> None:
+        """
+        :param fee_rate: callable (exchange, symbol) -> taker fee rate
+        :param on_execution: called with the ExecutionResult of every recovery order, to book it
+        """
+        self.exchangeshandler = exchangeshandler
+        self.wallets = wallets
+        self.fee_rate = fee_rate
+        self.max_slippage = max_slippage
+        self.max_attempts = max_attempts
+        self.max_quote_age = max_quote_age
+        self.journal = journal
+        self.on_execution = on_execution
+        # Set when an order manager reports resting orders done, otherwise only what filled at the ack counts
+        self.follow_open_orders = False
+        self._waiting = {}
+        self._tasks = set()
+
+    @classmethod
+    def from_config(cls, config, exchangeshandler, wallets, fee_rate, journal=None, on_execution=None):
+        recovery_config = config.get("recovery", {})
+        if not recovery_config.get("enabled", True):
+            return None
+        return cls(
+            exchangeshandler,
+            wallets,
+            fee_rate,
+            max_slippage=recovery_config.get("max_slippage", 0.02),
+            max_attempts=recovery_config.get("max_attempts", 3),
+            max_quote_age=config.get("max_quote_age", 10),
+            journal=journal,
+            on_execution=on_execution,
+        )
+
+    @staticmethod
+    def _is_open(leg):
+        return leg.ok and leg.result.get("status") not in DONE
+
+    @staticmethod
+    def _state(exchange, order, result=None):
+        """What a leg traded so far, in the shape of a ccxt order"""
+        result = result or {}
+        return {
+            "exchange": exchange,
+            "side": order["side"],
+            "price": order["price"],
+            "amount": order["amount"],
+            "filled": result.get("filled") or 0,
+            "fee": result.get("fee"),
+        }
+
+    def _min_amount(self, symbol):
+        """Smallest amount any exchange accepts, less than that cannot be hedged"""
+        amounts = [
+            template.min_amount for exchange in self.exchangeshandler.exchanges.values()
+            for template in [getattr(exchange, "templates", {}).get(symbol)] if template
+        ]
+        return min(amounts, default=0)
+
+    def exposure(self, symbol, states, reference=None):
+        """
+        Base amount legs of one symbol left unhedged, after the fees they paid in the base currency.
+        Residuals within the taker fees of the legs are what the strategies leave by sizing the sell
+        legs net of fees, not exposure.
+        :param states: what every leg traded, see _state
+        :param reference: price of the missing side, the average price of its legs by default
+        :return: (amount, price of the missing side), amount positive when we are long, None if it nets out
+        """
+        base = symbol.split("/")[0]
+        amount = allowance = 0
+        for state in states:
+            fee = state["fee"] or {}
+            # Like the balances, a fee without a currency is paid in the quote currency
+            fee_in_base = (fee.get("cost") or 0) if fee.get("currency") == base else 0
+            if state["side"] == "buy":
+                amount += state["filled"] - fee_in_base
+            else:
+                amount -= state["filled"] + fee_in_base
+            allowance += state["filled"] * self.fee_rate(state["exchange"], symbol)
+        if abs(amount) <= max(self._min_amount(symbol), allowance, 1e-12):
+            return None
+        if reference is None:
+            missing = [state for state in states if state["side"] == ("sell" if amount > 0 else "buy")]
+            reference = (
+                sum(state["price"] * state["amount"] for state in missing) / sum(state["amount"] for state in missing)
+            )
+        return amount, reference
+
+    def _wait_for(self, symbol, states, open_keys, opportunity_id, exposed_since, reference=None):
+        """
+        Settle states once the orders of open_keys are done
+        :param open_keys: dict (exchange, order id) -> index of its state
+        """
+        group = {
+            "symbol": symbol, "states": states, "open": dict(open_keys), "reference": reference,
+            "opportunity_id": opportunity_id, "exposed_since": exposed_since,
+        }
+        for key in open_keys:
+            self._waiting[key] = group
+
+    def on_order_done(self, exchange, order, filled, fee=None) -> None:
+        """
+        Called by the order manager when an order it followed is filled or cancelled
+        :param fee: the fees the order paid, as in a ccxt order
+        """
+        key = (exchange, order.get("id"))
+        group = self._waiting.pop(key, None)
+        if group is None:
+            return
+        state = group["states"][group["open"].pop(key)]
+        state["filled"], state["fee"] = filled, fee
+        if group["open"]:
+            return
+        exposure = self.exposure(group["symbol"], group["states"], group["reference"])
+        if exposure:
+            amount, reference = exposure
+            self._spawn(self._recover(group["symbol"], amount, reference, group["exposed_since"], group["opportunity_id"]))
+
+    def _spawn(self, coro):
+        task = self.exchangeshandler.loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def stop(self) -> None:
+        """Let running recoveries finish, including those of orders cancelled while stopping"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def recover(self, execution, opportunity_id=None):
+        """
+        Hedge whatever the execution left one-sided, symbols traded on one side only, like most
+        legs of a cycle, are not expected to net out
+        :return: list of Recovery, empty when every symbol nets out or waits for resting legs
+        """
+        legs = {}
+        for leg in execution.legs:
+            legs.setdefault(leg.order["symbol"], []).append(leg)
+        exposed_since = min((leg.acked_at for leg in execution.placed_legs), default=execution.finished_at)
+        exposure = {}
+        for symbol, symbol_legs in legs.items():
+            if len({leg.order["side"] for leg in symbol_legs}) < 2:
+                continue
+            states = [self._state(leg.exchange, leg.order, leg.result if leg.ok else None) for leg in symbol_legs]
+            open_keys = {
+                (leg.exchange, leg.result.get("id")): i for i, leg in enumerate(symbol_legs)
+                if self._is_open(leg) and leg.result.get("id")
+            }
+            if open_keys and self.follow_open_orders:
+                self._wait_for(symbol, states, open_keys, opportunity_id, exposed_since)
+                continue
+            symbol_exposure = self.exposure(symbol, states)
+            if symbol_exposure:
+                exposure[symbol] = symbol_exposure
+        if not exposure:
+            return []
+        # Stopping the bot must not leave a hedge half done, stop() waits for it instead
+        return await asyncio.shield(self._spawn(self._recover_all(exposure, exposed_since, opportunity_id)))
+
+    async def _recover_all(self, exposure, exposed_since, opportunity_id):
+        return await asyncio.gather(*[
+            self._recover(symbol, amount, reference, exposed_since, opportunity_id)
+            for symbol, (amount, reference) in exposure.items()
+        ])
+
+    def quote(self, symbol, side, amount, exclude=()):
+        """
+        Best venue to buy or sell amount on in the current books, after fees and within the balances
+        :return: (order dict limited at the worst level touched, expected average price) or (None, None)
+        """
+        base, quote = symbol.split("/")
+        now = self.exchangeshandler.now()
+        book_store = self.exchangeshandler.book_store
+        best, best_value = (None, None), None
+        for ex in self.exchangeshandler.exchanges_list:
+            if ex in exclude or not self.exchangeshandler.is_healthy(ex):
+                continue
+            ob = book_store.get(ex, symbol)
+            if ob is None or book_store.quote_age(ex, symbol, now) > self.max_quote_age:
+                continue
+            side_levels = ob["asks"] if side == "buy" else ob["bids"]
+            levels = to_levels(side_levels, len(side_levels))
+            amounts, costs = cumulative(levels)
+            if amounts[-1] < amount:
+                continue
+            price = worst_price(levels, amounts, amount)
+            template = getattr(self.exchangeshandler.exchanges[ex], "templates", {}).get(symbol)
+            if template and template.check(amount, price):
+                continue
+            average = float(np.interp(amount, amounts, costs)) / amount
+            fee = self.fee_rate(ex, symbol)
+            if side == "buy":
+                value = -average * (1 + fee)
+                funded = self.wallets.check_free_amount(ex, quote, amount * price * (1 + fee))
+            else:
+                value = average * (1 - fee)
+                funded = self.wallets.check_free_amount(ex, base, amount)
+            if funded and (best_value is None or value > best_value):
+                order = {"exchange": ex, "symbol": symbol, "type": "limit", "side": side, "amount": amount, "price": price}
+                best, best_value = (order, average), value
+        return best
+
+    async def _recover(self, symbol, amount, reference, exposed_since, opportunity_id):
+        side = "sell" if amount > 0 else "buy"
+        remaining = abs(amount)
+        logger.warning(f"Execution left {amount:+} {symbol} unhedged, {side}ing it")
+        min_amount = max(self._min_amount(symbol), 1e-12)
+        filled = cost = 0
+        exchanges = []
+        excluded = set()
+        status = "no_venue"
+        for _ in range(self.max_attempts):
+            order, average = self.quote(symbol, side, remaining, excluded)
+            if order is None:
+                status = "no_venue"
+                break
+            if self._slippage(side, average, reference) > self.max_slippage:
+                status = "too_expensive"
+                logger.warning(
+                    f"Not {side}ing {remaining} {symbol} on {order['exchange']} at {average}, "
+                    f"more than {self.max_slippage:.2%} off {reference}"
+                )
+                break
+            limit = reference * (1 - self.max_slippage) if side == "sell" else reference * (1 + self.max_slippage)
+            # Immediate or cancel, a hedge left resting would be exposure again
+            execution = await self.exchangeshandler.create_orders([dict(order, price=limit, params={"timeInForce": "IOC"})])
+            if self.on_execution:
+                self.on_execution(execution, opportunity_id)
+            leg = execution.legs[0]
+            if not leg.ok:
+                excluded.add(order["exchange"])
+                status = "failed"
+                continue
+            got = leg.result.get("filled") or 0
+            if self._is_open(leg) and self.follow_open_orders and leg.result.get("id"):
+                # The exchange let the rest of the order rest, whatever it leaves unfilled is hedged once it is done
+                exposed = self._state(
+                    leg.exchange, dict(leg.order, side="buy" if side == "sell" else "sell"), {"filled": leg.order["amount"]}
+                )
+                states = [exposed, self._state(leg.exchange, leg.order, leg.result)]
+                self._wait_for(symbol, states, {(leg.exchange, leg.result["id"]): 1}, opportunity_id, exposed_since, reference)
+                got = leg.order["amount"]
+            if got:
+                exchanges.append(order["exchange"])
+            filled += got
+            cost += got * (leg.result.get("average") or order["price"])
+            remaining -= got
+            if remaining < min_amount:
+                status = "recovered"
+                break
+            status = "partial" if filled else "failed"
+        price = cost / filled if filled else None
+        recovery = Recovery(
+            symbol, side, abs(amount), reference, filled, price,
+            self._slippage(side, price, reference) if price else None,
+            self.exchangeshandler.now() - exposed_since, ",".join(exchanges), status,
+        )
+        self._report(recovery, opportunity_id)
+        return recovery
+
+    @staticmethod
+    def _slippage(side, price, reference):
+        """Relative price given up against the missing leg, positive when worse"""
+        if side == "sell":
+            return (reference - price) / reference
+        return (price - reference) / reference
+
+    def _report(self, recovery, opportunity_id):
+        metrics.inc("ceres_recoveries_total", status=recovery.status)
+        metrics.observe("ceres_recovery_seconds", recovery.exposed_for, status=recovery.status)
+        slippage = f"{recovery.slippage:+.4%}" if recovery.slippage is not None else "n/a"
+        log = logger.info if recovery.status == "recovered" else logger.warning
+        log(
+            f"Recovery of {recovery.amount} {recovery.symbol} {recovery.status}: {recovery.side} {recovery.filled} "
+            f"on {recovery.exchanges or 'no exchange'} at {recovery.price}, slippage {slippage}, "
+            f"exposed for {recovery.exposed_for * 1000:.1f} ms"
+        )
+        if self.journal:
+            self.journal.record_recovery(opportunity_id, recovery)
@@ -1 +1,6 @@
-from ceres.remote.telegram import Telegram
+def __getattr__(name):
+    # python-telegram-bot is only imported when telegram is enabled
+    if name == "Telegram":
+        from ceres.remote.telegram import Telegram
+        return Telegram
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Notifier:
+    """
+    Sends notifications from a background thread so the trading loop never
+    waits on a chat api. push() only appends to a bounded queue; the worker
+    coalesces everything queued within batch_window seconds into one message
+    and sends at most one message every min_interval seconds. When the queue
+    is full messages are dropped and the next message says how many.
+    """
+
+    def __init__(self, send, queue_size=100, batch_window=0.5, min_interval=1.0, max_length=4096) -> None:
+        """
+        :param send: blocking function sending one message
+        """
+        self.send = send
+        self.batch_window = batch_window
+        self.min_interval = min_interval
+        self.max_length = max_length
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+        self._last_sent = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = threading.Thread(target=self._send_loop, name="ceres-notifier", daemon=True)
+        self._worker.start()
+
+    def push(self, message) -> None:
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+    def close(self, timeout=5.0) -> None:
+        """Send what is still queued and stop the worker, waiting at most timeout seconds"""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Notification queue is still full, dropping the remaining messages")
+            return
+        self._worker.join(timeout)
+
+    def _send_loop(self):
+        stopping = False
+        while not stopping:
+            message = self._queue.get()
+            if message is None:
+                break
+            messages = [message]
+            stopping = self._collect(messages, time.monotonic() + self.batch_window)
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0 and not stopping:
+                # Whatever arrives while we respect the rate limit joins this message
+                stopping = self._collect(messages, time.monotonic() + wait)
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            try:
+                self.send(self._coalesce(messages, dropped))
+            except Exception as e:
+                logger.warning(f"Could not send notification: {e}")
+            self._last_sent = time.monotonic()
+
+    def _collect(self, messages, deadline):
+        """
+        Append messages arriving before deadline
+        :return: True if the notifier is closing
+        """
+        while True:
+            timeout = deadline - time.monotonic()
+            try:
+                message = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return False
+            if message is None:
+                return True
+            messages.append(message)
+
+    def _coalesce(self, messages, dropped):
+        """Join messages up to max_length and summarize the rest"""
+        text = messages[0][:self.max_length]
+        skipped = dropped
+        for i, message in enumerate(messages[1:], start=1):
+            if len(text) + len(message) + 2 > self.max_length - 64:
+                skipped += len(messages) - i
+                break
+            text += "\n\n" + message
+        if skipped:
+            text += f"\n\n... and {skipped} more notifications"
+        return text
@@ -1,10 +1,12 @@
 import logging
+import time
 from typing import Any, Dict
 
 from telegram import ParseMode, Update
-from telegram.error import NetworkError, TelegramError
-from telegram.ext import CallbackContext, CommandHandler, Updater
+from telegram.error import NetworkError, RetryAfter, TelegramError
+from telegram.ext import CallbackContext, CommandHandler, Filters, Updater
 from ceres.config import Config
+from ceres.remote.notifier import Notifier
 
 logger = logging.getLogger(__name__)
 
@@ -14,16 +16,25 @@ class Telegram:
     This class handles all telegram communication
     """
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, on_profile=None) -> None:
         """
         Init the Telegram call
         :param config: Configuration object as dictionary
+        :param on_profile: called by /profile to start or stop profiling, returns the message to answer
         :return: None
         """
         self.config = config
+        self.on_profile = on_profile
         self.token = self.config.telegram_token
         self.chat_id = self.config.telegram_chat_id
         self._updater = Updater(token=self.token, use_context=True)
+        telegram_config = self.config.telegram
+        self._notifier = Notifier(
+            self._send_message,
+            queue_size=telegram_config.get("queue_size", 100),
+            batch_window=telegram_config.get("batch_window", 0.5),
+            min_interval=telegram_config.get("min_interval", 1.0),
+        )
         self._init()
 
     def _init(self) -> None:
@@ -36,6 +47,9 @@ class Telegram:
             CommandHandler("help", self._help),
             CommandHandler("version", self._version),
         ]
+        if self.on_profile:
+            # Profiling writes files on the host, only the configured chat may start it
+            handles.append(CommandHandler("profile", self._profile, filters=self._chat_filter()))
 
         for handle in handles:
             self._updater.dispatcher.add_handler(handle)
@@ -47,6 +61,16 @@ class Telegram:
             [h.command for h in handles],
         )
 
+    def _chat_filter(self):
+        """
+        Filter on the configured chat, given by its id or, for a channel, its @username
+        :return: Filters.chat
+        """
+        chat_id = str(self.chat_id)
+        if chat_id.lstrip("-").isdigit():
+            return Filters.chat(chat_id=int(chat_id))
+        return Filters.chat(username=chat_id.lstrip("@"))
+
     def _start(self, update: Update, context: CallbackContext) -> None:
         """
         Handler for /start.
@@ -71,6 +95,8 @@ class Telegram:
             "*/version:* `Show version of the bot`\n"
             "*/help:* `Show this help message`\n"
         )
+        if self.on_profile:
+            help_msg += "*/profile:* `Start profiling, or stop and write the profile`\n"
         self._send_message(help_msg, parse_mode=ParseMode.MARKDOWN)
 
     def _version(self, update: Update, context: CallbackContext) -> None:
@@ -83,9 +109,31 @@ class Telegram:
         """
         self._send_message(f"*Ceres version:* {0.1}")
 
-    def send_message(self,msg) -> None:
-        
-        self._send_message(msg) 
+    def _profile(self, update: Update, context: CallbackContext) -> None:
+        """
+        Handler for /profile.
+        Start or stop the profiler and tell where the profile went
+        :param bot: telegram bot
+        :param update: message update
+        :return: None
+        """
+        self._send_message(self.on_profile(), parse_mode=None)
+
+    def send_message(self, msg) -> None:
+        """
+        Queue a message, it is sent from a background thread
+        :param msg: message
+        :return: None
+        """
+        self._notifier.push(msg)
+
+    def close(self) -> None:
+        """
+        Send the queued messages and stop polling
+        :return: None
+        """
+        self._notifier.close()
+        self._updater.stop()
 
     def _send_message(self, message: str, parse_mode: str = ParseMode.MARKDOWN) -> None:
         """
@@ -99,6 +147,13 @@ class Telegram:
                 self._updater.bot.send_message(
                     chat_id=self.chat_id, text=message, parse_mode=parse_mode
                 )
+            except RetryAfter as retry_after:
+                # Rate limited by telegram, only the notification thread waits here
+                logger.warning(f"TelegramError: {retry_after.message}! Retrying in {retry_after.retry_after}s.")
+                time.sleep(retry_after.retry_after)
+                self._updater.bot.send_message(
+                    chat_id=self.chat_id, text=message, parse_mode=parse_mode
+                )
             except NetworkError as network_err:
                 # Sometimes the telegram server resets the current connection,
                 # if this is the case we send the message again.
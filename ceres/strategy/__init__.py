@@ -1,2 +1,8 @@
 from ceres.strategy.spotarbitrage import SpotArbitrage
+from ceres.strategy.cyclearbitrage import CycleArbitrage
 from ceres.strategy.strategybase import StrategyBase
+
+STRATEGIES = {
+    "spot_arbitrage": SpotArbitrage,
+    "cycle_arbitrage": CycleArbitrage,
+}
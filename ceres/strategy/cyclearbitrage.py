@@ -0,0 +1,214 @@
+import logging
+import math
+from collections import Counter
+
+from ceres.strategy.cyclegraph import CycleGraph
+from ceres.strategy.spotarbitrage import Fees, Limits
+from ceres.strategy.strategybase import StrategyBase
+
+logger = logging.getLogger(__name__)
+
+
+class CycleArbitrage(StrategyBase):
+    """
+    Triangular and multi-leg cycle arbitrage.
+    Nodes of the currency graph are (exchange, currency). Every market adds
+    a buy edge quote -> base and a sell edge base -> quote weighted by
+    -log(rate after taker fee), so a profitable cycle is a negative cycle.
+    With cycle_cross_exchange the same currency on two exchanges is linked
+    with weight 0, as all legs are executed at once from the inventory held
+    on each exchange. Profits and fees are reported in profit_currency,
+    converted at the mid prices of the watched markets, whatever currency a
+    cycle starts with.
+    """
+
+    def __init__(self, config, exchangeshandler, wallets=None) -> None:
+        super().__init__(config, exchangeshandler, wallets)
+        self.symbols = self.exchangeshandler.symbols
+        self.cross_exchange = self._config.get("cycle_cross_exchange", True)
+        # The quote most symbols share unless configured, e.g. USDT
+        self.profit_currency = self._config.get("profit_currency") or Counter(
+            symbol.split("/")[1] for symbol in self.symbols
+        ).most_common(1)[0][0]
+        self.fees = Fees()
+        self.limits = Limits()
+        self.graph = CycleGraph()
+        # (exchange, symbol) -> (bid, bid amount, ask, ask amount)
+        self.tops = {}
+        self._get_fees()
+        self._add_transfer_edges()
+
+    def update_markets(self):
+        self._get_fees()
+
+    def _get_fees(self):
+        markets = self.exchangeshandler.get_markets()
+        for ex, market in markets.items():
+            for symbol in self.symbols:
+                m = market.get(symbol, None)
+                if m:
+                    self.fees.update(ex, m)
+                    self.limits.update(ex, m)
+        logger.info(f"Loaded fees of {len(self.symbols)} symbols")
+
+    def _add_transfer_edges(self):
+        if not self.cross_exchange:
+            return
+        currencies = {currency for symbol in self.symbols for currency in symbol.split("/")}
+        exchanges = self.exchangeshandler.current_exchanges
+        for currency in currencies:
+            for ex_from in exchanges:
+                for ex_to in exchanges:
+                    if ex_from != ex_to:
+                        self.graph.set_weight((ex_from, currency), (ex_to, currency), 0.0)
+
+    def check_opportunity(self, updates=None):
+        book_store = self.exchangeshandler.book_store
+        if updates is None:
+            updates = [(ex, symbol) for symbol in self.symbols for ex in book_store.get_books(symbol)]
+        cycles = []
+        for ex, symbol in updates:
+            ob = book_store.get(ex, symbol)
+            if ob is None:
+                self._remove_market(ex, symbol)
+                continue
+            if not len(ob["bids"]) or not len(ob["asks"]):
+                continue
+            cycles += self._update_market(ex, symbol, ob)
+        best = False, {}
+        now = self.exchangeshandler.now()
+        for cycle in cycles:
+            orders = self._size_cycle(cycle, now)
+            if orders and (not best[0] or float(orders["profit"]["profit"]) > float(best[1]["profit"]["profit"])):
+                best = True, orders
+        return best
+
+    def _update_market(self, ex, symbol, ob):
+        bid, bid_amount = ob["bids"][0][:2]
+        ask, ask_amount = ob["asks"][0][:2]
+        self.tops[(ex, symbol)] = (bid, bid_amount, ask, ask_amount)
+        base, quote = symbol.split("/")
+        fee = self.fees.taker(ex, symbol)
+        cycles = self.graph.set_weight((ex, base), (ex, quote), -math.log(bid * (1 - fee)))
+        cycles += self.graph.set_weight((ex, quote), (ex, base), -math.log((1 - fee) / ask))
+        return cycles
+
+    def _remove_market(self, ex, symbol):
+        """Take the edges of a market out of the graph, e.g. when its exchange is unhealthy"""
+        if self.tops.pop((ex, symbol), None) is None:
+            return
+        base, quote = symbol.split("/")
+        self.graph.remove((ex, base), (ex, quote))
+        self.graph.remove((ex, quote), (ex, base))
+
+    def _market(self, ex, currency_from, currency_to):
+        """Symbol and side trading currency_from into currency_to"""
+        if f"{currency_to}/{currency_from}" in self.fees.fees.get(ex, {}):
+            return f"{currency_to}/{currency_from}", "buy"
+        return f"{currency_from}/{currency_to}", "sell"
+
+    def _mid(self, currency_from, currency_to):
+        """Mid price of currency_from in currency_to on any exchange quoting a market of both, None if none does"""
+        for symbol, invert in ((f"{currency_from}/{currency_to}", False), (f"{currency_to}/{currency_from}", True)):
+            for ex in self.exchangeshandler.current_exchanges:
+                top = self.tops.get((ex, symbol))
+                if top:
+                    mid = (top[0] + top[2]) / 2
+                    return 1 / mid if invert else mid
+        return None
+
+    def _value(self, currency):
+        """
+        Price of one unit of currency in the profit currency, directly or through one other currency
+        :return: None when no watched market links them
+        """
+        if currency == self.profit_currency:
+            return 1.0
+        direct = self._mid(currency, self.profit_currency)
+        if direct:
+            return direct
+        for symbol in self.symbols:
+            base, quote = symbol.split("/")
+            if currency in (base, quote):
+                other = quote if currency == base else base
+                step, onward = self._mid(currency, other), self._mid(other, self.profit_currency)
+                if step and onward:
+                    return step * onward
+        return None
+
+    def _size_cycle(self, cycle, now):
+        """
+        Turn a cycle into orders, sized by the top of book amounts and the
+        free balances of every leg, expressed in the currency the cycle starts with
+        """
+        weight = self.graph.cycle_weight(cycle)
+        if weight >= 0:
+            return None
+        legs = []
+        start_amount = math.inf
+        scale = 1.0
+        for (ex_from, currency_from), (ex_to, currency_to) in zip(cycle, cycle[1:]):
+            if ex_from != ex_to:
+                continue
+            symbol, side = self._market(ex_from, currency_from, currency_to)
+            if (ex_from, symbol) not in self.tops:
+                return None
+            if not self._is_fresh(ex_from, symbol, now):
+                logger.info(f"Ignoring stale {symbol} quotes of {ex_from}")
+                self._remove_market(ex_from, symbol)
+                return None
+            bid, bid_amount, ask, ask_amount = self.tops[(ex_from, symbol)]
+            fee = self.fees.taker(ex_from, symbol)
+            leg_cap = ask * ask_amount if side == "buy" else bid_amount
+            if self.wallets:
+                leg_cap = min(leg_cap, self.wallets.get_free(ex_from, currency_from))
+            start_amount = min(start_amount, leg_cap / scale)
+            legs.append((ex_from, symbol, side, scale))
+            scale *= (1 - fee) / ask if side == "buy" else bid * (1 - fee)
+        if not legs or not 0 < start_amount < math.inf:
+            return None
+
+        orders = []
+        for ex, symbol, side, leg_scale in legs:
+            bid, _, ask, _ = self.tops[(ex, symbol)]
+            price = ask if side == "buy" else bid
+            amount = start_amount * leg_scale
+            if side == "buy":
+                amount /= price
+            amount = self.exchangeshandler.exchanges[ex].round_amount(symbol, amount)
+            limits = self.limits.get(ex, symbol)
+            if amount <= 0 or amount < limits.get("min_amount", 0) or amount * price < limits.get("min_cost", 0):
+                return None
+            orders.append({
+                'exchange': ex,
+                'symbol': symbol,
+                'type': 'limit',
+                'side': side,
+                'amount': amount,
+                'price': price
+            })
+
+        # Profit is in the start currency and fees in the quote of each leg, report both in the profit currency
+        values = {currency: self._value(currency) for currency in
+                  {cycle[0][1]} | {order['symbol'].split("/")[1] for order in orders}}
+        if None in values.values():
+            logger.debug(f"Cannot value the cycle in {self.profit_currency}, no market links {values}")
+            return None
+        profit_rate = math.exp(-weight) - 1
+        profit = start_amount * profit_rate * values[cycle[0][1]]
+        fees = sum(
+            self.fees.taker(o['exchange'], o['symbol']) * o['amount'] * o['price'] * values[o['symbol'].split("/")[1]]
+            for o in orders
+        )
+        logger.info(
+            f"Found cycle opportunity {' -> '.join(f'{c}@{ex}' for ex, c in cycle)}: "
+            f"{profit_rate * 100:.4f}% on {start_amount} {cycle[0][1]}, {profit:.5f} {self.profit_currency}"
+        )
+        return {
+            'exchange_orders': orders,
+            'profit': {
+                'profit': "%.5f" % profit,
+                'profit_pct': "%.6f" % (profit_rate * 100),
+                'fees': fees,
+            }
+        }
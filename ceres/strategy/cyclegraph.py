@@ -0,0 +1,102 @@
+import heapq
+import math
+from collections import defaultdict
+
+EPSILON = 1e-12
+
+
+class CycleGraph:
+    """
+    Directed weighted graph with incremental negative cycle detection.
+    A potential p is maintained with p(v) <= p(u) + w(u, v) for every
+    admitted edge, which exists only while the admitted edges contain no
+    negative cycle. Raising a weight never breaks it, so that costs O(1).
+    Lowering a weight that breaks it repairs the potentials with a
+    Dijkstra-like search starting at the edge's head, which only visits
+    the nodes whose potential has to change. If the search reaches the
+    edge's tail the edge closes a negative cycle: it is then kept aside
+    until its weight changes or another weight rises, instead of
+    re-running Bellman-Ford over the whole graph.
+    """
+
+    def __init__(self) -> None:
+        self.weights = {}
+        self._out = defaultdict(dict)
+        self._potential = defaultdict(float)
+        self._rejected = set()
+
+    def set_weight(self, u, v, weight):
+        """
+        Set the weight of edge u -> v
+        :return: list of negative cycles found, each a list of nodes starting and ending with the same node
+        """
+        old = self.weights.get((u, v))
+        self.weights[(u, v)] = weight
+        if (u, v) in self._rejected:
+            self._rejected.discard((u, v))
+            cycles = self._admit(u, v, weight)
+        elif old is not None and weight >= old:
+            self._out[u][v] = weight
+            cycles = []
+        else:
+            self._out[u].pop(v, None)
+            cycles = self._admit(u, v, weight)
+        if old is not None and weight > old:
+            cycles += self._retry_rejected(skip=(u, v))
+        return cycles
+
+    def remove(self, u, v) -> None:
+        self.weights.pop((u, v), None)
+        self._out[u].pop(v, None)
+        self._rejected.discard((u, v))
+
+    def cycle_weight(self, cycle) -> float:
+        return sum(self.weights[(a, b)] for a, b in zip(cycle, cycle[1:]))
+
+    def _retry_rejected(self, skip=None):
+        cycles = []
+        for u, v in list(self._rejected):
+            if (u, v) == skip:
+                continue
+            self._rejected.discard((u, v))
+            cycles += self._admit(u, v, self.weights[(u, v)])
+        return cycles
+
+    def _admit(self, u, v, weight):
+        potential = self._potential
+        if potential[u] + weight >= potential[v] - EPSILON:
+            self._out[u][v] = weight
+            return []
+
+        updated = {v: potential[u] + weight}
+        pred = {v: u}
+        heap = [(updated[v] - potential[v], v)]
+        while heap:
+            delta, x = heapq.heappop(heap)
+            if delta > updated[x] - potential[x]:
+                continue
+            for y, w in self._out[x].items():
+                candidate = updated[x] + w
+                if candidate >= potential[y] - EPSILON or candidate >= updated.get(y, math.inf):
+                    continue
+                pred[y] = x
+                if y == u:
+                    self._rejected.add((u, v))
+                    return [self._trace(pred, u, v)]
+                updated[y] = candidate
+                heapq.heappush(heap, (candidate - potential[y], y))
+
+        potential.update(updated)
+        self._out[u][v] = weight
+        return []
+
+    @staticmethod
+    def _trace(pred, u, v):
+        path = [u]
+        node = u
+        while node != v:
+            node = pred[node]
+            path.append(node)
+        path.append(u)
+        path.reverse()
+        return path
@@ -0,0 +1,101 @@
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Sizing(NamedTuple):
+    """Best size to buy on one book and sell into another"""
+
+    amount: float
+    cost: float
+    proceeds: float
+    buy_fee: float
+    sell_fee: float
+    profit: float
+    buy_price: float
+    sell_price: float
+
+
+def to_levels(side, depth):
+    """Top depth levels of a ccxt order book side as a (n, 2) array of price and amount"""
+    levels = np.array(side[:depth], dtype=float)
+    if levels.ndim != 2 or not len(levels):
+        return np.empty((0, 2))
+    return levels[:, :2]
+
+
+def cumulative(levels):
+    """
+    Cumulative amount and cost of walking the levels, both starting at 0,
+    so cost for any amount can be interpolated linearly
+    """
+    amounts = np.concatenate(([0.0], np.cumsum(levels[:, 1])))
+    costs = np.concatenate(([0.0], np.cumsum(levels[:, 0] * levels[:, 1])))
+    return amounts, costs
+
+
+def vwap(levels):
+    """Volume weighted average price for every cumulative level"""
+    amounts, costs = cumulative(levels)
+    return costs[1:] / amounts[1:]
+
+
+def worst_price(levels, amounts, amount):
+    """Price of the deepest level touched when walking amount through the levels"""
+    idx = np.searchsorted(amounts, amount, side="left") - 1
+    return levels[min(max(idx, 0), len(levels) - 1), 0]
+
+
+def best_size(asks, bids, buy_fee_rate, sell_fee_rate, min_amount=0, max_amount=math.inf,
+              max_cost=math.inf, min_cost=0, precision=None, asks_cumulative=None, bids_cumulative=None):
+    """
+    Size maximizing the profit after taker fees of buying from asks and selling into bids.
+    The profit is piecewise linear with decreasing slope between the level
+    boundaries of both books, so the maximum is at one of those boundaries
+    or at a limit.
+    :param max_cost: quote currency available for the buy including fees
+    :param precision: optional callable rounding an amount down to the market precision
+    :param asks_cumulative: cumulative of the asks when already known, e.g. from OrderBook.cumulative
+    :param bids_cumulative: cumulative of the bids when already known
+    :return: Sizing or None when no size is profitable within the limits
+    """
+    if not len(asks) or not len(bids):
+        return None
+    ask_amounts, ask_costs = asks_cumulative or cumulative(asks)
+    bid_amounts, bid_proceeds = bids_cumulative or cumulative(bids)
+    limit = min(max_amount, ask_amounts[-1], bid_amounts[-1])
+    if max_cost < math.inf:
+        limit = min(limit, np.interp(max_cost / (1 + buy_fee_rate), ask_costs, ask_amounts))
+    if limit <= 0 or limit < min_amount:
+        return None
+
+    sizes = np.sort(np.concatenate((ask_amounts, bid_amounts)))
+    sizes = np.append(sizes[(sizes > 0) & (sizes < limit)], limit)
+    costs = np.interp(sizes, ask_amounts, ask_costs)
+    proceeds = np.interp(sizes, bid_amounts, bid_proceeds)
+    profits = proceeds * (1 - sell_fee_rate) - costs * (1 + buy_fee_rate)
+    profits[(sizes < min_amount) | (costs < min_cost) | (proceeds < min_cost)] = -np.inf
+    i = int(np.argmax(profits))
+    amount = sizes[i]
+    if precision is not None:
+        amount = precision(amount)
+        if amount <= 0 or amount < min_amount:
+            return None
+    cost = float(np.interp(amount, ask_amounts, ask_costs))
+    proceeds = float(np.interp(amount, bid_amounts, bid_proceeds))
+    buy_fee = cost * buy_fee_rate
+    sell_fee = proceeds * sell_fee_rate
+    profit = proceeds - cost - buy_fee - sell_fee
+    if profit <= 0 or cost < min_cost or proceeds < min_cost:
+        return None
+    return Sizing(
+        amount=float(amount),
+        cost=cost,
+        proceeds=proceeds,
+        buy_fee=buy_fee,
+        sell_fee=sell_fee,
+        profit=profit,
+        buy_price=float(worst_price(asks, ask_amounts, amount)),
+        sell_price=float(worst_price(bids, bid_amounts, amount)),
+    )
@@ -0,0 +1,130 @@
+import numpy as np
+
+# Step used when the market precision is unknown or not a fixed step
+DEFAULT_STEP = 1e-8
+
+
+class OrderBook:
+    """
+    Top depth levels of one symbol on every exchange in fixed point: each
+    level is an integer number of price ticks and amount lots of the market
+    precision, in a preallocated (exchanges, 2 sides, depth, 2) array
+    overwritten by every update. The best bid and ask of all exchanges are also kept as
+    price vectors in exchanges order, NaN where an exchange has no book.
+    Each update also writes the levels back in price and amount, with their
+    cumulative amounts and costs, so evaluating a book between two updates
+    only takes views of arrays allocated once.
+    """
+
+    __slots__ = (
+        "depth", "exchanges", "index", "steps", "books", "prices", "sums", "n_bids", "n_asks", "present", "top_bids",
+        "top_asks", "_scratch",
+    )
+
+    def __init__(self, exchanges, depth=20):
+        n = len(exchanges)
+        self.depth = depth
+        self.exchanges = list(exchanges)
+        self.index = {ex: i for i, ex in enumerate(self.exchanges)}
+        # Price tick and amount lot of every exchange
+        self.steps = np.full((n, 2), DEFAULT_STEP)
+        # Bids then asks of every exchange
+        self.books = np.zeros((n, 2, depth, 2), dtype=np.int64)
+        # The same levels on the price grid, then cumulative amounts and costs of both sides starting at 0
+        self.prices = np.zeros((n, 2, depth, 2))
+        self.sums = np.zeros((n, 2, 2, depth + 1))
+        self.n_bids = np.zeros(n, dtype=np.int64)
+        self.n_asks = np.zeros(n, dtype=np.int64)
+        self.present = np.zeros(n, dtype=bool)
+        self.top_bids = np.full(n, np.nan)
+        self.top_asks = np.full(n, np.nan)
+        self._scratch = np.zeros((2, depth, 2))
+
+    def set_precision(self, ex, tick, lot):
+        """Price tick and amount lot of an exchange, its current book is dropped"""
+        i = self.index[ex]
+        self.steps[i] = tick or DEFAULT_STEP, lot or DEFAULT_STEP
+        self.remove(ex)
+
+    def update(self, ex, ob):
+        if not len(ob["bids"]) or not len(ob["asks"]):
+            return False
+        i = self.index[ex]
+        self.n_bids[i] = self._copy(ob["bids"], self._scratch[0])
+        self.n_asks[i] = self._copy(ob["asks"], self._scratch[1])
+        # Both sides are converted to ticks and lots at once, straight into the book
+        book = self.books[i]
+        np.rint(np.divide(self._scratch, self.steps[i], out=self._scratch), out=book, casting="unsafe")
+        prices, sums = self.prices[i], self.sums[i]
+        np.multiply(book, self.steps[i], out=prices)
+        # Both sides over the whole depth, the sums past the last level of a side are never read
+        np.cumsum(prices[:, :, 1], axis=1, out=sums[:, 0, 1:])
+        # The scratch holds nothing needed anymore, it takes the cost of every level
+        np.multiply(prices[:, :, 0], prices[:, :, 1], out=self._scratch[:, :, 0])
+        np.cumsum(self._scratch[:, :, 0], axis=1, out=sums[:, 1, 1:])
+        self.present[i] = True
+        tick = self.steps[i, 0]
+        self.top_bids[i] = book[0, 0, 0] * tick
+        self.top_asks[i] = book[1, 0, 0] * tick
+        return True
+
+    def _copy(self, side, scratch):
+        n = min(len(side), self.depth)
+        try:
+            scratch[:n] = side[:n]
+        except ValueError:
+            # Levels with more than price and amount, e.g. an order count
+            scratch[:n] = np.asarray(side[:n], dtype=float)[:, :2]
+        return n
+
+    def remove(self, ex):
+        i = self.index[ex]
+        self.present[i] = False
+        self.n_bids[i] = self.n_asks[i] = 0
+        self.top_bids[i] = np.nan
+        self.top_asks[i] = np.nan
+
+    def has(self, ex):
+        return self.present[self.index[ex]]
+
+    def available(self):
+        """Exchanges which have a book"""
+        return [self.exchanges[i] for i in np.flatnonzero(self.present)]
+
+    def best_bid(self, ex):
+        return self.top_bids[self.index[ex]]
+
+    def best_ask(self, ex):
+        return self.top_asks[self.index[ex]]
+
+    def _side(self, ex, side):
+        """
+        :return: (exchange index, side index, number of levels)
+        """
+        i = self.index[ex]
+        if side == "bids":
+            return i, 0, self.n_bids[i]
+        return i, 1, self.n_asks[i]
+
+    def levels(self, ex, side):
+        """
+        :param side: "bids" or "asks"
+        :return: (n, 2) float view of price and amount, valid until the next update of the exchange
+        """
+        i, s, n = self._side(ex, side)
+        return self.prices[i, s, :n]
+
+    def cumulative(self, ex, side):
+        """
+        Like depth.cumulative of the levels, views valid until the next update of the exchange
+        :return: (amounts, costs), both starting at 0
+        """
+        i, s, n = self._side(ex, side)
+        amounts, costs = self.sums[i, s]
+        return amounts[:n + 1], costs[:n + 1]
+
+    def bids(self, ex):
+        return self.levels(ex, "bids")
+
+    def asks(self, ex):
+        return self.levels(ex, "asks")
@@ -0,0 +1,65 @@
+import heapq
+from itertools import count
+
+
+class BestPriceIndex:
+    """
+    Best bid and best ask per symbol across exchanges.
+    Every symbol has a max heap of bids and a min heap of asks. Entries of
+    an exchange are superseded lazily: an update pushes a new entry and
+    outdated entries are dropped when they reach the top, so an update and
+    a lookup both cost O(log n) in the number of exchanges.
+    """
+
+    def __init__(self) -> None:
+        self._bids = {}
+        self._asks = {}
+        self._current = {}
+        self._seq = count()
+
+    def update(self, symbol, exchange, bid, ask) -> None:
+        key = (symbol, exchange)
+        current = self._current.get(key)
+        if current and current[1] == bid and current[2] == ask:
+            return
+        seq = next(self._seq)
+        self._current[key] = (seq, bid, ask)
+        bids = self._bids.setdefault(symbol, [])
+        asks = self._asks.setdefault(symbol, [])
+        heapq.heappush(bids, (-bid, seq, exchange))
+        heapq.heappush(asks, (ask, seq, exchange))
+        if len(bids) > 64:
+            self._compact(symbol)
+
+    def remove(self, symbol, exchange) -> None:
+        self._current.pop((symbol, exchange), None)
+
+    def _is_current(self, symbol, entry) -> bool:
+        current = self._current.get((symbol, entry[2]))
+        return current is not None and current[0] == entry[1]
+
+    def _top(self, heap, symbol):
+        while heap and not self._is_current(symbol, heap[0]):
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _compact(self, symbol) -> None:
+        """Drop every outdated entry when a heap grows too much, e.g. for a rarely read symbol"""
+        for heaps in (self._bids, self._asks):
+            heap = [entry for entry in heaps[symbol] if self._is_current(symbol, entry)]
+            heapq.heapify(heap)
+            heaps[symbol] = heap
+
+    def best_bid(self, symbol):
+        """
+        :return: (price, exchange) of the highest bid or None
+        """
+        top = self._top(self._bids.get(symbol, []), symbol)
+        return (-top[0], top[2]) if top else None
+
+    def best_ask(self, symbol):
+        """
+        :return: (price, exchange) of the lowest ask or None
+        """
+        top = self._top(self._asks.get(symbol, []), symbol)
+        return (top[0], top[2]) if top else None
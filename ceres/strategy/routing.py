@@ -0,0 +1,245 @@
+import math
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from ceres.strategy.depth import cumulative, worst_price
+
+
+class Venue(NamedTuple):
+    """One side of one exchange as seen by the router"""
+
+    levels: np.ndarray
+    fee_rate: float
+    max_amount: float = math.inf
+    # Quote currency available for a buy including fees
+    max_cost: float = math.inf
+    min_amount: float = 0
+    min_cost: float = 0
+    # Rounds an amount down to the market precision of this exchange
+    precision: Optional[Callable[[float], float]] = None
+
+
+class RouteLeg(NamedTuple):
+    exchange: str
+    side: str
+    amount: float
+    # Deepest level touched, used as the limit price
+    price: float
+    # Cost of a buy or proceeds of a sell, before fees
+    value: float
+    fee: float
+
+
+class Route(NamedTuple):
+    legs: list
+    amount: float
+    cost: float
+    proceeds: float
+    fees: float
+    profit: float
+
+
+def capped(levels, fee_rate, max_amount=math.inf, max_cost=math.inf):
+    """Levels truncated to what max_amount and max_cost including fees allow"""
+    if not len(levels):
+        return levels
+    amounts, costs = cumulative(levels)
+    limit = min(max_amount, amounts[-1])
+    if max_cost < math.inf:
+        limit = min(limit, np.interp(max_cost / (1 + fee_rate), costs, amounts))
+    taken = np.clip(limit - amounts[:-1], 0, levels[:, 1])
+    keep = taken > 0
+    return np.column_stack((levels[keep, 0], taken[keep]))
+
+
+def _merge(venues, side):
+    """
+    Levels of all venues merged into one curve, best effective price after fees first
+    :return: (effective prices, amounts, venue index of every level)
+    """
+    prices, amounts, owners = [], [], []
+    for i, venue in enumerate(venues):
+        levels = capped(venue.levels, venue.fee_rate, venue.max_amount, venue.max_cost if side == "buy" else math.inf)
+        fee_factor = 1 + venue.fee_rate if side == "buy" else 1 - venue.fee_rate
+        prices.append(levels[:, 0] * fee_factor)
+        amounts.append(levels[:, 1])
+        owners.append(np.full(len(levels), i))
+    if not prices:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=int)
+    prices = np.concatenate(prices)
+    order = np.argsort(prices if side == "buy" else -prices, kind="stable")
+    return prices[order], np.concatenate(amounts)[order], np.concatenate(owners)[order]
+
+
+def _allocate(amounts, owners, n_venues, total):
+    """Amount taken from every venue when walking total through the merged curve"""
+    before = np.concatenate(([0.0], np.cumsum(amounts)[:-1]))
+    taken = np.clip(total - before, 0, amounts)
+    return np.bincount(owners, weights=taken, minlength=n_venues)
+
+
+def _best_total(ask_prices, ask_amounts, bid_prices, bid_amounts, max_amount):
+    """
+    Total amount maximizing the profit of buying along the merged asks and
+    selling along the merged bids. Like best_size the profit is concave and
+    piecewise linear, so the maximum is at a level boundary or the limit.
+    """
+    ask_cum = np.concatenate(([0.0], np.cumsum(ask_amounts)))
+    bid_cum = np.concatenate(([0.0], np.cumsum(bid_amounts)))
+    limit = min(max_amount, ask_cum[-1], bid_cum[-1])
+    if limit <= 0:
+        return 0
+    sizes = np.sort(np.concatenate((ask_cum, bid_cum)))
+    sizes = np.append(sizes[(sizes > 0) & (sizes < limit)], limit)
+    costs = np.interp(sizes, ask_cum, np.concatenate(([0.0], np.cumsum(ask_prices * ask_amounts))))
+    proceeds = np.interp(sizes, bid_cum, np.concatenate(([0.0], np.cumsum(bid_prices * bid_amounts))))
+    profits = proceeds - costs
+    i = int(np.argmax(profits))
+    return sizes[i] if profits[i] > 0 else 0
+
+
+def _round(venues, allocation):
+    return np.array([
+        venue.precision(amount) if venue.precision is not None and amount > 0 else amount
+        for venue, amount in zip(venues, allocation)
+    ])
+
+
+def _trim(venues, allocation, excess, worst_first):
+    """Remove excess from the venues with the worst prices first"""
+    for i in worst_first:
+        if excess <= 0:
+            break
+        if allocation[i] <= 0:
+            continue
+        reduced = max(allocation[i] - excess, 0)
+        if venues[i].precision is not None and reduced > 0:
+            reduced = venues[i].precision(reduced)
+        excess -= allocation[i] - reduced
+        allocation[i] = reduced
+    return allocation
+
+
+def _balance(buy_venues, buys, buy_worst, sell_venues, sells, sell_worst):
+    """
+    Round every allocation to its venue precision and trim the larger side
+    until both sides trade the same amount
+    :return: (buys, sells) or None if they do not meet
+    """
+    buys = _round(buy_venues, buys)
+    sells = _round(sell_venues, sells)
+    for _ in range(2 * (len(buy_venues) + len(sell_venues))):
+        bought, sold = buys.sum(), sells.sum()
+        if math.isclose(bought, sold, rel_tol=1e-9, abs_tol=1e-12):
+            return buys, sells
+        if bought > sold:
+            buys = _trim(buy_venues, buys, bought - sold, buy_worst)
+        else:
+            sells = _trim(sell_venues, sells, sold - bought, sell_worst)
+    return None
+
+
+def _worst_first(owners, n_venues):
+    """Venues ordered by the position of their deepest level on the merged curve, worst first"""
+    last = np.full(n_venues, -1)
+    np.maximum.at(last, owners, np.arange(len(owners)))
+    return [int(i) for i in np.argsort(-last, kind="stable") if last[i] >= 0]
+
+
+def _legs(venues, names, allocation, side):
+    legs = []
+    for venue, ex, amount in zip(venues, names, allocation):
+        if amount <= 0:
+            continue
+        amounts, values = cumulative(venue.levels)
+        value = float(np.interp(amount, amounts, values))
+        legs.append(RouteLeg(
+            exchange=ex,
+            side=side,
+            amount=float(amount),
+            price=float(worst_price(venue.levels, amounts, amount)),
+            value=value,
+            fee=value * venue.fee_rate,
+        ))
+    return legs
+
+
+def _too_small(venues, legs):
+    return [
+        leg.exchange for venue, leg in zip(venues, legs)
+        if leg.amount < venue.min_amount or leg.value < venue.min_cost
+    ]
+
+
+def route(buys, sells, max_amount=math.inf):
+    """
+    Split one arbitrage across venues: buy along the asks of all buy venues
+    merged by price after fees and sell along the bids of all sell venues,
+    up to the amount where the next unit would lose money. Every venue is
+    capped by its balances and limits, allocations are rounded to each
+    venue's precision, and venues whose share falls below their minimums are
+    left out and the route computed again. A venue on both sides, which
+    only crossed books make worth it, would trade against ourselves: it is
+    left out of the side where it got less and the route computed again.
+    Cost is a sort of all levels plus a few vector operations, well under a
+    millisecond for a handful of venues at the usual depths.
+    :param buys: dict exchange -> Venue with its asks
+    :param sells: dict exchange -> Venue with its bids
+    :param max_amount: cap of the total amount
+    :return: Route or None when nothing is profitable within the limits
+    """
+    buys, sells = dict(buys), dict(sells)
+    while buys and sells:
+        buy_names, sell_names = list(buys), list(sells)
+        buy_venues, sell_venues = list(buys.values()), list(sells.values())
+        ask_prices, ask_amounts, ask_owners = _merge(buy_venues, "buy")
+        bid_prices, bid_amounts, bid_owners = _merge(sell_venues, "sell")
+        total = _best_total(ask_prices, ask_amounts, bid_prices, bid_amounts, max_amount)
+        if total <= 0:
+            return None
+        balanced = _balance(
+            buy_venues, _allocate(ask_amounts, ask_owners, len(buy_venues), total),
+            _worst_first(ask_owners, len(buy_venues)),
+            sell_venues, _allocate(bid_amounts, bid_owners, len(sell_venues), total),
+            _worst_first(bid_owners, len(sell_venues)),
+        )
+        if balanced is None:
+            return None
+        buy_legs = _legs(buy_venues, buy_names, balanced[0], "buy")
+        sell_legs = _legs(sell_venues, sell_names, balanced[1], "sell")
+        if not buy_legs or not sell_legs:
+            return None
+        small_buys = _too_small([buys[leg.exchange] for leg in buy_legs], buy_legs)
+        small_sells = _too_small([sells[leg.exchange] for leg in sell_legs], sell_legs)
+        if small_buys or small_sells:
+            for ex in small_buys:
+                del buys[ex]
+            for ex in small_sells:
+                del sells[ex]
+            continue
+        bought = {leg.exchange: leg.amount for leg in buy_legs}
+        sold = {leg.exchange: leg.amount for leg in sell_legs}
+        both = bought.keys() & sold.keys()
+        if both:
+            for ex in both:
+                if bought[ex] < sold[ex]:
+                    del buys[ex]
+                else:
+                    del sells[ex]
+            continue
+        cost = sum(leg.value for leg in buy_legs)
+        proceeds = sum(leg.value for leg in sell_legs)
+        fees = sum(leg.fee for leg in buy_legs + sell_legs)
+        profit = proceeds - cost - fees
+        if profit <= 0:
+            return None
+        return Route(
+            legs=buy_legs + sell_legs,
+            amount=float(sum(leg.amount for leg in buy_legs)),
+            cost=cost,
+            proceeds=proceeds,
+            fees=fees,
+            profit=profit,
+        )
+    return None
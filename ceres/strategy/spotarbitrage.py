@@ -1,5 +1,14 @@
 import logging
+import math
 
+import numpy as np
+from ccxt.base.decimal_to_precision import TICK_SIZE
+
+from ceres.exchange.ordertemplates import to_step
+from ceres.strategy.depth import best_size
+from ceres.strategy.orderbook import DEFAULT_STEP, OrderBook
+from ceres.strategy.priceindex import BestPriceIndex
+from ceres.strategy.routing import Venue, route
 from ceres.strategy.strategybase import StrategyBase
 
 logger = logging.getLogger(__name__)
@@ -10,28 +19,86 @@ class Fees:
         self.fees = {}
 
     def update(self, ex, m):
-        self.fees[ex] = {
+        self.fees.setdefault(ex, {})[m["symbol"]] = {
             "taker": m.get("taker", 0.001),
             "maker": m.get("maker", 0.001),
         }
 
+    def taker(self, ex, symbol):
+        return self.fees[ex][symbol]["taker"]
+
+
+class Limits:
+    def __init__(self):
+        self.limits = {}
+
+    def update(self, ex, m):
+        limits = m.get("limits", {})
+        amount = limits.get("amount") or {}
+        cost = limits.get("cost") or {}
+        self.limits.setdefault(ex, {})[m["symbol"]] = {
+            "min_amount": amount.get("min") or 0,
+            "max_amount": amount.get("max") or math.inf,
+            "min_cost": cost.get("min") or 0,
+        }
+
+    def get(self, ex, symbol):
+        return self.limits.get(ex, {}).get(symbol, {})
+
+
+class Precision:
+    """Price tick and amount lot size of every market, as steps whatever the exchange's precision mode"""
 
-class OrderBook:
     def __init__(self):
-        self.bids = {}
-        self.asks = {}
+        self.precision = {}
+
+    def update(self, ex, m, mode=TICK_SIZE):
+        precision = m.get("precision") or {}
+        self.precision.setdefault(ex, {})[m["symbol"]] = (
+            to_step(precision.get("price"), mode) or DEFAULT_STEP,
+            to_step(precision.get("amount"), mode) or DEFAULT_STEP,
+        )
+
+    def get(self, ex, symbol):
+        """
+        :return: (price tick, amount lot)
+        """
+        return self.precision.get(ex, {}).get(symbol, (DEFAULT_STEP, DEFAULT_STEP))
 
-    def update(self, ex, obs):
-        self.bids[ex] = obs[ex]["bids"][0][0]
-        self.asks[ex] = obs[ex]["asks"][0][0]
 
 class SpotArbitrage(StrategyBase):
-    def __init__(self, config, exchangeshandler) -> None:
-        super().__init__(config, exchangeshandler)
-        self.symbol = self._config.get("symbol")
-        self.order_size = self._config.get("order_size", 0)
-        self.order_book = OrderBook()
+    """
+    Buys on one exchange and sells on another. Every buy/sell pair of
+    exchanges is evaluated at once from the top of the books as an N x N
+    matrix, masked by what the balances can fund; the best pairs are then
+    sized on the full depth. When several venues are profitable on a side,
+    the router may split the trade across their combined depth instead.
+    """
+
+    def __init__(self, config, exchangeshandler, wallets=None) -> None:
+        super().__init__(config, exchangeshandler, wallets)
+        self.symbols = self.exchangeshandler.symbols
+        self.exchanges = list(self.exchangeshandler.current_exchanges)
+        # order_size caps the size of one arbitrage, 0 means only balances and depth limit it
+        self.order_size = self._config.get("order_size", 0) or math.inf
+        # Number of best ranked pairs sized on the full depth
+        self.pair_candidates = self._config.get("pair_candidates", 3)
+        self.smart_routing = self._config.get("smart_routing", True)
+        depth = self._config.get("order_book_depth", 20)
+        self.order_books = {symbol: OrderBook(self.exchanges, depth) for symbol in self.symbols}
+        self.price_index = BestPriceIndex()
         self.fees = Fees()
+        self.limits = Limits()
+        self.precision = Precision()
+        # symbol -> per exchange vectors: cost of buying one unit with fees, proceeds of selling one, minimums
+        self.buy_factors = {}
+        self.sell_factors = {}
+        self.min_amounts = {}
+        self.min_costs = {}
+        self._not_self = ~np.eye(len(self.exchanges), dtype=bool)
+        self._get_fees()
+
+    def update_markets(self):
         self._get_fees()
 
     def _get_fees(self):
@@ -40,72 +107,259 @@ class SpotArbitrage(StrategyBase):
         """
         markets = self.exchangeshandler.get_markets()
         for ex, market in markets.items():
-            m = market.get(self.symbol, None)
-            if m:
-                self.fees.update(ex, m)
-        logger.info(f"Fees per exchange: {self.fees.fees}")
+            mode = getattr(self.exchangeshandler.exchanges[ex].api, "precisionMode", TICK_SIZE)
+            for symbol in self.symbols:
+                m = market.get(symbol, None)
+                if m:
+                    self.fees.update(ex, m)
+                    self.limits.update(ex, m)
+                    steps = self.precision.get(ex, symbol)
+                    self.precision.update(ex, m, mode)
+                    if self.precision.get(ex, symbol) != steps:
+                        # The book is kept in ticks and lots of the market, a new precision drops it
+                        self.order_books[symbol].set_precision(ex, *self.precision.get(ex, symbol))
+        for symbol in self.symbols:
+            fees = np.array([self.fees.fees.get(ex, {}).get(symbol, {}).get("taker", np.nan) for ex in self.exchanges])
+            self.buy_factors[symbol] = 1 + fees
+            self.sell_factors[symbol] = 1 - fees
+            limits = [self.limits.get(ex, symbol) for ex in self.exchanges]
+            self.min_amounts[symbol] = np.array([limit.get("min_amount", 0) for limit in limits])
+            self.min_costs[symbol] = np.array([limit.get("min_cost", 0) for limit in limits])
+        logger.info(f"Loaded fees of {len(self.symbols)} symbols")
+        logger.debug(f"Fees per exchange: {self.fees.fees}")
 
-    def check_opportunity(self):
-        self._get_orderbook_data()
-        return self._check_profit()
+    def check_opportunity(self, updates=None):
+        """
+        Re-check the symbols touched by the given order book updates
+        :param updates: iterable of (exchange, symbol), None re-checks everything
+        :return: (signal, orders) of the most profitable opportunity
+        """
+        symbols = self._get_orderbook_data(updates)
+        best = False, {}
+        for symbol in symbols:
+            signal, orders = self._check_profit(symbol)
+            if signal and (not best[0] or float(orders["profit"]["profit"]) > float(best[1]["profit"]["profit"])):
+                best = signal, orders
+        return best
 
-    def _get_orderbook_data(self):
-        obs = self.exchangeshandler.watch_order_books(self.symbol)
-        for ex in self.exchangeshandler.current_exchanges:
-            self.order_book.update(ex, obs)
+    def _get_orderbook_data(self, updates=None):
+        book_store = self.exchangeshandler.book_store
+        if updates is None:
+            updates = [(ex, symbol) for symbol in self.symbols for ex in book_store.get_books(symbol)]
+        symbols = set()
+        for ex, symbol in updates:
+            order_book = self.order_books.get(symbol)
+            if order_book is None:
+                continue
+            ob = book_store.get(ex, symbol)
+            if ob is None:
+                # The exchange was taken out, e.g. because it is unhealthy
+                order_book.remove(ex)
+                self.price_index.remove(symbol, ex)
+                continue
+            if order_book.update(ex, ob):
+                self.price_index.update(symbol, ex, order_book.best_bid(ex), order_book.best_ask(ex))
+                symbols.add(symbol)
+        return symbols
 
-    def _check_profit(self):
-        min_ask_ex = min(self.order_book.asks, key=self.order_book.asks.get)
-        max_bid_ex = max(self.order_book.bids, key=self.order_book.bids.get)
-        min_ask_price = self.order_book.asks[min_ask_ex]
-        max_bid_price = self.order_book.bids[max_bid_ex]
+    def _check_profit(self, symbol):
+        if not self._may_be_profitable(symbol):
+            return False, {}
+        pairs = self.rank_pairs(symbol)
+        best = None
+        for buy_ex, sell_ex, edge in pairs[:self.pair_candidates]:
+            sizing = self._size_opportunity(symbol, buy_ex, sell_ex)
+            logger.debug(f"{symbol}: buy on {buy_ex}, sell on {sell_ex}, edge {edge} per unit, sizing: {sizing}")
+            if sizing and (best is None or sizing.profit > best[2].profit):
+                best = buy_ex, sell_ex, sizing
 
-        max_bid_price = -max_bid_price  # Negate bid prices for max heap
+        routed = self._route(symbol, pairs) if self.smart_routing and len(pairs) > 1 else None
+        if routed and (best is None or routed.profit > best[2].profit):
+            orders = self._create_routed_orders(symbol, routed)
+            venues = ", ".join(f"{leg.side} {leg.exchange}" for leg in routed.legs)
+            logger.info(f'Found arbitrage opportunity for {symbol} routed across {venues}')
+            return True, orders
 
-        if min_ask_ex == max_bid_ex:
-            return False, {}
+        if best:
+            buy_ex, sell_ex, sizing = best
+            orders = self._create_orders(symbol, buy_ex, sell_ex, sizing)
+            logger.info(f'Found arbitrage opportunity for {symbol} between {buy_ex} and {sell_ex}')
+            return True, orders
 
-        min_fee = self.order_size * min_ask_price * self.fees.fees[min_ask_ex]["taker"]
-        max_fee = self.order_size * max_bid_price * self.fees.fees[max_bid_ex]["taker"]
+        return False, {}
+
+    def _may_be_profitable(self, symbol):
+        """
+        Cheap bound before the pair matrix: even the best bid with the lowest
+        fee does not pay the best ask with the lowest fee
+        """
+        best_ask = self.price_index.best_ask(symbol)
+        best_bid = self.price_index.best_bid(symbol)
+        if not best_ask or not best_bid:
+            return False
+        return best_bid[0] * np.nanmax(self.sell_factors[symbol]) > best_ask[0] * np.nanmin(self.buy_factors[symbol])
+
+    def rank_pairs(self, symbol, now=None):
+        """
+        Evaluate every buy/sell exchange pair of a symbol at once
+        :return: list of (buy exchange, sell exchange, profit per unit after fees)
+                 of the profitable pairs the balances can fund, best first
+        """
+        self._drop_stale(symbol, self.exchangeshandler.now() if now is None else now)
+        order_book = self.order_books[symbol]
+        costs = order_book.top_asks * self.buy_factors[symbol]
+        proceeds = order_book.top_bids * self.sell_factors[symbol]
+        # edges[i, j]: buy one unit on exchange i and sell it on exchange j, NaN compares False
+        edges = proceeds[np.newaxis, :] - costs[:, np.newaxis]
+        mask = (edges > 0) & self._not_self
+        if self.wallets:
+            can_buy, can_sell = self._fundable(symbol, order_book)
+            mask &= can_buy[:, np.newaxis] & can_sell[np.newaxis, :]
+        buys, sells = np.nonzero(mask)
+        ranked = np.argsort(-edges[buys, sells], kind="stable")
+        return [
+            (self.exchanges[buys[k]], self.exchanges[sells[k]], float(edges[buys[k], sells[k]]))
+            for k in ranked
+        ]
+
+    def _fundable(self, symbol, order_book):
+        """
+        :return: (can_buy, can_sell) boolean vectors, whether each exchange
+                 has the balance for the smallest order it accepts
+        """
+        base, quote = symbol.split("/")
+        free_quote = np.array([self.wallets.get_free(ex, quote) for ex in self.exchanges])
+        free_base = np.array([self.wallets.get_free(ex, base) for ex in self.exchanges])
+        min_amounts = self.min_amounts[symbol]
+        min_costs = self.min_costs[symbol]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            can_buy = free_quote >= np.maximum(min_costs, min_amounts * order_book.top_asks) * self.buy_factors[symbol]
+            can_sell = free_base >= np.maximum(min_amounts, min_costs / order_book.top_bids)
+        return can_buy & (free_quote > 0), can_sell & (free_base > 0)
 
-        price_profit = max_bid_price - min_ask_price
-        profit = (price_profit * self.order_size) - (min_fee + max_fee)
-        profit_pct = profit / 100
+    def _drop_stale(self, symbol, now):
+        order_book = self.order_books[symbol]
+        for ex in order_book.available():
+            if not self._is_fresh(ex, symbol, now):
+                # A frozen feed shows a spread which is not there anymore, its next update brings it back
+                logger.info(f"Ignoring stale {symbol} quotes of {ex}")
+                order_book.remove(ex)
+                self.price_index.remove(symbol, ex)
 
-        logger.info(
-            f"{self.symbol}: Profit after fees: {profit}, buy exchange {min_ask_ex} at: {min_ask_price}, sell exchange {max_bid_ex} at: {max_bid_price}"
+    def _size_opportunity(self, symbol, buy_ex, sell_ex):
+        """Most profitable size within depth, balances and market limits of both exchanges"""
+        base, quote = symbol.split("/")
+        order_book = self.order_books[symbol]
+        buy_limits = self.limits.get(buy_ex, symbol)
+        sell_limits = self.limits.get(sell_ex, symbol)
+        max_amount = min(
+            self.order_size, buy_limits.get("max_amount", math.inf), sell_limits.get("max_amount", math.inf)
+        )
+        max_cost = math.inf
+        if self.wallets:
+            max_amount = min(max_amount, self.wallets.get_free(sell_ex, base))
+            max_cost = self.wallets.get_free(buy_ex, quote)
+        return best_size(
+            order_book.asks(buy_ex),
+            order_book.bids(sell_ex),
+            self.fees.taker(buy_ex, symbol),
+            self.fees.taker(sell_ex, symbol),
+            min_amount=max(buy_limits.get("min_amount", 0), sell_limits.get("min_amount", 0)),
+            max_amount=max_amount,
+            max_cost=max_cost,
+            min_cost=max(buy_limits.get("min_cost", 0), sell_limits.get("min_cost", 0)),
+            precision=lambda amount: self._amount_to_precision(symbol, buy_ex, sell_ex, amount),
+            asks_cumulative=order_book.cumulative(buy_ex, "asks"),
+            bids_cumulative=order_book.cumulative(sell_ex, "bids"),
         )
 
-        if profit > 0:
-            orders = self._create_orders(min_ask_ex, min_ask_price, max_bid_ex, max_bid_price, profit, profit_pct,
-                                     min_fee, max_fee)
-            logger.info(f'Found arbitrage opportunity for {self.symbol} between {min_ask_ex} and {max_bid_ex}')
-            return True, orders
+    def _route(self, symbol, pairs):
+        """
+        Split the trade across every venue which is on the buy or sell side of a profitable pair
+        :return: Route or None
+        """
+        buys, sells = {}, {}
+        for buy_ex, sell_ex, _ in pairs:
+            if buy_ex not in buys:
+                buys[buy_ex] = self._venue(symbol, buy_ex, "buy")
+            if sell_ex not in sells:
+                sells[sell_ex] = self._venue(symbol, sell_ex, "sell")
+        if len(buys) + len(sells) < 3:
+            return None
+        return route(buys, sells, max_amount=self.order_size)
 
-        return False, {}
+    def _venue(self, symbol, ex, side):
+        """One side of an exchange for the router, capped by its free balance"""
+        base, quote = symbol.split("/")
+        limits = self.limits.get(ex, symbol)
+        max_amount = limits.get("max_amount", math.inf)
+        max_cost = math.inf
+        if self.wallets:
+            if side == "buy":
+                max_cost = self.wallets.get_free(ex, quote)
+            else:
+                max_amount = min(max_amount, self.wallets.get_free(ex, base))
+        order_book = self.order_books[symbol]
+        exchange = self.exchangeshandler.exchanges[ex]
+        return Venue(
+            levels=order_book.asks(ex) if side == "buy" else order_book.bids(ex),
+            fee_rate=self.fees.taker(ex, symbol),
+            max_amount=max_amount,
+            max_cost=max_cost,
+            min_amount=limits.get("min_amount", 0),
+            min_cost=limits.get("min_cost", 0),
+            precision=lambda amount: exchange.round_amount(symbol, amount),
+        )
+
+    def _amount_to_precision(self, symbol, buy_ex, sell_ex, amount):
+        """Round down to the coarser amount precision of both exchanges"""
+        for ex in (buy_ex, sell_ex):
+            amount = self.exchangeshandler.exchanges[ex].round_amount(symbol, amount)
+        return amount
 
-    def _create_orders(self, min_ask_ex, min_ask_price, max_bid_ex, max_bid_price, profit, profit_pct, min_fee,
-                       max_fee):
+    def _create_orders(self, symbol, buy_ex, sell_ex, sizing):
         return {
-            'exchange_orders': {
-                min_ask_ex: {
-                    'symbol': self.symbol,
+            'exchange_orders': [
+                {
+                    'exchange': buy_ex,
+                    'symbol': symbol,
                     'type': 'limit',
                     'side': 'buy',
-                    'amount': self.order_size,
-                    'price': min_ask_price
+                    'amount': sizing.amount,
+                    'price': sizing.buy_price
                 },
-                max_bid_ex: {
-                    'symbol': self.symbol,
+                {
+                    'exchange': sell_ex,
+                    'symbol': symbol,
                     'type': 'limit',
                     'side': 'sell',
-                    'amount': self.order_size,
-                    'price': max_bid_price
+                    'amount': sizing.amount,
+                    'price': sizing.sell_price
+                }
+            ],
+            'profit': {
+                'profit': "%.5f" % sizing.profit,
+                'profit_pct': "%.6f" % (sizing.profit / sizing.cost * 100),
+                'fees': sizing.buy_fee + sizing.sell_fee
+            }
+        }
+
+    def _create_routed_orders(self, symbol, routed):
+        return {
+            'exchange_orders': [
+                {
+                    'exchange': leg.exchange,
+                    'symbol': symbol,
+                    'type': 'limit',
+                    'side': leg.side,
+                    'amount': leg.amount,
+                    'price': leg.price
                 }
-            },
+                for leg in routed.legs
+            ],
             'profit': {
-                'profit': "%.5f" % profit,
-                'profit_pct': "%.6f" % profit_pct,
-                'fees': min_fee + max_fee
+                'profit': "%.5f" % routed.profit,
+                'profit_pct': "%.6f" % (routed.profit / routed.cost * 100),
+                'fees': routed.fees
             }
         }
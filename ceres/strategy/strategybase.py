@@ -1,11 +1,32 @@
 from abc import ABC, abstractmethod
 
+from ceres.metrics import metrics
+
 
 class StrategyBase(ABC):
-    def __init__(self, config, exchangeshandler) -> None:
+    def __init__(self, config, exchangeshandler, wallets=None) -> None:
         self._config = config
         self.exchangeshandler = exchangeshandler
+        self.wallets = wallets
+        # Quotes older than this many seconds are not traded on
+        self.max_quote_age = self._config.get("max_quote_age", 10)
+
+    def _is_fresh(self, ex, symbol, now):
+        age = self.exchangeshandler.book_store.quote_age(ex, symbol, now)
+        metrics.observe("ceres_quote_age_seconds", age, exchange=ex)
+        if age > self.max_quote_age:
+            metrics.inc("ceres_stale_quotes_total", exchange=ex)
+            return False
+        return True
+
+    def update_markets(self):
+        """Markets were reloaded, refresh anything derived from them"""
+        pass
 
     @abstractmethod
-    def check_opportunity(self):
+    def check_opportunity(self, updates=None):
+        """
+        :param updates: iterable of (exchange, symbol) order book updates since the last check
+        :return: (signal, orders)
+        """
         pass
@@ -2,11 +2,12 @@ import json
 from typing import Any, Dict, List
 
 
-def load_config() -> Dict[str, Any]:
+def load_config(path: str = "config.json") -> Dict[str, Any]:
     """
     Load config file and returns is as a dictionary
+    :param path: path of the config file
     :return: Configuration dictionary
     """
-    with open("config.json") as json_data:
+    with open(path) as json_data:
         config = json.load(json_data)
         return config
@@ -3,6 +3,7 @@ from setuptools import setup
 setup(
     install_requires = [
         'ccxt',
+        'numpy',
         'python-telegram-bot>=13.15'
     ]
 )
\ No newline at end of file
@@ -0,0 +1,45 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from ceres.balances import Balances
+from ceres.exchange.exchange import Exchange
+
+
+def balances(fake, circuit_breaker=None):
+    exchange = Exchange(
+        {"dry": True, "circuit_breaker": circuit_breaker or {}},
+        {"name": "fake0", "fake": dict(fake, watch_balance=True, markets=["BTC/USDT"])},
+    )
+    handler = SimpleNamespace(symbols=["BTC/USDT"], current_exchanges=["fake0"], exchanges={"fake0": exchange})
+    return Balances({"dry": True, "dry_balance": 0}, handler), exchange
+
+
+async def run_stream(ledger, seconds):
+    """Run the balance stream and count how often the loop gets to other tasks meanwhile"""
+    ticks = 0
+    stream = asyncio.ensure_future(ledger._stream_balance("fake0"))
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        ticks += 1
+    stream.cancel()
+    await asyncio.gather(stream, return_exceptions=True)
+    return ticks
+
+
+def test_balance_stream_updates_the_ledger():
+    ledger, exchange = balances({"update_interval": 0.01, "balance": {"BTC": 2, "USDT": 500}})
+    assert exchange.api.has["watchBalance"]
+    asyncio.run(run_stream(ledger, 0.2))
+    assert ledger.get_free("fake0", "BTC") == 2
+    assert ledger.get_free("fake0", "USDT") == 500
+
+
+def test_open_breaker_does_not_hold_the_loop():
+    ledger, exchange = balances(
+        {"update_interval": 0.01, "error_rate": 1.0}, {"failure_threshold": 1, "reset_timeout": 5.0},
+    )
+    ticks = asyncio.run(run_stream(ledger, 1.0))
+    assert exchange.breaker.state == "open"
+    assert ticks >= 10
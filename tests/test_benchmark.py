@@ -0,0 +1,12 @@
+from ceres.benchmark import check_thresholds, run_benchmark
+
+# Far above what the fake exchanges take on a shared CI runner, a regression by an order of magnitude still fails
+MAX_TICK_P99_MS = 100
+MAX_SEND_P99_MS = 100
+
+
+def test_benchmark_stays_within_latency_thresholds():
+    results = run_benchmark(exchanges=(2,), symbols=(1,), duration=1.0, warmup=0.5)
+    assert results[0]["decisions_per_second"] > 0
+    assert results[0]["executions"] > 0
+    assert check_thresholds(results, max_tick_p99_ms=MAX_TICK_P99_MS, max_send_p99_ms=MAX_SEND_P99_MS) == []
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+from ceres.strategy.cyclearbitrage import CycleArbitrage
+
+
+def strategy(tops, symbols):
+    cycle = CycleArbitrage.__new__(CycleArbitrage)
+    cycle.exchangeshandler = SimpleNamespace(current_exchanges=["a", "b"])
+    cycle.symbols = symbols
+    cycle.profit_currency = "USDT"
+    cycle.tops = tops
+    return cycle
+
+
+def test_values_currencies_in_the_profit_currency():
+    cycle = strategy(
+        {("a", "BTC/USDT"): (29990, 1, 30010, 1), ("b", "ETH/BTC"): (0.0499, 1, 0.0501, 1)},
+        ["BTC/USDT", "ETH/BTC"],
+    )
+    assert cycle._value("USDT") == 1
+    assert cycle._value("BTC") == 30000
+    assert abs(cycle._value("ETH") - 0.05 * 30000) < 1e-9
+    assert cycle._value("LTC") is None
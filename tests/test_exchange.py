@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+from ceres.exchange.circuitbreaker import OPEN
+from ceres.exchange.exchange import Exchange
+from ceres.exchange.exchangehelpers import StreamIdleError
+
+
+def test_quiet_stream_does_not_open_the_breaker():
+    exchange = Exchange(
+        {"dry": True, "stream_timeout": 0.05},
+        {"name": "quiet", "fake": {"markets": ["BTC/USDT"], "update_interval": 1}},
+    )
+
+    async def run():
+        for _ in range(10):
+            with pytest.raises(StreamIdleError):
+                await exchange.watch_order_book("BTC/USDT")
+
+    asyncio.run(run())
+    assert exchange.breaker.state != OPEN
+    assert exchange.breaker.allow()
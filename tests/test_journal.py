@@ -0,0 +1,46 @@
+from ceres.data import Journal, JournalReader
+from ceres.exchange.execution import LegResult
+
+
+def opportunity(journal, exchanges, profit, status="executed"):
+    orders = {"profit": {"profit": profit, "fees": 0.1}}
+    opportunity_id = journal.record_opportunity("BTC/USDT", "spot_arbitrage", orders, status)
+    for exchange, side in zip(exchanges, ("buy", "sell")):
+        order = {"symbol": "BTC/USDT", "side": side, "type": "limit", "amount": 1, "price": 100}
+        journal.record_order(opportunity_id, LegResult(exchange, order, {"id": "1", "status": "closed"}, sent_at=1, acked_at=1))
+
+
+def test_journal_is_off_unless_enabled():
+    assert Journal.from_config({}) is None
+    assert Journal.from_config({"journal": {"enabled": False}}) is None
+
+
+def test_pnl_filters_on_the_exchange_of_the_orders(tmp_path):
+    path = str(tmp_path / "ceres.db")
+    journal = Journal(path, flush_interval=0.01)
+    opportunity(journal, ("binance", "kraken"), 1.0)
+    opportunity(journal, ("kraken", "bitfinex"), 2.0)
+    journal.close()
+    reader = JournalReader(path)
+    try:
+        assert [row["profit"] for row in reader.pnl()] == [3.0]
+        assert [row["profit"] for row in reader.pnl(exchange="binance")] == [1.0]
+        assert [row["trades"] for row in reader.pnl(exchange="kraken")] == [2]
+        assert reader.pnl(exchange="okx") == []
+    finally:
+        reader.close()
+
+
+def test_totals_leave_out_opportunities_with_a_failed_leg(tmp_path):
+    path = str(tmp_path / "ceres.db")
+    journal = Journal(path, flush_interval=0.01)
+    opportunity(journal, ("binance", "kraken"), 1.0)
+    opportunity(journal, ("binance", "kraken"), 2.0, status="partially_executed")
+    opportunity(journal, ("binance", "kraken"), 4.0, status="failed")
+    journal.close()
+    reader = JournalReader(path)
+    try:
+        trades, profit, _ = reader.totals()
+        assert (trades, profit) == (1, 1.0)
+    finally:
+        reader.close()
@@ -0,0 +1,23 @@
+from ceres.exchange.exchange import Exchange
+from ceres.exchange.marketdatahub import MarketDataHub, client_key
+
+
+def test_entries_differing_in_sandbox_or_options_get_their_own_client():
+    live = {"name": "kraken", "key": "a"}
+    assert client_key(live) == client_key({"name": "kraken", "key": "b"})
+    assert client_key(live) != client_key({"name": "kraken", "sandbox": True})
+    assert client_key(live) != client_key({"name": "kraken", "options": {"defaultType": "future"}})
+
+
+def test_clients_of_an_exchange_share_its_rate_budget():
+    hub = MarketDataHub()
+    try:
+        first = Exchange({"dry": True}, {"name": "binance", "key": "a", "options": {}}, budgets=hub.rate_budget)
+        second = Exchange({"dry": True}, {"name": "binance", "key": "b", "options": {}}, budgets=hub.rate_budget)
+        sandbox = Exchange({"dry": True}, {"name": "binance", "sandbox": True, "options": {}}, budgets=hub.rate_budget)
+        assert first.budget is not None
+        assert first.budget is second.budget
+        assert sandbox.budget is not first.budget
+        assert sandbox.budget.labels == {"exchange": "binance", "sandbox": "true"}
+    finally:
+        hub.loop.close()
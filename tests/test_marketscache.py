@@ -0,0 +1,22 @@
+import os
+
+from ceres.exchange.marketscache import MarketsCache
+
+
+def test_markets_are_cached_in_the_user_cache_by_default(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = MarketsCache.from_config({})
+    assert cache.path == os.path.join(str(tmp_path), "ceres", "markets")
+    cache.save("binance", {"BTC/USDT": {"symbol": "BTC/USDT"}})
+    assert cache.load("binance") == {"BTC/USDT": {"symbol": "BTC/USDT"}}
+    assert MarketsCache.from_config({"markets_cache": {"enabled": False}}) is None
+
+
+def test_sandbox_markets_are_cached_apart(tmp_path):
+    cache = MarketsCache(str(tmp_path))
+    cache.save("binance", {"BTC/USDT": {"id": "live"}})
+    cache.save("binance", {"BTC/USDT": {"id": "test"}}, sandbox=True)
+    assert cache.load("binance") == {"BTC/USDT": {"id": "live"}}
+    assert cache.load("binance", sandbox=True) == {"BTC/USDT": {"id": "test"}}
+    assert os.path.exists(os.path.join(str(tmp_path), "binance-sandbox.json"))
+    assert MarketsCache(str(tmp_path / "other")).load("binance", sandbox=True) is None
@@ -0,0 +1,21 @@
+import numpy as np
+
+from ceres.strategy.depth import cumulative
+from ceres.strategy.orderbook import OrderBook
+
+
+def test_cached_sums_match_the_levels_of_the_last_update():
+    order_book = OrderBook(["a", "b"], depth=5)
+    order_book.set_precision("a", 0.01, 0.001)
+    order_book.update("a", {
+        "bids": [[10.0, 1], [9.99, 2], [9.98, 3], [9.97, 1], [9.96, 1], [9.95, 1]],
+        "asks": [[10.01, 0.5]],
+    })
+    # A shallower book must not read the levels left by the deeper one
+    order_book.update("a", {"bids": [[10.0, 1], [9.99, 2]], "asks": [[10.02, 0.5], [10.03, 1.5], [10.04, 2]]})
+    for side in ("bids", "asks"):
+        amounts, costs = order_book.cumulative("a", side)
+        expected_amounts, expected_costs = cumulative(order_book.levels("a", side))
+        assert np.allclose(amounts, expected_amounts)
+        assert np.allclose(costs, expected_costs)
+    assert np.allclose(order_book.asks("a"), [[10.02, 0.5], [10.03, 1.5], [10.04, 2.0]])
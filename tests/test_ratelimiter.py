@@ -0,0 +1,46 @@
+import asyncio
+
+from ceres.exchange.exchange import Exchange
+from ceres.exchange.ratelimiter import BACKGROUND, ORDER, RateBudget
+
+
+def test_budget_goes_through_ccxt_open_and_fetch2():
+    exchange = Exchange({"dry": True}, {"name": "kraken"})
+    api = exchange.api
+    calls = []
+
+    async def fetch(url, method="GET", headers=None, body=None):
+        calls.append(url)
+        return {"result": {}}
+
+    async def run():
+        api.fetch = fetch
+        # ccxt gives the throttler its loop when opening the exchange
+        api.open()
+        try:
+            await api.fetch2("Time", "public")
+        finally:
+            await api.close()
+
+    asyncio.run(run())
+    assert api.throttle.loop is not None
+    assert len(calls) == 1
+
+
+def test_orders_go_before_background_calls():
+    async def run():
+        budget = RateBudget("test", rate=100, capacity=1, reserve=0)
+        await budget.acquire(1)
+        served = []
+
+        async def call(level, name):
+            await budget.acquire(1, level)
+            served.append(name)
+
+        background = asyncio.ensure_future(call(BACKGROUND, "background"))
+        await asyncio.sleep(0)
+        order = asyncio.ensure_future(call(ORDER, "order"))
+        await asyncio.gather(background, order)
+        return served
+
+    assert asyncio.run(run()) == ["order", "background"]
@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+from ceres.exchange.execution import ExecutionResult, LegResult
+from ceres.recovery import RecoveryEngine
+
+
+def engine():
+    handler = SimpleNamespace(exchanges={}, loop=None)
+    return RecoveryEngine(handler, wallets=None, fee_rate=lambda ex, symbol: 0.001)
+
+
+def leg(exchange, side, amount, price, filled=None, status="closed", fee=None, order_id="1"):
+    order = {"exchange": exchange, "symbol": "BTC/USDT", "side": side, "amount": amount, "price": price}
+    if filled is None:
+        return LegResult(exchange, order, error="rejected", sent_at=1, acked_at=1)
+    result = {"id": order_id, "status": status, "filled": filled, "fee": fee}
+    return LegResult(exchange, order, result, sent_at=1, acked_at=1)
+
+
+def states(*legs):
+    return [RecoveryEngine._state(l.exchange, l.order, l.result) for l in legs]
+
+
+def test_failed_leg_leaves_the_filled_amount_exposed():
+    recovery = engine()
+    exposure = recovery.exposure("BTC/USDT", states(leg("a", "buy", 1, 100, filled=1), leg("b", "sell", 1, 101)))
+    assert exposure == (1, 101)
+
+
+def test_fees_paid_in_base_are_netted():
+    recovery = engine()
+    legs = states(
+        leg("a", "buy", 1.0, 100, filled=1.0, fee={"cost": 0.001, "currency": "BTC"}),
+        leg("b", "sell", 0.999, 101, filled=0.999),
+    )
+    assert recovery.exposure("BTC/USDT", legs) is None
+
+
+def test_sell_leg_sized_net_of_fees_is_not_exposure():
+    recovery = engine()
+    legs = states(
+        leg("a", "buy", 1.0, 100, filled=1.0, fee={"cost": 0.1, "currency": "USDT"}),
+        leg("b", "sell", 0.999, 101, filled=0.999),
+    )
+    assert recovery.exposure("BTC/USDT", legs) is None
+
+
+def test_cancelled_remainder_of_a_resting_leg_is_hedged():
+    recovered = []
+
+    async def run():
+        recovery = engine()
+        recovery.exchangeshandler.loop = asyncio.get_running_loop()
+        recovery.follow_open_orders = True
+
+        async def _recover(symbol, amount, reference, exposed_since, opportunity_id):
+            recovered.append((symbol, amount, reference))
+
+        recovery._recover = _recover
+        execution = ExecutionResult([
+            leg("a", "buy", 1, 100, filled=1, order_id="1"),
+            leg("b", "sell", 1, 101, filled=0.25, status="open", order_id="2"),
+        ])
+        assert await recovery.recover(execution) == []
+        assert not recovered
+        recovery.on_order_done("b", {"id": "2"}, 0.4)
+        await recovery.stop()
+
+    asyncio.run(run())
+    assert recovered == [("BTC/USDT", 0.6, 101)]
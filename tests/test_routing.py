@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+from ceres.exchange.exchange import Exchange
+from ceres.strategy.routing import Venue, route
+
+MARKET = {
+    "id": "BTCUSDT", "symbol": "BTC/USDT", "base": "BTC", "quote": "USDT", "baseId": "BTC", "quoteId": "USDT",
+    "active": True, "spot": True, "type": "spot", "precision": {"amount": 4, "price": 2},
+    "limits": {"amount": {"min": 0.0001}, "cost": {"min": 10}},
+}
+
+
+def levels(best, step, amount=1.0, depth=3):
+    return np.array([[best + step * k, amount] for k in range(depth)])
+
+
+def book(mid, half_spread=0.05):
+    """(asks, bids) venues around mid"""
+    return (
+        Venue(levels(mid + half_spread, 0.05), fee_rate=0.001),
+        Venue(levels(mid - half_spread, -0.05), fee_rate=0.001),
+    )
+
+
+def test_round_amount_truncates_dust_to_zero():
+    exchange = Exchange({"dry": True}, {"name": "binance"})
+    exchange.set_markets({"BTC/USDT": MARKET})
+    # ccxt raises when the amount truncates to 0
+    assert exchange.round_amount("BTC/USDT", 0.00005) == 0
+    assert exchange.round_amount("BTC/USDT", 0.12345) == 0.1234
+    exchange.prepare_orders({"BTC/USDT": MARKET})
+    assert exchange.round_amount("BTC/USDT", 0.00005) == 0
+    assert exchange.round_amount("BTC/USDT", 0.12345) == 0.1234
+
+
+def test_dust_allocation_leaves_the_venue_out():
+    exchange = Exchange({"dry": True}, {"name": "binance"})
+    exchange.set_markets({"BTC/USDT": MARKET})
+    precision = lambda amount: exchange.round_amount("BTC/USDT", amount)
+    a_asks, _ = book(100)
+    _, c_bids = book(101)
+    # Only dust is left on b, below the amount precision of the market
+    dust = Venue(levels(100.05, 0.05, amount=0.00004, depth=1), fee_rate=0.001, precision=precision)
+    routed = route({"a": a_asks._replace(precision=precision), "b": dust}, {"c": c_bids._replace(precision=precision)})
+    assert routed is not None
+    assert {leg.exchange for leg in routed.legs} == {"a", "c"}
+
+
+def test_venue_between_two_others_takes_what_the_outer_ones_cannot():
+    a_asks, _ = book(100)
+    b_asks, b_bids = book(100.5)
+    _, c_bids = book(101)
+    c_bids = c_bids._replace(levels=c_bids.levels[:1])
+    # a -> b and b -> c both pay, c only takes one unit of what a sells
+    routed = route({"a": a_asks, "b": b_asks}, {"b": b_bids, "c": c_bids})
+    assert routed is not None
+    assert {(leg.exchange, leg.side) for leg in routed.legs} == {("a", "buy"), ("b", "sell"), ("c", "sell")}
+    assert routed.profit > 0
+
+
+def test_crossed_venue_is_kept_on_one_side():
+    a_asks, _ = book(100)
+    _, c_bids = book(101)
+    c_bids = c_bids._replace(levels=c_bids.levels[:1])
+    # b quotes a crossed book without fees, the merged curves reach it on both sides
+    b_asks = Venue(levels(100.3, 0.05), fee_rate=0)
+    b_bids = Venue(levels(100.6, -0.05), fee_rate=0)
+    routed = route({"a": a_asks, "b": b_asks}, {"b": b_bids, "c": c_bids})
+    assert routed is not None
+    bought = {leg.exchange for leg in routed.legs if leg.side == "buy"}
+    sold = {leg.exchange for leg in routed.legs if leg.side == "sell"}
+    assert not bought & sold
+    assert "b" in bought | sold
+    assert routed.profit > 0
+    assert math.isclose(routed.amount, sum(leg.amount for leg in routed.legs if leg.side == "sell"))
@@ -0,0 +1,25 @@
+from types import SimpleNamespace
+
+from ceres.remote.telegram import Telegram
+
+
+def message(chat_id, username=None):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id, username=username), chat_id=chat_id)
+
+
+def chat_filter(chat_id):
+    telegram = Telegram.__new__(Telegram)
+    telegram.chat_id = chat_id
+    return telegram._chat_filter()
+
+
+def test_profile_is_limited_to_the_configured_chat():
+    assert chat_filter("123").filter(message(123))
+    assert not chat_filter("123").filter(message(456))
+    assert chat_filter(-100123).filter(message(-100123))
+
+
+def test_channel_username_is_accepted():
+    channel = chat_filter("@mychannel")
+    assert channel.filter(message(-100123, "mychannel"))
+    assert not channel.filter(message(456, "other"))